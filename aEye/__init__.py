@@ -1,4 +1,37 @@
-from .video import Video
-from .labeler import Labeler
-from .extractor import Extractor
-from .auxiliary import Aux
+"""
+aEye loads its classes on first use, so importing the package doesn't import OpenCV, boto3 or static_ffmpeg.
+
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Type checkers and linters see the classes, the package still imports them on first use.
+    from aEye.video import Video
+    from aEye.labeler import Labeler
+    from aEye.extractor import Extractor
+    from aEye.auxiliary import Aux
+    from aEye.async_auxiliary import AsyncAux
+
+_exports = {
+    "Video": ".video",
+    "Labeler": ".labeler",
+    "Extractor": ".extractor",
+    "Aux": ".auxiliary",
+    "AsyncAux": ".async_auxiliary",
+}
+
+__all__ = ["Video", "Labeler", "Extractor", "Aux", "AsyncAux"]
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
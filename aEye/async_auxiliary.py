@@ -0,0 +1,390 @@
+"""
+Module contains the AsyncAux class, the asyncio counterpart of Aux. Every method that would block on ffmpeg,
+ffprobe or S3 is a coroutine, so aEye can be embedded into an event loop without stalling it.
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shlex
+import subprocess
+from aEye.auxiliary import Aux
+from aEye.cache import get_metadata_cache
+from aEye.executables import get_executables
+
+_DONE = object()
+
+
+class AsyncAux:
+    """
+    AsyncAux wraps an Aux and gives it awaitable versions of load_s3, extract_metadata, probe_all,
+    execute_label_and_write_local and upload_s3, with the same parameters and defaults. ffmpeg and ffprobe
+    run through asyncio subprocesses, and the S3 transfers and all other blocking work run in the default
+    executor, so the event loop is never blocked. Every other attribute and method, like load_local or
+    execution_results, is the one of the wrapped Aux.
+
+    Attributes
+    ----------
+        aux: Aux
+            The wrapped Aux, which keeps the results of every call.
+
+    Methods
+    ---------
+        load_s3(bucket, prefix, suffix, start_after, lazy, page_size) -> list[Video]:
+            Awaitable version of Aux.load_s3. With lazy=True an async generator of the videos is returned.
+
+        extract_metadata(video, low_io) -> dict:
+            Awaitable ffprobe of a single video. Fills video.meta_data like Video.extract_metadata.
+
+        probe_all(video_list, max_workers, low_io) -> list[Video]:
+            Awaitable version of Aux.probe_all.
+
+        execute_label_and_write_local(video_list, path, max_workers, lazy, chunks, bucket, prefix, upload_workers,
+                                      transfer_config) -> List[Video]:
+            Awaitable version of Aux.execute_label_and_write_local. If a bucket is given, every output is
+            uploaded as soon as its own encode finishes, while the other encodes are still running.
+
+        upload_s3(video_list, bucket, prefix, max_workers, transfer_config) -> list[dict]:
+            Awaitable version of Aux.upload_s3.
+
+    Examples
+    ---------
+        videos = await aux.load_s3(bucket='aeye-data-bucket', prefix='input_video/')
+
+        await aux.execute_label_and_write_local(videos, max_workers=4, bucket='aeye-data-bucket', prefix='modified/')
+
+    """
+
+    def __init__(self, aux=None):
+        self.aux = aux if aux is not None else Aux()
+
+    def __getattr__(self, name):
+        if name == "aux":
+            raise AttributeError(name)
+        return getattr(self.aux, name)
+
+    def __setattr__(self, name, value):
+        if name == "aux":
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.aux, name, value)
+
+    async def load_s3(self, bucket, prefix, suffix=None, start_after=None, lazy=False, page_size=1000):
+        """
+        This method will load the video files from S3 without blocking the event loop.
+
+        Parameters
+        ----------
+            bucket: string
+                The bucket name to path into S3 to get the video files.
+
+            prefix: string
+                The folder name where the video files belong in the S3 bucket.
+
+            suffix: string or tuple
+                Only load keys ending with this suffix or one of these suffixes, ignoring case.
+
+            start_after: string
+                Only load keys that come after this key.
+
+            lazy: boolean
+                Return an async generator that yields each video as soon as its page is listed, instead of a list.
+
+            page_size: int
+                The number of keys requested per page.
+
+        Returns
+        ----------
+            video_list: list
+                The list of all video files loaded from S3 bucket, or an async generator of them if lazy is set.
+        """
+        if lazy:
+            return self._iter_async(self.aux.load_s3(bucket, prefix, suffix, start_after, True, page_size))
+        return await asyncio.to_thread(self.aux.load_s3, bucket, prefix, suffix, start_after, False, page_size)
+
+    async def _iter_async(self, videos):
+        """
+        This method will turn a generator that blocks on S3 into an async generator, listing every page in
+        the default executor.
+
+        Parameters
+        ----------
+            videos: generator
+                The videos of Aux.load_s3 with lazy set.
+
+        Returns
+        ----------
+            videos: async generator
+                The same videos.
+        """
+        while True:
+            video = await asyncio.to_thread(next, videos, _DONE)
+            if video is _DONE:
+                return
+            yield video
+
+    async def extract_metadata(self, video, low_io=False):
+        """
+        This method will probe the video with ffprobe and store the result in video.meta_data.
+
+        Parameters
+        ----------
+            video: Video
+                The video to probe.
+
+            low_io: boolean
+                Probe S3 videos from ranged GETs of their container index, see Video.extract_metadata.
+
+        Returns
+        ----------
+            meta_data: dictionary
+                The dictionary of metadata for all streams.
+        """
+        if video.meta_data is None and (video.stage is not None or low_io and video.file is None):
+            # Planned videos read the frame index of their source, and the ranged GETs use the blocking S3 client.
+            await asyncio.to_thread(video.extract_metadata, low_io=low_io)
+            return video.meta_data
+        cache = get_metadata_cache()
+        identity = None
+        if video.meta_data is None and cache is not None:
+            identity = await asyncio.to_thread(video.content_identity)
+            if identity is not None:
+                video.meta_data = await asyncio.to_thread(cache.get, identity)
+        if video.meta_data is None:
+            _, probe_path = await asyncio.to_thread(get_executables)
+            source = await asyncio.to_thread(video._probe_source)
+            process = await asyncio.create_subprocess_exec(
+                probe_path, "-hide_banner", "-show_streams", "-v", "error", "-print_format", "json",
+                "-show_format", "-i", source.strip("'"),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            out, err = await process.communicate()
+            if process.returncode != 0:
+                raise subprocess.CalledProcessError(process.returncode, probe_path, out, err)
+            video.meta_data = json.loads(out.decode("utf-8"))
+            if identity is not None:
+                await asyncio.to_thread(cache.put, identity, video.meta_data)
+        return video.meta_data
+
+    async def probe_all(self, video_list, max_workers=16, low_io=False):
+        """
+        This method will probe every video concurrently with up to max_workers ffprobe processes.
+        Failures are kept in probe_errors like Aux.probe_all.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video to probe.
+
+            max_workers: int
+                The maximum amount of ffprobe processes to run at once. Setting this to None uses the
+                default of a ThreadPoolExecutor, like Aux.probe_all.
+
+            low_io: boolean
+                Probe S3 videos from ranged GETs of their container index, see Video.extract_metadata.
+
+        Returns
+        ----------
+            video_list: list
+                The same list of video, with metadata filled in.
+        """
+        semaphore = asyncio.Semaphore(_default_workers(max_workers))
+
+        async def probe(video):
+            async with semaphore:
+                try:
+                    await self.extract_metadata(video, low_io)
+                    return None
+                except Exception as e:
+                    logging.error(f"Cannot probe video {video}: {e}")
+                    return e
+
+        errors = await asyncio.gather(*(probe(video) for video in video_list))
+        self.aux.probe_errors = {video.title: str(error) for video, error in zip(video_list, errors)
+                                 if error is not None}
+
+        logging.info(f"successfully probed {len(video_list) - len(self.aux.probe_errors)} of {len(video_list)} videos")
+        return video_list
+
+    async def execute_label_and_write_local(self, video_list, path=None, max_workers=1, lazy=False, chunks=1,
+                                            bucket=None, prefix='modified/', upload_workers=8, transfer_config=None):
+        """
+        This method will execute and write new videos based on all videos that contain ffmpeg labels.
+        Up to max_workers ffmpeg processes run at once. Lazy plans and chunked encodes work like in
+        Aux.execute_label_and_write_local. If a bucket is given, each output is uploaded to bucket/prefix
+        as soon as its encode succeeds, with up to upload_workers uploads at once.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video that needs to be executed and wrote as output files.
+
+            path: string
+                The path to write the output videos to.
+
+            max_workers: int
+                The maximum amount of ffmpeg processes to run at once. Setting this to None will use
+                one worker per cpu core.
+
+            lazy: boolean
+                Whether to plan the outputs instead of writing them.
+
+            chunks: int
+                The number of keyframe aligned chunks to encode each video in, at once.
+
+            bucket: string
+                The bucket to upload finished outputs to. Nothing is uploaded if this is None.
+
+            prefix: string
+                The subfolder name that the outputs will be uploaded to.
+
+            upload_workers: int
+                The maximum amount of files to upload at once, see Aux.execute_label_and_write_local.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart settings per file, see Aux.upload_s3.
+
+        Returns
+        ----------
+            list_video: list
+                The list of output videos, in the same order as video_list.
+        """
+        path = await asyncio.to_thread(self.aux._resolve_output_path, path)
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if lazy:
+            return await asyncio.to_thread(self.aux._plan_outputs, video_list, path, max_workers)
+
+        ffmpeg, _ = await asyncio.to_thread(get_executables)
+        # Smart cuts, chunked and partial jobs probe their sources while they are built.
+        commands, output_titles, job_of = await asyncio.to_thread(self.aux._prepare_commands, video_list, ffmpeg,
+                                                                  path, chunks)
+        semaphore = asyncio.Semaphore(max_workers)
+        upload_semaphore = asyncio.Semaphore(_default_workers(upload_workers))
+        uploads = [[] for _ in commands]
+
+        async def upload(file):
+            async with upload_semaphore:
+                return await self._upload_file(f"{path}/{file}", bucket, prefix + file, transfer_config)
+
+        async def job(index, command):
+            async with semaphore:
+                process = await self._run_command_async(command)
+            if bucket is not None and process.returncode == 0:
+                files = [file for title, job_index in zip(output_titles, job_of) if job_index == index
+                         for file in self.aux._output_files(path, title)]
+                uploads[index] = await asyncio.gather(*(upload(file) for file in files))
+            return process
+
+        completed = await asyncio.gather(*(job(index, command) for index, command in enumerate(commands)))
+        if bucket is not None:
+            self.aux.upload_results = [result for results in uploads for result in results]
+            self.aux._log_uploads(bucket, prefix)
+        list_video = self.aux._collect_outputs(output_titles, completed, path, job_of)
+        logging.info(f"successfully write the output video files to path: {path}")
+
+        return list_video
+
+    async def upload_s3(self, video_list, bucket, prefix='modified/', max_workers=8, transfer_config=None):
+        """
+        This method will push the modified video list to the S3 bucket, uploading up to max_workers files at once.
+        Frame shards in shard_files are uploaded too, and removed from it once they are uploaded.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video that needs to be uploaded.
+
+            bucket: string
+                The bucket name/path to upload on S3.
+
+            prefix: string
+                The subfolder name that the video list will be uploaded to.
+
+            max_workers: int
+                The maximum amount of files to upload at once. Setting this to None uses the default of a
+                ThreadPoolExecutor, like Aux.upload_s3.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart settings per file, see Aux.upload_s3.
+
+        Returns
+        ----------
+            upload_results: list
+                One dictionary per uploaded file with its key, etag, bytes, duration and error.
+        """
+        folder = self.aux._local_path if self.aux._local_path else self.aux._temp_folder
+        files = await asyncio.to_thread(lambda: [file for video in video_list
+                                                 for file in self.aux._output_files(folder, video.get_output_title())])
+        shards = list(self.aux.shard_files)
+        files += shards
+        semaphore = asyncio.Semaphore(_default_workers(max_workers))
+
+        async def upload(file):
+            async with semaphore:
+                return await self._upload_file(f"{folder}/{file}", bucket, prefix + file, transfer_config)
+
+        self.aux.upload_results = await asyncio.gather(*(upload(file) for file in files))
+
+        self.aux._keep_failed_shards(shards)
+        self.aux._log_uploads(bucket, prefix)
+        return self.aux.upload_results
+
+    async def _run_command_async(self, command):
+        """
+        This method will run a single ffmpeg command as an asyncio subprocess.
+
+        Parameters
+        ----------
+            command: string
+                The ffmpeg command line to run. Callable jobs like smart cuts run in the default executor.
+
+        Returns
+        ----------
+            process: subprocess.CompletedProcess
+                The finished process, with stderr decoded as text.
+        """
+        if callable(command):
+            return await asyncio.to_thread(self.aux._run_command, command)
+        logging.info(command)
+        process = await asyncio.create_subprocess_exec(*shlex.split(command), stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        _, err = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"ffmpeg exited with code {process.returncode}: {command}")
+        return subprocess.CompletedProcess(command, process.returncode, None, err.decode("utf-8", "replace"))
+
+    async def _upload_file(self, file_path, bucket, key, transfer_config=None):
+        """
+        This method will upload one file to S3 in the default executor, see Aux._upload_file.
+
+        Parameters
+        ----------
+            file_path: string
+                The local file to upload.
+
+            bucket: string
+                The bucket name to upload to.
+
+            key: string
+                The S3 key of the uploaded file.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart settings. Defaults to TRANSFER_SETTINGS.
+
+        Returns
+        ----------
+            result: dict
+                The key, etag, bytes and duration of the upload, and the error if it failed.
+        """
+        return await asyncio.to_thread(self.aux._upload_file, file_path, bucket, key, transfer_config)
+
+
+def _default_workers(max_workers):
+    """
+    Returns max_workers, or the number of workers a ThreadPoolExecutor defaults to if it is None.
+    """
+    if max_workers is None:
+        return min(32, (os.cpu_count() or 1) + 4)
+    return max_workers
@@ -3,14 +3,27 @@ Module contains the Aux class that handles the loading and uploading of videos.
 
 """
 
+import copy
+import functools
 import shutil
 from aEye.video import Video
-import boto3
+from aEye.planner import Stage, frames_end, fuse, input_seek, is_terminal, parse_label, pop_seek, root_of, seek_mode_of
+from aEye.smart_cut import run_smart_cut
+from aEye.chunked import is_chunk_safe, run_chunked
+from aEye.cache import get_source_cache
+from aEye.partial_fetch import SOURCE_PLACEHOLDER, run_partial
+from aEye.storage import get_s3_client
+from aEye.executables import get_executables
+import glob
 import tempfile
 import os
 import subprocess
 import logging
-from static_ffmpeg import run
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Outputs above the threshold are uploaded in parts, several parts of a file at once.
+TRANSFER_SETTINGS = dict(multipart_threshold=64 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024, max_concurrency=8)
 
 
 class Aux:
@@ -28,22 +41,44 @@ class Aux:
         _local_path: string
             An internal variable for local folder path.
 
+        execution_results: list
+            The exit code, stderr and command of every ffmpeg job from the last execute, in output order.
+
+        probe_errors: dict
+            The error of every video that could not be probed by the last probe_all, by title.
+
+        upload_results: list
+            The key, ETag, size, duration and error of every file from the last upload, in output order.
+
+        shard_files: list
+            The frame shards and their indexes written by Extractors with shard output, relative to the
+            output folder, that are not uploaded yet. upload_s3 uploads them along with the videos.
+
 
     Methods
     ---------
-        load_s3(bucket, prefix) -> list[Video]:
-            Loads in video files as Video classes into a list from S3.
+        load_s3(bucket, prefix, suffix, start_after, lazy, page_size) -> list[Video]:
+            Loads in video files as Video classes into a list from S3. Every page of the listing is read,
+            and with lazy=True the videos are yielded as each page arrives.
 
         load_local(path) -> list[Video]:
             Loads in video files as Video classes into a list from local machine.
 
-        upload_s3(video_list, bucket, prefix) -> None:
+        probe_all(video_list, max_workers, low_io) -> list[Video]:
+            Probes the metadata of all videos concurrently, so labels don't wait on one ffprobe at a time.
+            With low_io, S3 videos are probed from ranged GETs of their index only.
+
+        upload_s3(video_list, bucket, prefix, max_workers, transfer_config) -> list[dict]:
             Uploads the contents of the temp folder to S3. Bucket can be specifed, and the prefix is the path
-            to the folder within that bucket where the output videos should end up.
+            to the folder within that bucket where the output videos should end up. Files are uploaded
+            concurrently, large files in parts, and the result of every upload is returned.
 
-        execute_label_and_write_local(video_list) -> List[Video]:
+        execute_label_and_write_local(video_list, path, max_workers, lazy, chunks, bucket, prefix, upload_workers,
+                                      transfer_config) -> List[Video]:
             Super important function to execute any pending labels on video list. This is how the FFmpeg
             command is run, and if further processing is needed, it returns a processed video list.
+            Setting max_workers above 1 runs that many FFmpeg processes at once. If a bucket is given,
+            every output is uploaded as soon as its own encode finishes, with up to upload_workers uploads at once.
 
         clean() -> None:
             Removes the temp directory and anything within it. Really useful for a debug, and everything
@@ -57,12 +92,20 @@ class Aux:
         load_s3(bucket='aeye-data-bucket', prefix='input_video/') -> Loads everything from the aEye data bucket in the input_video
         directory.
 
+        load_s3('aeye-data-bucket', 'input_video/', suffix='.mp4', lazy=True) -> Yields the mp4 files page by page
+
         load_local('/documents/testVid.mp4') -> Loads video directly from the local file location
 
+        probe_all(video_list, max_workers=32) -> Probes up to 32 videos at once
+
         upload_s3(modified_video_list, 'aeye-data-bucket', 'output_videos/')
 
         execute_label_and_write_local(list_of_videos) -> Executes the pending labels for all video objects in the list
 
+        execute_label_and_write_local(list_of_videos, max_workers=8) -> Same as above, with up to 8 ffmpeg jobs at once
+
+        execute_label_and_write_local([long_video], chunks=16) -> Encodes one long video as 16 chunks at once
+
         clean() -> Cleans the temp folder
 
         set_local_path(cur_path) -> sets the local path to whatever you pass it. Unlikely a user will need this
@@ -70,14 +113,33 @@ class Aux:
     """
 
     def __init__(self):
-        self._s3 = boto3.client('s3')
+        self._client = None
         self._temp_folder = None
         self._local_path = None
+        self.execution_results = []
+        self.probe_errors = {}
+        self.upload_results = []
+        self.shard_files = []
+
+    @property
+    def _s3(self):
+        """
+        The S3 client of this Aux. The shared client is only looked up once S3 is used, so local work
+        never imports boto3.
+        """
+        if self._client is None:
+            self._client = get_s3_client()
+        return self._client
 
-    def load_s3(self, bucket, prefix):
+    @_s3.setter
+    def _s3(self, client):
+        self._client = client
+
+    def load_s3(self, bucket, prefix, suffix=None, start_after=None, lazy=False, page_size=1000):
         """
         This method will load the video files from S3 and return them
-        into a list of video classes.
+        into a list of video classes. Every page of the listing is requested, so prefixes with more
+        than 1000 objects are loaded completely.
 
          Parameters
         ----------
@@ -86,33 +148,82 @@ class Aux:
             The bucket name to path into S3 to get the video files.
         prefix: string
             The folder name where the video files belong in the S3 bucket.
+        suffix: string or tuple
+            Only load keys ending with this suffix or one of these suffixes, ignoring case (ex. ('.mp4', '.mov')).
+        start_after: string
+            Only load keys that come after this key, to resume an interrupted listing.
+        lazy: boolean
+            Return a generator that yields each video as soon as its page is listed, instead of a list.
+        page_size: int
+            The number of keys requested per page.
 
         Returns
         ----------
 
         video_list: list
-            The list of all video files loaded from S3 bucket.
+            The list of all video files loaded from S3 bucket, or a generator of them if lazy is set.
         """
 
-        video_list = []
-        result = self._s3.list_objects(Bucket=bucket, Prefix=prefix)
-        for i in result["Contents"]:
-            # When we request from S3 with the input parameters, the prefix folder will also pop up as a object.
-            # This if-statement is to skip over the folder object since we are only interested in the video files.
-            if i["Key"] == prefix:
-                continue
-
-            title = i["Key"].split(prefix)[1]
-            new_video = Video(bucket=bucket, key=i["Key"], title=title)
-            if self._local_path is None:
-                new_video.path = self._temp_folder
-            else:
-                new_video.path = self._local_path
-            video_list.append(new_video)
+        videos = self._iter_s3(bucket, prefix, suffix, start_after, page_size)
+        if lazy:
+            return videos
+        video_list = list(videos)
         logging.info(f"successfully load the video files from S3 bucket: s3://{bucket}/{prefix}/")
 
         return video_list
 
+    def _iter_s3(self, bucket, prefix, suffix, start_after, page_size):
+        """
+        This method will list the video files in S3 page by page with list_objects_v2 and yield them
+        as video classes. The next page is only requested once every video of the current page is consumed.
+
+        Parameters
+        ----------
+            bucket: string
+                The bucket name to path into S3 to get the video files.
+
+            prefix: string
+                The folder name where the video files belong in the S3 bucket.
+
+            suffix: string or tuple
+                The key suffixes to keep, or None to keep every key.
+
+            start_after: string
+                The key to start listing after, or None.
+
+            page_size: int
+                The number of keys requested per page.
+
+        Returns
+        ----------
+            videos: generator
+                The video files of the S3 bucket, in key order.
+        """
+        if isinstance(suffix, str):
+            suffix = (suffix,)
+        if suffix is not None:
+            suffix = tuple(s.lower() for s in suffix)
+        params = {"Bucket": bucket, "Prefix": prefix, "PaginationConfig": {"PageSize": page_size}}
+        if start_after is not None:
+            params["StartAfter"] = start_after
+
+        for page in self._s3.get_paginator("list_objects_v2").paginate(**params):
+            for i in page.get("Contents", []):
+                # When we request from S3 with the input parameters, the prefix folder will also pop up as a object.
+                # This if-statement is to skip over the folder object since we are only interested in the video files.
+                if i["Key"] == prefix:
+                    continue
+                if suffix is not None and not i["Key"].lower().endswith(suffix):
+                    continue
+
+                title = i["Key"].split(prefix)[1]
+                new_video = Video(bucket=bucket, key=i["Key"], title=title)
+                if self._local_path is None:
+                    new_video.path = self._temp_folder
+                else:
+                    new_video.path = self._local_path
+                yield new_video
+
     def load_local(self, path):
         """
         This method will load the video files from the given path parameters.
@@ -152,9 +263,51 @@ class Aux:
         logging.info(f"successfully load the video files from local path: {path}")
         return video_list
 
-    def upload_s3(self, video_list, bucket, prefix='modified/'):
+    def probe_all(self, video_list, max_workers=16, low_io=False):
         """
-        This method will push modified video list to the S3 bucket and delete all video files from local temp folder.
+        This method will fill in the metadata of every video at once, instead of one blocking ffprobe per
+        video when the labels first need it. A video that can't be probed keeps meta_data as None, and its
+        error is kept in probe_errors under its title.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video to probe.
+
+            max_workers: int
+                The maximum amount of ffprobe processes to run at once.
+
+            low_io: boolean
+                Probe S3 videos from ranged GETs of their container index instead of the whole object.
+
+        Returns
+        ----------
+            video_list: list
+                The same list of video, with metadata filled in.
+        """
+
+        def probe(video):
+            try:
+                video.extract_metadata(low_io=low_io)
+                return None
+            except Exception as e:
+                logging.error(f"Cannot probe video {video}: {e}")
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            errors = list(pool.map(probe, video_list))
+        self.probe_errors = {video.title: str(error) for video, error in zip(video_list, errors) if error is not None}
+
+        logging.info(f"successfully probed {len(video_list) - len(self.probe_errors)} of {len(video_list)} videos")
+        return video_list
+
+    def upload_s3(self, video_list, bucket, prefix='modified/', max_workers=8, transfer_config=None):
+        """
+        This method will push modified video list to the S3 bucket. Up to max_workers files are uploaded
+        at once with the client of this Aux, and files above the multipart threshold are sent in parts.
+        A file that fails to upload doesn't stop the others, its error is kept in its result.
+        Frame shards in shard_files are uploaded too, so aux.upload_s3([], bucket) uploads only the shards.
+        Uploaded shards are removed from shard_files, so the next call only retries the ones that failed.
 
         Parameters
         ----------
@@ -167,22 +320,145 @@ class Aux:
             prefix: string
                 The subfolder name that the video list will be uploaded to.
 
+            max_workers: int
+                The maximum amount of files to upload at once.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart threshold, part size and concurrency per file. Defaults to TRANSFER_SETTINGS.
+
+        Returns
+        ----------
+            upload_results: list
+                One dictionary per uploaded file with its key, etag, bytes, duration and error.
         """
 
-        s3 = boto3.client('s3')
-        for video in video_list:
-            if not self._local_path:
-                path = self._temp_folder + '/' + video.get_output_title()
-            else:
-                path = self._local_path + '/' + video.get_output_title()
-            s3.upload_file(path, bucket, prefix + video.get_output_title())
+        folder = self._local_path if self._local_path else self._temp_folder
+        files = [file for video in video_list for file in self._output_files(folder, video.get_output_title())]
+        shards = list(self.shard_files)
+        files += shards
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            self.upload_results = list(pool.map(
+                lambda file: self._upload_file(f"{folder}/{file}", bucket, prefix + file, transfer_config), files))
+
+        self._keep_failed_shards(shards)
+        self._log_uploads(bucket, prefix)
+        return self.upload_results
+
+    def _keep_failed_shards(self, shards):
+        """
+        This method will remove the shards that the last upload sent from shard_files. Their results are the
+        last ones in upload_results.
 
-        logging.info(f"successfully upload the output files S3 bucket: s3://{bucket}/{prefix}/")
+        Parameters
+        ----------
+            shards: list
+                The shards that were uploaded, in upload order.
+        """
+        results = self.upload_results[len(self.upload_results) - len(shards):]
+        uploaded = {file for file, result in zip(shards, results) if result["error"] is None}
+        self.shard_files = [file for file in self.shard_files if file not in uploaded]
 
-    def execute_label_and_write_local(self, video_list, path=None):
+    def _log_uploads(self, bucket, prefix):
+        """
+        This method will log the outcome of the last upload, with an error that names every file that failed.
+
+        Parameters
+        ----------
+            bucket: string
+                The bucket name that was uploaded to.
+
+            prefix: string
+                The subfolder name that the files were uploaded to.
+        """
+        failed = [result["key"] for result in self.upload_results if result["error"] is not None]
+        if failed:
+            logging.error(f"{len(failed)} of {len(self.upload_results)} files failed to upload to "
+                          f"s3://{bucket}/{prefix}: {', '.join(failed)}")
+        else:
+            logging.info(f"successfully upload the output files S3 bucket: s3://{bucket}/{prefix}/")
+
+    def _output_files(self, folder, title):
+        """
+        This method will list the files an output title stands for. Segmented outputs have a %02d
+        pattern in their title and stand for every numbered segment.
+
+        Parameters
+        ----------
+            folder: string
+                The folder that the outputs were written to.
+
+            title: string
+                The output title.
+
+        Returns
+        ----------
+            files: list
+                The file names, relative to folder.
+        """
+        if '%02d' not in title:
+            return [title]
+        pattern = glob.escape(title).replace('%02d', '[0-9]' * 2)
+        return sorted(os.path.relpath(file, folder) for file in glob.glob(f"{folder}/{pattern}"))
+
+    def _upload_file(self, file_path, bucket, key, transfer_config=None):
+        """
+        This method will upload one file to S3 and describe the result.
+
+        Parameters
+        ----------
+            file_path: string
+                The local file to upload.
+
+            bucket: string
+                The bucket name to upload to.
+
+            key: string
+                The S3 key of the uploaded file.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart settings. Defaults to TRANSFER_SETTINGS.
+
+        Returns
+        ----------
+            result: dict
+                The key, etag, bytes and duration of the upload, and the error if it failed.
+        """
+        result = {"file": file_path, "key": key, "etag": None, "bytes": None, "duration": None, "error": None}
+        start = time.perf_counter()
+        try:
+            result["bytes"] = os.path.getsize(file_path)
+            if transfer_config is None:
+                from boto3.s3.transfer import TransferConfig
+                transfer_config = TransferConfig(**TRANSFER_SETTINGS)
+            self._s3.upload_file(file_path, bucket, key, Config=transfer_config)
+            result["etag"] = self._s3.head_object(Bucket=bucket, Key=key)["ETag"]
+        except Exception as e:
+            logging.error(f"Cannot upload {file_path} to s3://{bucket}/{key}: {e}")
+            result["error"] = str(e)
+        result["duration"] = time.perf_counter() - start
+        return result
+
+    def execute_label_and_write_local(self, video_list, path=None, max_workers=1, lazy=False, chunks=1, bucket=None,
+                                      prefix='modified/', upload_workers=8, transfer_config=None):
         """
         This method will execute and write new videos based on all videos that contain ffmpeg labels.
         This will default write the output video into a temp folder unless the user provide a local path.
+        When max_workers is greater than 1, the ffmpeg jobs run concurrently in a bounded worker pool.
+        The output list keeps the order of the input list either way, and the exit code and stderr of
+        every job are kept in execution_results.
+
+        With lazy set, nothing is run. The returned videos are planned videos that can take more labels,
+        and the next non-lazy execute runs each whole chain as a single ffmpeg pass over the original source.
+        Videos with segment or raw labels can't be read back, so they are always run right away.
+
+        With chunks above 1, every video is split on its keyframes into up to that many chunks, which are
+        encoded by separate ffmpeg processes at once and joined again. This speeds up single long videos.
+        Videos with labels that aren't chunk safe, like trims, fps changes or segmenting, run as one process.
+
+        With a bucket, every output is uploaded to bucket/prefix as soon as its own encode succeeds, while
+        the other encodes are still running. Uploads run on their own pool of upload_workers threads, with the
+        same transfer_config as upload_s3. The results are kept in upload_results. Planned outputs of a
+        lazy execute are not written, so they are not uploaded either.
 
         Parameters
         ----------
@@ -192,8 +468,130 @@ class Aux:
             path: string
                 The path to write the output videos to.
 
+            max_workers: int
+                The maximum amount of ffmpeg processes to run at once. Setting this to None will use
+                one worker per cpu core.
+
+            lazy: boolean
+                Whether to plan the outputs instead of writing them.
+
+            chunks: int
+                The number of keyframe aligned chunks to encode each video in, at once.
+
+            bucket: string
+                The bucket to upload finished outputs to. Nothing is uploaded if this is None.
+
+            prefix: string
+                The subfolder name that the outputs will be uploaded to.
+
+            upload_workers: int
+                The maximum amount of files to upload at once. Setting this to None uses the default of a
+                ThreadPoolExecutor.
+
+            transfer_config: boto3.s3.transfer.TransferConfig
+                The multipart settings per file, see upload_s3.
+
+        Returns
+        ----------
+            list_video: list
+                The list of output videos, in the same order as video_list.
+
+        """
+
+        path = self._resolve_output_path(path)
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if lazy:
+            return self._plan_outputs(video_list, path, max_workers)
+
+        ffmpeg, probe_path = get_executables()
+        commands, output_titles, job_of = self._prepare_commands(video_list, ffmpeg, path, chunks)
+        upload_pool = ThreadPoolExecutor(max_workers=upload_workers) if bucket is not None else None
+        uploads = [[] for _ in commands]
+
+        def run_job(index):
+            process = self._run_command(commands[index])
+            if upload_pool is not None and process.returncode == 0:
+                for title in (title for title, job in zip(output_titles, job_of) if job == index):
+                    uploads[index] += [upload_pool.submit(self._upload_file, f"{path}/{file}", bucket, prefix + file,
+                                                          transfer_config)
+                                       for file in self._output_files(path, title)]
+            return process
+
+        try:
+            if max_workers > 1 and len(commands) > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    completed = list(pool.map(run_job, range(len(commands))))
+            else:
+                completed = [run_job(index) for index in range(len(commands))]
+        finally:
+            if upload_pool is not None:
+                upload_pool.shutdown()
+        if upload_pool is not None:
+            self.upload_results = [future.result() for futures in uploads for future in futures]
+            self._log_uploads(bucket, prefix)
+
+        list_video = self._collect_outputs(output_titles, completed, path, job_of)
+        logging.info(f"successfully write the output video files to path: {path}")
+
+        return list_video
+
+    def _plan_outputs(self, video_list, path, max_workers):
+        """
+        This method will turn the pending labels of every video into a Stage and return planned videos
+        instead of running ffmpeg. Videos with terminal labels are executed right away.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video to plan.
+
+            path: string
+                The folder that the outputs will be written to once executed.
+
+            max_workers: int
+                The maximum amount of ffmpeg processes for the videos that run right away.
+
+        Returns
+        ----------
+            list_video: list
+                The planned and executed videos, in the same order as video_list.
+        """
+        list_video = [None] * len(video_list)
+        run_now = [i for i, video in enumerate(video_list) if is_terminal(video.get_label())]
+        if run_now:
+            executed = self.execute_label_and_write_local([video_list[i] for i in run_now], path, max_workers)
+            for i, video in zip(run_now, executed):
+                list_video[i] = video
+
+        for i, video in enumerate(video_list):
+            if list_video[i] is not None:
+                continue
+            stage = Stage(video, video.get_label(), video.complex_filter)
+            title = video.get_output_title()
+            video.reset_label()
+            new_video = Video(f'{path}/{title}', title=f'{title}')
+            new_video.path = path
+            new_video.stage = stage
+            list_video[i] = new_video
+
+        logging.info(f"successfully planned the output video files for path: {path}")
+        return list_video
+
+    def _resolve_output_path(self, path):
         """
+        This method will pick the folder that executed videos are written to.
 
+        Parameters
+        ----------
+            path: string
+                The path given by the user, or None.
+
+        Returns
+        ----------
+            path: string
+                The output folder.
+        """
         # If the user prompts this method with a specific path, then this will save it into the internal variable.
         # This will check if there exists an local path internal. If there exists, then we will write video files there.
         if path is None:
@@ -204,35 +602,350 @@ class Aux:
                 path = self._temp_folder
         else:
             self.set_local_path(path)
+        return path
 
-        list_video = []
-        ffmpeg, probe_path = run.get_or_fetch_platform_executables_else_raise()
-        for video in video_list:
-            if video.out == '':
-                source = video.get_presigned_url()
+    def _prepare_commands(self, video_list, ffmpeg, path, chunks=1):
+        """
+        This method will turn the pending labels of every video into an ffmpeg command.
+        Planned videos that branch from the same source are put into one fan-out command, so the
+        source is only decoded once for all of them.
+        Building the commands mutates the video labels and titles, so it always runs serially.
+
+        Parameters
+        ----------
+            video_list: list
+                The list of video that needs to be executed.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output videos will be written to.
+
+            chunks: int
+                The number of chunks to encode chunk safe videos in.
+
+        Returns
+        ----------
+            commands: list
+                One ffmpeg command per job. Smart cuts, chunked transcodes and partial fetches are
+                callables that run their own commands.
+
+            output_titles: list
+                One output title per video.
+
+            job_of: list
+                The index of the command that writes each video.
+        """
+        groups = {}
+        for i, video in enumerate(video_list):
+            if video.stage is not None and not is_terminal(video.get_label()):
+                groups.setdefault(id(root_of(video)), []).append(i)
             else:
-                source = video.out
-            if len(video.complex_filter) > 0:
-                video.create_complex_filter(video)
-            video.get_output_title()
-            command = f"{ffmpeg} -y -i {source} {video.get_label()} {path}/{video.get_output_title()}"
-            subprocess.run(command, shell=True)
-            logging.info(command)
-            #print(command)  # REALLY useful for debug
-            new_path = video.get_output_title()
-            video.reset_label()
-            new_video = Video(f'{path}/{video.get_output_title()}', title=f'{video.get_output_title()}')
+                groups[('single', i)] = [i]
+
+        commands = []
+        output_titles = [None] * len(video_list)
+        job_of = [None] * len(video_list)
+        for members in sorted(groups.values()):
+            videos = [video_list[i] for i in members]
+            if len(videos) == 1:
+                commands.append(self._build_smart_cut(videos[0], ffmpeg, path) or
+                                self._build_chunked(videos[0], ffmpeg, path, chunks) or
+                                self._build_partial(videos[0], ffmpeg, path) or
+                                self._build_command(videos[0], ffmpeg, path))
+            else:
+                commands.append(self._build_fanout_command(videos, ffmpeg, path))
+            for i, video in zip(members, videos):
+                output_titles[i] = video.get_output_title()
+                job_of[i] = len(commands) - 1
+                video.reset_label()
+        return commands, output_titles, job_of
+
+    def _collect_outputs(self, output_titles, completed, path, job_of):
+        """
+        This method will record the finished ffmpeg jobs and create the output videos.
+
+        Parameters
+        ----------
+            output_titles: list
+                One output title per video.
+
+            completed: list
+                One subprocess.CompletedProcess per job.
+
+            path: string
+                The folder that the output videos were written to.
+
+            job_of: list
+                The index of the job that wrote each video.
+
+        Returns
+        ----------
+            list_video: list
+                The output videos, in the same order as output_titles.
+        """
+        list_video = []
+        self.execution_results = []
+        for title, job in zip(output_titles, job_of):
+            process = completed[job]
+            self.execution_results.append({
+                "title": title,
+                "command": process.args,
+                "returncode": process.returncode,
+                "stderr": process.stderr,
+            })
+            new_video = Video(f'{path}/{title}', title=f'{title}')
             new_video.path = path
-            new_video.set_output(f"'{path}/{new_path}'")
+            new_video.set_output(f"'{path}/{title}'")
             list_video.append(new_video)
+        return list_video
 
-        logging.info(f"successfully write the output video files to path: {path}")
+    def _build_smart_cut(self, video, ffmpeg, path):
+        """
+        This method will create a smart-cut job for a video whose only pending label is a smart-cut trim.
+        Videos with any other label have to be re-encoded anyway, so they get no job.
 
-        return list_video
+        Parameters
+        ----------
+            video: Video
+                The video to cut.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output video will be written to.
+
+        Returns
+        ----------
+            job: callable
+                A function that runs the smart cut and returns a subprocess.CompletedProcess, or None.
+        """
+        if not video.smart_cut or video.stage is not None or video.complex_filter:
+            return None
+        start, duration, frames, options = parse_label(video.get_label())
+        if options:
+            logging.info(f"Video {video} has labels other than a trim, so it is fully re-encoded")
+            return None
+
+        end = None
+        if duration is not None:
+            end = start + duration
+        if frames is not None:
+            end = min(end, frames_end(video, start, frames)) if end is not None else frames_end(video, start, frames)
+        # The job runs later, after the output title has been written into video.out, so it gets a snapshot.
+        return functools.partial(run_smart_cut, ffmpeg, copy.copy(video), start, end,
+                                 f"{path}/{video.get_output_title()}")
+
+    def _build_chunked(self, video, ffmpeg, path, chunks):
+        """
+        This method will create a chunked transcode job for a video whose labels are all chunk safe.
+
+        Parameters
+        ----------
+            video: Video
+                The video to transcode.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output video will be written to.
+
+            chunks: int
+                The number of chunks to encode at once.
+
+        Returns
+        ----------
+            job: callable
+                A function that runs the chunked transcode and returns a subprocess.CompletedProcess, or None.
+        """
+        if chunks <= 1 or video.stage is not None:
+            return None
+        if not is_chunk_safe(video.get_label(), video.complex_filter):
+            logging.info(f"Video {video} has labels that are not chunk safe, so it runs as a single process")
+            return None
+
+        keep_audio = len(video.complex_filter) == 0
+        source = copy.copy(video)
+        if not keep_audio:
+            video.create_complex_filter(video)
+        return functools.partial(run_chunked, ffmpeg, source, video.get_label(), keep_audio,
+                                 f"{path}/{video.get_output_title()}", chunks)
+
+    def _build_partial(self, video, ffmpeg, path):
+        """
+        This method will create a job that fetches only the trimmed part of an S3 video and runs the
+        command on that partial copy. Only videos trimmed by a Labeler with partial_fetch get one.
+
+        Parameters
+        ----------
+            video: Video
+                The video to trim.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output video will be written to.
+
+        Returns
+        ----------
+            job: callable
+                A function that fetches the cut, runs the command and returns a subprocess.CompletedProcess,
+                or None.
+        """
+        if not video.partial_fetch or video.file is not None or video.stage is not None or video.out != '':
+            return None
+        # The partial copy only has data around the cut, so the input has to seek straight to it.
+        if seek_mode_of(video) is None or get_source_cache() is not None or video.get_label().count('-ss ') != 1:
+            return None
+        start, duration, frames, options = parse_label(video.get_label())
+        if duration is not None:
+            end = start + duration
+        elif frames is not None:
+            end = frames_end(video, start, frames)
+        else:
+            end = float(video.get_duration())
+        source = copy.copy(video)
+        return functools.partial(run_partial, self._s3, source, start, end,
+                                 self._build_command(video, ffmpeg, path, SOURCE_PLACEHOLDER))
+
+    def _build_fanout_command(self, video_list, ffmpeg, path):
+        """
+        This method will create one ffmpeg command that writes several planned videos of the same source.
+        The filter steps that all branches share run once, then a split filter feeds every branch,
+        and each branch is mapped to its own output with its own trims and encode options.
+
+        Parameters
+        ----------
+            video_list: list
+                Planned videos that share the same source.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output videos will be written to.
+
+        Returns
+        ----------
+            command: string
+                The full ffmpeg command line.
+        """
+        fused = [fuse(video) for video in video_list]
+        root = fused[0][0]
+        source = root.get_presigned_url() if root.out == '' else root.out
+        chains = [[step.strip() for step in filters] for _, _, filters in fused]
+
+        trunk = []
+        for steps in zip(*chains):
+            if any(step != steps[0] for step in steps):
+                break
+            trunk.append(steps[0])
+
+        # Branches can only share an input seek up to the earliest start among them. The rest of each
+        # start stays on the output side of its branch.
+        labels = [label for _, label, _ in fused]
+        input_label = ''
+        seek_mode = seek_mode_of(video_list[0])
+        starts = [pop_seek(label)[0] for label in labels]
+        if seek_mode is not None and None not in starts and min(starts) > 0:
+            shared = min(starts)
+            input_label = input_seek(shared, seek_mode)
+            for i, (start, label) in enumerate(zip(starts, labels)):
+                remainder = round(start - shared, 6)
+                labels[i] = pop_seek(label)[1] + (f"-ss {remainder} " if remainder > 0 else "")
+
+        graph = []
+        split_input = "0:v"
+        if trunk:
+            graph.append(f"[0:v]{','.join(trunk)}[trunk]")
+            split_input = "trunk"
+        graph.append(f"[{split_input}]split={len(video_list)}" + "".join(f"[s{i}]" for i in range(len(video_list))))
+
+        outputs = ""
+        for i, (video, label, steps) in enumerate(zip(video_list, labels, chains)):
+            branch = steps[len(trunk):]
+            graph.append(f"[s{i}]{','.join(branch) if branch else 'null'}[o{i}]")
+            # Like a single execute, filtered outputs only keep the video stream.
+            audio = "" if steps else "-map 0:a? "
+            video.get_output_title()
+            outputs += f"-map [o{i}] {audio}{label}{path}/{video.get_output_title()} "
+
+        return f"{ffmpeg} -y {input_label}-i {source} -filter_complex '{';'.join(graph)}' {outputs.strip()}"
+
+    def _build_command(self, video, ffmpeg, path, source=None):
+        """
+        This method will create the ffmpeg command that executes all pending labels of a video.
+
+        Parameters
+        ----------
+            video: Video
+                The video whose labels are turned into a command.
+
+            ffmpeg: string
+                The path to the ffmpeg executable.
+
+            path: string
+                The folder that the output video will be written to.
+
+            source: string
+                The input to read instead of the location of the video.
+
+        Returns
+        ----------
+            command: string
+                The full ffmpeg command line.
+        """
+        if video.stage is not None:
+            # Planned videos read straight from the original source, with every stage fused into one pass.
+            root, video.label, video.complex_filter = fuse(video)
+            source = root.get_presigned_url() if root.out == '' else root.out
+        elif source is None:
+            source = video.get_presigned_url() if video.out == '' else video.out
+
+        # Seeking before -i lets the demuxer jump to a keyframe instead of decoding everything before the start.
+        input_label = ''
+        seek_mode = seek_mode_of(video)
+        if seek_mode is not None:
+            start, video.label = pop_seek(video.label)
+            if start is not None:
+                input_label = input_seek(start, seek_mode)
+        if len(video.complex_filter) > 0:
+            video.create_complex_filter(video)
+        video.get_output_title()
+        return f"{ffmpeg} -y {input_label}-i {source} {video.get_label()} {path}/{video.get_output_title()}"
+
+    def _run_command(self, command):
+        """
+        This method will run a single ffmpeg command and capture its exit code and stderr.
+
+        Parameters
+        ----------
+            command: string
+                The ffmpeg command line to run, or a callable job that runs its own commands.
+
+        Returns
+        ----------
+            process: subprocess.CompletedProcess
+                The finished process, with stderr decoded as text.
+        """
+        if callable(command):
+            process = command()
+        else:
+            logging.info(command)
+            #print(command)  # REALLY useful for debug
+            process = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                     text=True, errors="replace")
+        if process.returncode != 0:
+            logging.error(f"ffmpeg exited with code {process.returncode}: {process.args}")
+        return process
 
     def clean(self, path=None):
         """
-        This method will delete the temp folder and all video files in it from local machine.
+        This method will delete the temp folder and all video, image and shard files in it from local machine.
 
         Parameters
         ----------
@@ -245,15 +958,9 @@ class Aux:
         if path is None:
             path = self._local_path if self._local_path else self._temp_folder
 
-        try:
-            for (path, _, files) in os.walk(path, topdown=True):
-                for video in files:
-                    os.remove(f'{path}/{video}')
-        except Exception as e:
-            print(e)
-        finally:
-            shutil.rmtree(path)
-
+        # rmtree removes the folder in one pass, without walking it first.
+        shutil.rmtree(path)
+        self.shard_files = []
 
         logging.info("successfully remove the temp folder from local machine")
 
@@ -0,0 +1,421 @@
+"""
+Module contains the MetadataCache class, an on-disk cache of ffprobe results shared by every process on a machine,
+and the SourceCache class, an on-disk cache of the S3 objects themselves.
+
+Entries are keyed by the identity of the content rather than by its location: bucket, key, ETag and size for
+S3 objects, and path, modification time and size for local files. A changed object gets a new key, so
+stale entries are never returned. The caches are off until enable_metadata_cache or enable_source_cache
+is called, or the AEYE_METADATA_CACHE or AEYE_SOURCE_CACHE environment variable points at a location.
+
+"""
+
+import collections
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+_metadata_cache = None
+_source_cache = None
+
+# Objects are downloaded as ranged GETs of this size, several at once.
+DOWNLOAD_SETTINGS = dict(multipart_threshold=16 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024, max_concurrency=8)
+
+# A cached object is served without asking S3 for its ETag again for this many seconds.
+ETAG_SECONDS = 60
+
+
+class MetadataCache:
+    """
+    MetadataCache stores JSON values in a SQLite database with a size limit. When the limit is passed,
+    the least recently used entries are evicted first. Every operation opens its own connection, so one
+    cache can be used from several threads and processes at once.
+
+    Attributes
+    ----------
+        path: string
+            The database file.
+
+        max_bytes: int
+            The total size of all stored values that triggers eviction.
+
+    Methods
+    ---------
+        get(identity, kind) -> dict:
+            Returns the stored value, or None if there is none.
+
+        put(identity, value, kind) -> None:
+            Stores a value and evicts old entries if the cache is over its limit.
+
+        clear() -> None:
+            Removes every entry.
+
+    """
+
+    def __init__(self, path=None, max_bytes=64 * 1024 * 1024):
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "aEye", "metadata.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, size INTEGER, "
+                       "accessed REAL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Opens a connection to the database that commits and closes when the block ends.
+
+        Returns
+        ----------
+            db: sqlite3.Connection
+                The open connection.
+        """
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, identity, kind="metadata"):
+        """
+        Looks up a value and marks it as recently used.
+
+        Parameters
+        ----------
+            identity: string
+                The content identity of the video.
+
+            kind: string
+                What the value is, so several kinds of values can be kept per video.
+
+        Returns
+        ----------
+            value: dict
+                The stored value, or None.
+        """
+        key = f"{kind}:{identity}"
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, identity, value, kind="metadata"):
+        """
+        Stores a value, then evicts the least recently used entries until the cache fits in max_bytes.
+
+        Parameters
+        ----------
+            identity: string
+                The content identity of the video.
+
+            value: dict
+                A JSON serializable value.
+
+            kind: string
+                What the value is.
+
+        """
+        data = json.dumps(value)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                       (f"{kind}:{identity}", data, len(data), time.time()))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                rows = db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+                logging.info(f"Evicted {len(evicted)} entries from the metadata cache")
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+
+
+def enable_metadata_cache(path=None, max_bytes=64 * 1024 * 1024):
+    """
+    Turns on the metadata cache for every video in this process.
+
+    Parameters
+    ----------
+        path: string
+            The database file. Defaults to ~/.cache/aEye/metadata.sqlite.
+
+        max_bytes: int
+            The size limit of the cache.
+
+    Returns
+    ----------
+        cache: MetadataCache
+            The cache that is now in use.
+    """
+    global _metadata_cache
+    _metadata_cache = MetadataCache(path, max_bytes)
+    return _metadata_cache
+
+
+def disable_metadata_cache():
+    """
+    Turns off the metadata cache. The database file is kept.
+    """
+    global _metadata_cache
+    _metadata_cache = None
+
+
+def get_metadata_cache():
+    """
+    Returns the metadata cache in use, creating it from AEYE_METADATA_CACHE the first time if that is set.
+
+    Returns
+    ----------
+        cache: MetadataCache
+            The cache, or None if caching is off.
+    """
+    global _metadata_cache
+    if _metadata_cache is None and os.environ.get("AEYE_METADATA_CACHE"):
+        _metadata_cache = MetadataCache(os.environ["AEYE_METADATA_CACHE"])
+    return _metadata_cache
+
+
+class SourceCache:
+    """
+    SourceCache keeps local copies of S3 objects in a folder with a size limit, so every consumer of a video
+    reads the object from S3 only once. Files are named after the hash of bucket, key and ETag, and are
+    downloaded with concurrent ranged GETs. The GETs are pinned to the version of the object if the bucket
+    is versioned, otherwise the ETag is checked again once the download is done, so a file never holds other
+    content than its name says. The ETag of an object is looked up at most once every ETAG_SECONDS, so hits
+    don't cost a request each. When the limit is passed, the least recently used files are removed first.
+
+    Attributes
+    ----------
+        path: string
+            The cache folder.
+
+        max_bytes: int
+            The total size of all cached objects that triggers eviction.
+
+        transfer_config: boto3.s3.transfer.TransferConfig
+            The part size and concurrency of the ranged GETs.
+
+    Methods
+    ---------
+        fetch(client, bucket, key) -> string:
+            Returns the local copy of an object, downloading it first if needed.
+
+        clear() -> None:
+            Removes every cached object.
+
+    """
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024 * 1024, transfer_config=None):
+        if path is None:
+            path = os.path.join(os.path.expanduser("~"), ".cache", "aEye", "sources")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        if transfer_config is None:
+            from boto3.s3.transfer import TransferConfig
+            transfer_config = TransferConfig(**DOWNLOAD_SETTINGS)
+        self.transfer_config = transfer_config
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._checked = collections.OrderedDict()
+
+    def fetch(self, client, bucket, key):
+        """
+        Returns the path of the local copy of an object and marks it as recently used.
+        Threads that ask for the same object at once share one download.
+        An object that was checked in the last ETAG_SECONDS is returned without asking S3 for its ETag.
+
+        Parameters
+        ----------
+            client: botocore client
+                The S3 client used for the download.
+
+            bucket: string
+                The bucket of the object.
+
+            key: string
+                The key of the object.
+
+        Returns
+        ----------
+            path: string
+                The local file with the content of the object.
+        """
+        now = time.time()
+        with self._locks_lock:
+            checked = self._checked.get((bucket, key))
+        if checked is not None and now - checked[0] <= ETAG_SECONDS:
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(checked[1])
+                return checked[1]
+        head = client.head_object(Bucket=bucket, Key=key)
+        etag = head["ETag"]
+        digest = hashlib.sha256(f"{bucket}/{key}|{etag}".encode("utf-8")).hexdigest()
+        local = os.path.join(self.path, digest + os.path.splitext(key)[1])
+        with self._locks_lock:
+            entry = self._locks.setdefault(digest, [threading.Lock(), 0])
+            entry[1] += 1
+        downloaded = False
+        try:
+            with entry[0]:
+                if os.path.exists(local):
+                    os.utime(local)
+                else:
+                    self._download(client, bucket, key, head, local)
+                    downloaded = True
+        finally:
+            # The lock is only kept while some thread fetches the object, so locks of old objects don't pile up.
+            with self._locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[digest]
+        if downloaded:
+            self._evict(keep=local)
+        with self._locks_lock:
+            self._checked[(bucket, key)] = (now, local)
+            self._checked.move_to_end((bucket, key))
+            # Objects are checked again in the order they were checked, so the oldest checks come first.
+            while next(iter(self._checked.values()))[0] < now - ETAG_SECONDS:
+                self._checked.popitem(last=False)
+        return local
+
+    def _download(self, client, bucket, key, head, local):
+        """
+        Downloads the object that was looked up with head to local, through a partial file next to it.
+
+        Parameters
+        ----------
+            client: botocore client
+                The S3 client used for the download.
+
+            bucket: string
+                The bucket of the object.
+
+            key: string
+                The key of the object.
+
+            head: dict
+                The HEAD response of the object, whose ETag and version the download has to match.
+
+            local: string
+                The file the object is stored in.
+        """
+        etag = head["ETag"]
+        handle, partial = tempfile.mkstemp(dir=self.path, suffix=".part")
+        os.close(handle)
+        try:
+            # download_file takes no IfMatch, but a version id pins every GET to the object that was checked.
+            version = {"VersionId": head["VersionId"]} if head.get("VersionId") else {}
+            client.download_file(bucket, key, partial, ExtraArgs=version, Config=self.transfer_config)
+            # Without one, the GETs are pinned to the ETag the transfer looked up itself, which has to be etag.
+            if not version and client.head_object(Bucket=bucket, Key=key)["ETag"] != etag:
+                raise IOError(f"s3://{bucket}/{key} changed while it was downloaded")
+            os.replace(partial, local)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        logging.info(f"Cached s3://{bucket}/{key} at {local}")
+
+    def _evict(self, keep):
+        """
+        Removes the least recently used objects until the cache fits in max_bytes.
+
+        Parameters
+        ----------
+            keep: string
+                A file that is never removed, because it was just fetched.
+        """
+        files = []
+        for name in os.listdir(self.path):
+            file = os.path.join(self.path, name)
+            if name.endswith(".part") or file == keep:
+                continue
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in files) + os.path.getsize(keep)
+        evicted = 0
+        for _, size, file in sorted(files):
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file)
+            total -= size
+            evicted += 1
+        if evicted:
+            logging.info(f"Evicted {evicted} objects from the source cache")
+
+    def clear(self):
+        """
+        Removes every cached object from the cache folder.
+        """
+        for name in os.listdir(self.path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.path, name))
+
+
+def enable_source_cache(path=None, max_bytes=10 * 1024 * 1024 * 1024):
+    """
+    Turns on the source cache for every S3 video in this process. Every consumer of a video, like ffprobe,
+    OpenCV and ffmpeg, then reads the local copy instead of a presigned url.
+
+    Parameters
+    ----------
+        path: string
+            The cache folder. Defaults to ~/.cache/aEye/sources.
+
+        max_bytes: int
+            The size limit of the cache.
+
+    Returns
+    ----------
+        cache: SourceCache
+            The cache that is now in use.
+    """
+    global _source_cache
+    _source_cache = SourceCache(path, max_bytes)
+    return _source_cache
+
+
+def disable_source_cache():
+    """
+    Turns off the source cache. The cached files are kept.
+    """
+    global _source_cache
+    _source_cache = None
+
+
+def get_source_cache():
+    """
+    Returns the source cache in use, creating it from AEYE_SOURCE_CACHE the first time if that is set.
+
+    Returns
+    ----------
+        cache: SourceCache
+            The cache, or None if caching is off.
+    """
+    global _source_cache
+    if _source_cache is None and os.environ.get("AEYE_SOURCE_CACHE"):
+        _source_cache = SourceCache(os.environ["AEYE_SOURCE_CACHE"])
+    return _source_cache
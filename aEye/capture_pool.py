@@ -0,0 +1,465 @@
+"""
+Module contains the CapturePool class, which keeps OpenCV captures open between Extractor calls, and the
+FrameCache class, which keeps recently decoded frames in memory.
+
+Opening a capture reads the container header, and a seek decodes from the keyframe before the target, so a
+tool that keeps asking for frames near each other pays both on every request. A pooled capture remembers the
+frame it reads next: a request after that frame in the same GOP is read forward instead of seeked, and a
+request for a frame that was decoded recently is answered from the frame cache without touching the video.
+The pool keeps at most max_open idle captures, least recently used first out, and closes captures that sat
+idle for longer than idle_seconds. Captures of presigned urls are reopened before the url can expire.
+Captures and frames also belong to a version of the content, the modification time and size of a local file
+or the ETag of an S3 object, so a file that is rewritten in place, like an output written again, is reopened.
+
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+# S3 objects are checked for a new version at most this often, since every check is a HEAD request.
+VERSION_SECONDS = 60
+
+_capture_pool = None
+_frame_cache = None
+_versions = {}
+_lock = threading.Lock()
+
+
+def capture_key(video):
+    """
+    Returns the key that the captures and frames of a video are stored under.
+
+    Parameters
+    ----------
+        video: Video
+            The video.
+
+    Returns
+    ----------
+        key: tuple
+            The file, bucket, key and executed output of the video.
+    """
+    return video.file, video.bucket, video.key, video.out
+
+
+def content_version(video):
+    """
+    Returns what changes when the content that a capture of the video reads is rewritten.
+
+    Parameters
+    ----------
+        video: Video
+            The video.
+
+    Returns
+    ----------
+        version: string
+            The content identity of the video (see Video.content_identity), which S3 objects are only
+            checked for every VERSION_SECONDS. None if the content can't be found.
+    """
+    if video.file is not None:
+        return video.content_identity()
+    now = time.monotonic()
+    with _lock:
+        checked = _versions.get((video.bucket, video.key))
+    if checked is None or now - checked[0] > VERSION_SECONDS:
+        checked = (now, video.content_identity())
+        with _lock:
+            _versions[(video.bucket, video.key)] = checked
+    return checked[1]
+
+
+class Capture:
+    """
+    Capture wraps an open cv2.VideoCapture and tracks the number of the frame that the next read returns.
+
+    Attributes
+    ----------
+        capture: cv2.VideoCapture
+            The open capture.
+
+        position: int
+            The frame the next read returns, or None if it is unknown.
+
+        remote: boolean
+            Whether the capture reads a url, which expires.
+
+        version: string
+            The content_version of the video the capture was opened for.
+
+    """
+
+    def __init__(self, location):
+        import cv2
+        self.capture = cv2.VideoCapture(location)
+        self.position = 0
+        self.remote = "://" in location
+        self.version = None
+        self.opened = self.used = time.monotonic()
+        # Set when the frame at position is grabbed but not retrieved yet.
+        self._grabbed = False
+
+    def get(self, prop):
+        """
+        Returns a property of the capture, like cv2.CAP_PROP_FPS.
+        """
+        return self.capture.get(prop)
+
+    def seek(self, frame):
+        """
+        Seeks to a frame, so the next read returns it.
+        """
+        import cv2
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self.position = frame
+        self._grabbed = False
+
+    def seek_exact(self, frame, index):
+        """
+        Seeks to a frame with the presentation times of a FrameIndex (see aEye.frame_index). OpenCV turns frame
+        numbers and times into each other with the average frame rate, which lands on the wrong frame when the
+        frame rate varies. So the capture is seeked by time to the keyframe before the frame, the frame it
+        landed on is looked up by its timestamp, and the rest of the way is read forward. If it landed past
+        the frame, the keyframe before is tried.
+
+        Returns
+        ----------
+            ret: boolean
+                False if the video ended before the frame.
+        """
+        import cv2
+        key = index.keyframe_before(frame)
+        while True:
+            if key == 0:
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            else:
+                # OpenCV's timestamps count from the first frame.
+                self.capture.set(cv2.CAP_PROP_POS_MSEC, (index.time_of(key) - index.time_of(0)) * 1000)
+            if not self.capture.grab():
+                self.position = None
+                self._grabbed = False
+                return False
+            landed = index.frame_at(self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000 + index.time_of(0))
+            if landed <= frame:
+                break
+            if key == 0:
+                self.seek(frame)
+                return True
+            key = index.keyframe_before(key - 1)
+        self.position = landed
+        self._grabbed = True
+        return self.grab(frame - landed)
+
+    def grab(self, count):
+        """
+        Skips count frames without converting them. Returns False if the video ended first.
+        """
+        if count > 0 and self._grabbed:
+            # The grabbed frame is skipped without decoding another.
+            self._grabbed = False
+            self.position += 1
+            count -= 1
+        for _ in range(count):
+            if not self.capture.grab():
+                self.position = None
+                return False
+            if self.position is not None:
+                self.position += 1
+        return True
+
+    def read(self, image=None):
+        """
+        Reads the next frame, into image if it is given and has the right shape.
+
+        Returns
+        ----------
+            ret: boolean
+                Whether a frame was read.
+
+            image: numpy.ndarray
+                The frame in BGR.
+        """
+        if self._grabbed:
+            self._grabbed = False
+            ret, image = self.capture.retrieve(image)
+        else:
+            ret, image = self.capture.read(image)
+        self.position = self.position + 1 if ret and self.position is not None else None
+        return ret, image
+
+    def release(self):
+        """
+        Closes the capture. Releasing twice is harmless.
+        """
+        self.capture.release()
+
+
+class CapturePool:
+    """
+    CapturePool keeps one idle capture per video open between calls. A capture is checked out for the
+    length of a read, so no two threads use it at once.
+
+    Attributes
+    ----------
+        max_open: int
+            The number of idle captures kept open. 0 turns pooling off.
+
+        idle_seconds: float
+            Captures idle for longer than this are closed.
+
+        max_age: float
+            Captures of urls older than this are reopened, so the presigned url can't expire mid-read.
+
+    Methods
+    ---------
+        acquire(video, location) -> Capture:
+            Context manager that checks out the capture of a video, opening one if there is none.
+
+        discard(video) -> None:
+            Closes the idle capture of a video.
+
+        close() -> None:
+            Closes every idle capture.
+
+    """
+
+    def __init__(self, max_open=8, idle_seconds=60, max_age=600):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.max_age = max_age
+        self._handles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self, video, location):
+        """
+        Checks out the capture of a video for the length of the block, and returns it to the pool afterwards.
+
+        Parameters
+        ----------
+            video: Video
+                The video. Its capture attribute is set to the capture.
+
+            location: callable
+                Returns the file or url to open, called only if a new capture is needed.
+
+        Returns
+        ----------
+            handle: Capture
+                The capture, positioned wherever the previous read left it.
+        """
+        key = capture_key(video)
+        version = content_version(video)
+        now = time.monotonic()
+        with self._lock:
+            self._close_idle(now)
+            handle = self._handles.pop(key, None)
+        if handle is not None and (handle.version != version or handle.remote and now - handle.opened > self.max_age):
+            # The content was rewritten since the capture was opened, or its url is about to expire.
+            handle.release()
+            handle = None
+        if handle is None:
+            handle = Capture(location())
+            handle.version = version
+        video.capture = handle
+        try:
+            yield handle
+        finally:
+            handle.used = time.monotonic()
+            with self._lock:
+                previous = self._handles.pop(key, None)
+                if previous is not None and previous is not handle:
+                    previous.release()
+                self._handles[key] = handle
+                while len(self._handles) > self.max_open:
+                    self._handles.popitem(last=False)[1].release()
+
+    def _close_idle(self, now):
+        """
+        Closes the captures that were idle for longer than idle_seconds. Expects the lock to be held.
+        """
+        while self._handles:
+            key, handle = next(iter(self._handles.items()))
+            if now - handle.used <= self.idle_seconds:
+                break
+            del self._handles[key]
+            handle.release()
+
+    def discard(self, video):
+        """
+        Closes the idle capture of a video, if there is one.
+
+        Parameters
+        ----------
+            video: Video
+                The video.
+        """
+        with self._lock:
+            handle = self._handles.pop(capture_key(video), None)
+        if handle is not None:
+            handle.release()
+
+    def close(self):
+        """
+        Closes every idle capture.
+        """
+        with self._lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        for handle in handles:
+            handle.release()
+
+
+class FrameCache:
+    """
+    FrameCache keeps decoded frames in memory with a size limit. When the limit is passed, the least
+    recently used frames are evicted first. Stored frames are read only, since every caller shares them.
+    Frames are stored under the content version of their video, so the frames of rewritten content are
+    never returned.
+
+    Attributes
+    ----------
+        max_bytes: int
+            The total size of all stored frames that triggers eviction. 0 turns caching off.
+
+    Methods
+    ---------
+        get(video, frame) -> (numpy.ndarray, float):
+            Returns the stored frame and its timestamp, or None if there is none.
+
+        put(video, frame, image, timestamp) -> None:
+            Stores a frame and evicts old frames if the cache is over its limit.
+
+        clear() -> None:
+            Removes every frame.
+
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._frames = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video, frame):
+        """
+        Looks up a frame and marks it as recently used.
+
+        Parameters
+        ----------
+            video: Video
+                The video.
+
+            frame: int
+                The frame number.
+
+        Returns
+        ----------
+            entry: tuple
+                The frame and its timestamp in seconds, or None.
+        """
+        key = (capture_key(video), content_version(video), frame)
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None:
+                self._frames.move_to_end(key)
+            return entry
+
+    def put(self, video, frame, image, timestamp):
+        """
+        Stores a frame, then evicts the least recently used frames until the cache fits in max_bytes.
+
+        Parameters
+        ----------
+            video: Video
+                The video.
+
+            frame: int
+                The frame number.
+
+            image: numpy.ndarray
+                The decoded frame. It is made read only.
+
+            timestamp: float
+                The time of the frame in seconds.
+        """
+        if image.nbytes > self.max_bytes:
+            return
+        image.flags.writeable = False
+        key = (capture_key(video), content_version(video), frame)
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[0].nbytes
+            self._frames[key] = (image, timestamp)
+            self.bytes += image.nbytes
+            while self.bytes > self.max_bytes:
+                self.bytes -= self._frames.popitem(last=False)[1][0].nbytes
+
+    def clear(self):
+        """
+        Removes every frame from the cache.
+        """
+        with self._lock:
+            self._frames.clear()
+            self.bytes = 0
+
+
+def configure_captures(max_open=8, idle_seconds=60, max_age=600, frame_cache_bytes=256 * 1024 * 1024):
+    """
+    Sets up the capture pool and the frame cache. Open captures are closed and cached frames dropped.
+
+    Parameters
+    ----------
+        max_open: int
+            The number of idle captures kept open. 0 turns pooling off.
+
+        idle_seconds: float
+            Captures idle for longer than this are closed.
+
+        max_age: float
+            Captures of urls older than this are reopened.
+
+        frame_cache_bytes: int
+            The size limit of the frame cache. 0 turns it off.
+    """
+    global _capture_pool, _frame_cache
+    with _lock:
+        if _capture_pool is not None:
+            _capture_pool.close()
+        _capture_pool = CapturePool(max_open, idle_seconds, max_age)
+        _frame_cache = FrameCache(frame_cache_bytes)
+
+
+def get_capture_pool():
+    """
+    Returns the capture pool, creating it with the default settings the first time.
+
+    Returns
+    ----------
+        pool: CapturePool
+            The pool shared by every Extractor.
+    """
+    global _capture_pool
+    with _lock:
+        if _capture_pool is None:
+            _capture_pool = CapturePool()
+        return _capture_pool
+
+
+def get_frame_cache():
+    """
+    Returns the frame cache, creating it with the default settings the first time.
+
+    Returns
+    ----------
+        cache: FrameCache
+            The cache shared by every Extractor.
+    """
+    global _frame_cache
+    with _lock:
+        if _frame_cache is None:
+            _frame_cache = FrameCache()
+        return _frame_cache
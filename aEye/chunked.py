@@ -0,0 +1,147 @@
+"""
+Module contains the chunked transcode, which spreads the encode of one long video over several ffmpeg processes.
+
+The source is split on its own keyframes, every chunk is run through the same labels in its own ffmpeg process,
+and the chunks are joined with the concat demuxer. Audio is not chunked: it is taken from the source in the
+final join, so there are no gaps at the chunk borders. Only labels that treat every frame on its own are
+chunk safe. Trims, frame rate changes, segmenting and raw output change how frames line up across the
+chunk borders and always run as a single process.
+
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from aEye.planner import is_terminal, parse_label
+from aEye.smart_cut import run_commands
+
+# Complex filter steps that only look at one frame at a time.
+CHUNK_SAFE_FILTERS = ('scale', 'setsar', 'crop', 'gblur', 'format')
+
+
+def is_chunk_safe(label, filters):
+    """
+    Checks whether a video with these labels can be split into chunks and joined again without changing
+    its duration or frame count.
+
+    Parameters
+    ----------
+        label: string
+            The label string of the video, without the complex filter.
+
+        filters: list
+            The complex filter steps of the video.
+
+    Returns
+    ----------
+        safe: boolean
+            True if every label works on frames independently.
+    """
+    if is_terminal(label):
+        return False
+    start, duration, frames, _ = parse_label(label)
+    if start or duration is not None or frames is not None:
+        return False
+    for step in filters:
+        for name in step.strip().split(','):
+            if name.partition('=')[0] not in CHUNK_SAFE_FILTERS:
+                return False
+    return True
+
+
+def chunk_starts(keyframes, duration, chunks):
+    """
+    Picks the keyframes that split a video into about equally long chunks.
+
+    Parameters
+    ----------
+        keyframes: list
+            Sorted keyframe times in seconds.
+
+        duration: float
+            The video duration in seconds.
+
+        chunks: int
+            The number of chunks wanted.
+
+    Returns
+    ----------
+        starts: list
+            The start time of every chunk, beginning with 0. There can be fewer than chunks of them
+            if the keyframes are far apart.
+    """
+    keyframes = [k for k in keyframes if 0 < k < duration]
+    starts = [0.0]
+    for i in range(1, chunks):
+        if not keyframes:
+            break
+        start = min(keyframes, key=lambda k, i=i: abs(k - duration * i / chunks))
+        if start > starts[-1]:
+            starts.append(start)
+    return starts
+
+
+def run_chunked(ffmpeg, video, label, keep_audio, output, chunks):
+    """
+    Writes the video with its labels to output, encoding up to chunks keyframe aligned pieces at once.
+
+    Parameters
+    ----------
+        ffmpeg: string
+            The path to the ffmpeg executable.
+
+        video: Video
+            The source video. Its metadata and keyframes are probed if they aren't known yet.
+
+        label: string
+            The full label string to run on every chunk, including the complex filter.
+
+        keep_audio: boolean
+            Whether the output keeps the audio of the source, like a single run without a complex filter does.
+
+        output: string
+            The output file path.
+
+        chunks: int
+            The maximum number of chunks and of ffmpeg processes running at once.
+
+    Returns
+    ----------
+        process: subprocess.CompletedProcess
+            The result of the whole transcode. args holds every command that was run and stderr all of their errors.
+    """
+    video.extract_metadata()
+    duration = float(video.meta_data["streams"][0]["duration"])
+    source = video._probe_source()
+    starts = chunk_starts(video.get_keyframes(), duration, chunks)
+    if len(starts) < 2:
+        return run_commands([f"{ffmpeg} -y -i {source} {label} {output}"])
+
+    extension = os.path.splitext(output)[1]
+    workdir = tempfile.mkdtemp()
+    ends = starts[1:] + [None]
+    pieces = [f"{workdir}/chunk_{i:04d}{extension}" for i in range(len(starts))]
+    commands = []
+    for start, end, piece in zip(starts, ends, pieces):
+        limit = f"-t {round(end - start, 6)} " if end is not None else ""
+        commands.append(f"{ffmpeg} -y -ss {start} -i {source} {limit}{label} -an {piece}")
+
+    try:
+        logging.info(f"Transcoding {video} as {len(pieces)} chunks")
+        with ThreadPoolExecutor(max_workers=chunks) as pool:
+            completed = list(pool.map(lambda command: run_commands([command]), commands))
+        failed = [process for process in completed if process.returncode != 0]
+        if failed:
+            return failed[0]
+
+        with open(f"{workdir}/chunks.txt", "w", encoding="utf-8") as concat_list:
+            concat_list.writelines(f"file '{piece}'\n" for piece in pieces)
+        audio = f"-i {source} -map 0:v -map 1:a? -c:a aac " if keep_audio else ""
+        join = run_commands([f"{ffmpeg} -y -f concat -safe 0 -i {workdir}/chunks.txt {audio}-c:v copy {output}"])
+        join.args = " && ".join(commands + [join.args])
+        join.stderr = "".join(process.stderr for process in completed) + join.stderr
+        return join
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,81 @@
+"""
+Module contains the lookup of the ffmpeg and ffprobe executables that every part of aEye runs.
+
+The executables are looked up once per process and remembered. By default they come from static_ffmpeg,
+which downloads them on first use. Systems that already have ffmpeg can point aEye at it instead, with
+set_executables or the AEYE_FFMPEG and AEYE_FFPROBE environment variables, and skip static_ffmpeg entirely.
+
+"""
+
+import os
+import shutil
+import threading
+
+_executables = None
+_lock = threading.Lock()
+
+
+def set_executables(ffmpeg=None, ffprobe=None):
+    """
+    Uses the given ffmpeg and ffprobe from now on. Without arguments, the ones found on PATH are used.
+
+    Parameters
+    ----------
+        ffmpeg: string
+            The path to the ffmpeg executable.
+
+        ffprobe: string
+            The path to the ffprobe executable. Defaults to the ffprobe next to ffmpeg.
+    """
+    global _executables
+    ffmpeg = ffmpeg or shutil.which("ffmpeg")
+    ffprobe = ffprobe or _sibling_ffprobe(ffmpeg) or shutil.which("ffprobe")
+    if ffmpeg is None or ffprobe is None:
+        raise FileNotFoundError("ffmpeg and ffprobe could not be found")
+    with _lock:
+        _executables = (ffmpeg, ffprobe)
+
+
+def reset_executables():
+    """
+    Forgets the executables, so the next use looks them up again.
+    """
+    global _executables
+    with _lock:
+        _executables = None
+
+
+def get_executables():
+    """
+    Returns the ffmpeg and ffprobe executables, looking them up the first time. AEYE_FFMPEG and AEYE_FFPROBE
+    are used if they are set, otherwise static_ffmpeg provides them.
+
+    Returns
+    ----------
+        ffmpeg: string
+            The path to the ffmpeg executable.
+
+        ffprobe: string
+            The path to the ffprobe executable.
+    """
+    global _executables
+    with _lock:
+        if _executables is None:
+            ffmpeg = os.environ.get("AEYE_FFMPEG")
+            if ffmpeg:
+                _executables = (ffmpeg, os.environ.get("AEYE_FFPROBE") or _sibling_ffprobe(ffmpeg) or "ffprobe")
+            else:
+                from static_ffmpeg import run
+                _executables = tuple(run.get_or_fetch_platform_executables_else_raise())
+        return _executables
+
+
+def _sibling_ffprobe(ffmpeg):
+    """
+    Returns the ffprobe in the same folder as ffmpeg, or None if there is none.
+    """
+    if not ffmpeg:
+        return None
+    folder, name = os.path.split(ffmpeg)
+    ffprobe = os.path.join(folder, name.replace("ffmpeg", "ffprobe"))
+    return ffprobe if ffprobe != ffmpeg and os.path.exists(ffprobe) else None
@@ -1,14 +1,106 @@
+import bisect
+import contextlib
 import cv2
 import logging
+import math
+import numpy
 import os
+import subprocess
 import tempfile
 from aEye.auxiliary import Aux
+from aEye.capture_pool import Capture, get_capture_pool, get_frame_cache
+from aEye.executables import get_executables
+from aEye.image_writer import ImageWriter
+from aEye.partial_fetch import partial_source
+from aEye.pipe_decoder import CHANNELS, decode_batches, decode_command
+from aEye.shards import ShardWriter
+from aEye.storage import get_s3_client
+
+# OpenCV seeks to a frame by jumping this many frames before it and reading forward.
+OPENCV_SEEK_FRAMES = 16
+
+# Without the keyframes of a video, requested frames this close to the previous one are reached by reading forward.
+READ_AHEAD_FRAMES = 30
+
+# Pixel formats the ffmpeg backend outputs for the colour conversions it does itself.
+PIPE_PIXEL_FORMATS = {None: "bgr24", cv2.COLOR_BGR2RGB: "rgb24", cv2.COLOR_BGR2BGRA: "bgra",
+                      cv2.COLOR_BGR2RGBA: "rgba", cv2.COLOR_BGR2GRAY: "gray"}
+
+# Frames the ffmpeg backend of iter_frames reads per batch.
+PIPE_BATCH_FRAMES = 16
+
+
+def seek_plan(frames, key_frames=None):
+    """
+    Orders frame requests so that one capture can serve all of them, seeking once per group of frames.
+
+    Parameters
+    ----------
+        frames: list
+            The requested frame numbers, in any order and possibly repeated.
+
+        key_frames: list
+            Sorted frame numbers of the keyframes. Frames in the same GOP are grouped. Without keyframes,
+            frames at most READ_AHEAD_FRAMES apart are grouped.
+
+    Returns
+    ----------
+        plan: list
+            (frame, seek) pairs for every distinct frame in ascending order. seek is True for the first frame of
+            every group, and the other frames of a group are reached by reading forward.
+    """
+    plan = []
+    for frame in sorted(set(frames)):
+        plan.append((frame, not plan or not _same_group(plan[-1][0], frame, key_frames)))
+    return plan
+
+
+def _same_group(first, second, key_frames=None):
+    """
+    Returns whether the frame second can be reached from the frame first by reading forward instead of seeking.
+    """
+    if key_frames:
+        return bisect.bisect_right(key_frames, first) == bisect.bisect_right(key_frames, second)
+    return second - first <= READ_AHEAD_FRAMES
+
+
+def _channels(color):
+    """
+    Returns the number of channels a frame has after the given cv2 colour conversion.
+    """
+    if color is None:
+        return 3
+    converted = cv2.cvtColor(numpy.zeros((1, 1, 3), numpy.uint8), color)
+    return 1 if converted.ndim == 2 else converted.shape[2]
+
+
+def _convert(frame, size=None, color=None, dst=None):
+    """
+    Resizes and colour converts a decoded frame, writing the result into dst if one is given.
+    """
+    if size is not None:
+        frame = cv2.resize(frame, size, dst=None if color is not None else dst, interpolation=cv2.INTER_AREA)
+    if color is not None:
+        frame = cv2.cvtColor(frame, color, dst=dst)
+    elif size is None and dst is not None:
+        dst[...] = frame
+    return frame.reshape(frame.shape[0], frame.shape[1], -1)
+
 
 class Extractor:
     """
     The Extractor class is used for frame extractions using openCV. Any time the methods
     within the Extractor are run, they will instantly execute. To get frames from processed
     videos, use Aux.execute_label_and_write_local and pass the resulting list to the extractor.
+    With partial_fetch, frames of MP4/MOV videos in S3 are read from a partial copy that only holds the
+    GOPs around the requested frames, instead of the object being read from the start.
+    Captures stay open between calls and recently decoded frames are kept in memory (see aEye.capture_pool),
+    so asking for frames near the previous ones neither reopens nor seeks the video.
+    Images are encoded on a pool of writer threads while the next frames are decoded, as PNG, JPEG or WebP,
+    and the time and bytes spent on the last call are kept in write_stats. With a tar or npz output, they are
+    streamed into a few size capped shards with an index instead of one file each (see aEye.shards).
+    The array methods take a backend: 'opencv' reads through cv2.VideoCapture, and 'ffmpeg' has a multithreaded
+    ffmpeg decode, scale and convert the frames and reads them from a pipe (see aEye.pipe_decoder).
 
     Methods
     --------
@@ -19,9 +111,23 @@ class Extractor:
     specific_frame_extractor(aux, video_list, frame) -> List[Video]
         Will extract the frame # that is passed in and store it as a PNG in the temp folder
 
-    multiple_frame_extractor(aux, video_list, start_frame, num_frames) -> List[Video]
+    multiple_frame_extractor(aux, video_list, start_frame, num_frames, stride) -> List[Video]
         Extract the next num_frames after start_frame and send ALL the images to the output folder. This has the
-        capacity to create a HUGE amount of images per video, use with caution!
+        capacity to create a HUGE amount of images per video, use with caution! The video is seeked once and
+        then decoded in order, and with stride only every stride-th frame is converted and saved.
+
+    iter_frames(video, start_frame, num_frames, stride, size, color) -> Iterator[(int, float, numpy.ndarray)]
+        Yields the frame index, timestamp and image of every frame as a NumPy array. Nothing is written to disk.
+
+    read_frames(video, start_frame, num_frames, stride, size, color) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        Decodes the frames straight into one preallocated (N, H, W, C) array, and returns it with the frame
+        indexes and timestamps.
+
+    iter_batches(video, batch_size, start_frame, num_frames, stride, size, color) -> Iterator[tuple]
+        Like read_frames, but yields (frames, indexes, timestamps) batches of at most batch_size frames.
+
+    read_frames_at(video, frames, times, size, color) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        Decodes a list of frames, or the frames at a list of times, in the order they were asked for.
 
     Examples
     --------
@@ -31,12 +137,245 @@ class Extractor:
     specific_frame_extractor(aux, s3_videos, 320) -> Output image comes from frame 320
 
     multiple_frame_extractor(aux, s3_videos, 634, 10) -> Extract 10 contiguous frames starting from 634
+
+    multiple_frame_extractor(aux, s3_videos, 0, 100, stride=30) -> Extract every 30th frame, 100 images in total
+
+    read_frames(video, 0, 64, size=(224, 224), color=cv2.COLOR_BGR2RGB) -> A (64, 224, 224, 3) RGB array
+
+    read_frames(video, size=(320, 180), backend='ffmpeg') -> Every frame, decoded and scaled by ffmpeg
     """
 
+    def __init__(self, partial_fetch=False, threads=0, image_format="png", quality=None, compression=None,
+                 write_workers=4, output="files", shard_bytes=1024 * 1024 * 1024):
+        """
+        Parameters
+        -------
+        partial_fetch : Boolean
+            Whether S3 videos fetch only the byte ranges around the requested frames (see aEye.partial_fetch).
+
+        threads       : Integer
+            Decoder threads of the ffmpeg backend. 0 lets ffmpeg pick.
+
+        image_format  : String
+            Format of the extracted images, "png", "jpeg" or "webp".
+
+        quality       : Integer
+            JPEG or WebP quality, up to 100. None keeps OpenCV's default.
+
+        compression   : Integer
+            PNG compression level, 0 to 9. None keeps OpenCV's default.
+
+        write_workers : Integer
+            Threads that encode and write images while frames are decoded (see aEye.image_writer).
+
+        output        : String
+            "files" writes one image file per frame. "tar" and "npz" stream the frames of every video into
+            shards of at most shard_bytes in the output folder, with an index per shard (see aEye.shards).
+
+        shard_bytes   : Integer
+            The size a shard is closed at.
+        """
+        self.partial_fetch = partial_fetch
+        self.threads = threads
+        self.image_format = image_format
+        self.quality = quality
+        self.compression = compression
+        self.write_workers = write_workers
+        self.output = output
+        self.shard_bytes = shard_bytes
+        self.write_stats = None
+
+    def _writer(self, aux):
+        """
+        Returns a new ImageWriter, or a ShardWriter into the output folder of aux, with the image settings of
+        the extractor.
+        """
+        if self.output == "files":
+            return ImageWriter(self.image_format, self.quality, self.compression, self.write_workers)
+        folder = aux._local_path if aux._local_path else aux._temp_folder
+        if folder is None:
+            folder = tempfile.mkdtemp(dir="")
+            aux._local_path = folder
+            aux._temp_folder = folder
+        return ShardWriter(folder, self.output, self.shard_bytes, image_format=self.image_format,
+                           quality=self.quality, compression=self.compression, max_workers=self.write_workers)
+
+    def _finish(self, aux, writer):
+        """
+        Waits for the writer, keeps its stats, and hands any shards it wrote to aux for upload_s3.
+        """
+        self.write_stats = writer.close()
+        if isinstance(writer, ShardWriter):
+            aux.shard_files += writer.files
+
+    def _source(self, video, start_frame, end_frame, stack):
+        """
+        Gives the file or url that OpenCV should read the frames from start_frame to end_frame of a video from.
+
+        Parameters
+        -------
+        video       : Video
+            The video to read.
+
+        start_frame : Float
+            The first frame that will be read.
+
+        end_frame   : Float
+            The last frame that will be read.
+
+        stack       : contextlib.ExitStack
+            Holds the partial copy until the frames are read.
+
+        Returns
+        -------
+
+        The location of the video as a string
+        """
+        if video.out != '':
+            return video.out.strip("'")
+        if self.partial_fetch and video.file is None:
+            index = self._index(video)
+            if index is not None:
+                seek = max(index.keyframe_before(start_frame) - OPENCV_SEEK_FRAMES, 0)
+                start, end = index.time_of(seek), index.time_of(end_frame)
+            else:
+                fps = float(video.get_num_frames()) / float(video.get_duration())
+                start, end = max(start_frame - OPENCV_SEEK_FRAMES, 0) / fps, end_frame / fps
+            return stack.enter_context(partial_source(get_s3_client(), video, start, end)).strip("'")
+        return video.get_presigned_url().strip("'")
+
+    def _index(self, video):
+        """
+        Returns the frame index of a video (see aEye.frame_index), or None if building it would mean reading
+        the whole video. Local files are indexed once, S3 videos only if their moov box or the metadata cache
+        has the index. Executed outputs are read without one.
+
+        Parameters
+        -------
+        video : Video
+            The video to read.
+
+        Returns
+        -------
+
+        FrameIndex or None
+        """
+        if video.out != '':
+            return None
+        try:
+            return video.get_frame_index(low_io=True)
+        except Exception as e:
+            logging.error(f"Cannot index video {video}: {e}")
+            return None
+
+    def _capture(self, video, file_path, stack):
+        """
+        Checks out the pooled capture of a video until the stack closes. A partial copy is removed when the
+        stack closes, so it gets a capture of its own instead.
+
+        Parameters
+        -------
+        video     : Video
+            The video to read.
+
+        file_path : String
+            The location from _source.
+
+        stack     : contextlib.ExitStack
+            Returns the capture to the pool, or releases it, once the frames are read.
+
+        Returns
+        -------
+
+        The Capture, positioned wherever the previous read of the video left it
+        """
+        if self.partial_fetch and video.file is None and video.out == '':
+            handle = Capture(file_path)
+            stack.callback(handle.release)
+        else:
+            handle = stack.enter_context(get_capture_pool().acquire(video, lambda: file_path))
+        if not handle.capture.isOpened():
+            raise IOError(f"Cannot open video {video}")
+        return handle
+
+    def _move(self, handle, frame, index=None):
+        """
+        Positions a capture so that its next read returns frame. The capture reads forward if frame lies ahead
+        of it in the same group (see seek_plan), and seeks otherwise. With a frame index, the seek goes to the
+        keyframe before frame by its time, which stays exact for variable frame rates (see Capture.seek_exact).
+
+        Parameters
+        -------
+        handle : Capture
+            The capture.
+
+        frame  : Integer
+            The frame to read next.
+
+        index  : FrameIndex
+            The frame index of the video, if there is one.
+
+        Returns
+        -------
+
+        False if the video ended before frame, True otherwise
+        """
+        position = handle.position
+        key_frames = index.key_frames if index is not None else None
+        if position is not None and position <= frame and _same_group(position, frame, key_frames):
+            # grab() decodes a frame without converting it, which is all the skipped frames need.
+            return handle.grab(frame - position)
+        if index is not None:
+            return handle.seek_exact(frame, index)
+        # Seeking decodes from the previous keyframe.
+        handle.seek(frame)
+        return True
+
+    def _read_plan(self, video, handle, plan, index=None):
+        """
+        Reads the frames of a seek plan from one capture. Frames in the frame cache are not decoded again,
+        and decoded frames are added to it.
+
+        Parameters
+        -------
+        video      : Video
+            The video to read.
+
+        handle     : Capture
+            The capture of the video.
+
+        plan       : List[(Integer, Boolean)]
+            The plan from seek_plan.
+
+        index      : FrameIndex
+            The frame index of the video, if there is one.
+
+        Returns
+        -------
+
+        Yields (frame number, image, timestamp in seconds) for every frame of the plan that could be read.
+        Images are read only.
+        """
+        frame_cache = get_frame_cache()
+        for frame, _ in plan:
+            entry = frame_cache.get(video, frame)
+            if entry is None:
+                if not self._move(handle, frame, index):
+                    # The video ended before the frame, so every later frame is missing too.
+                    return
+                ret, image = handle.read()
+                if not ret:
+                    continue
+                entry = (image, handle.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                frame_cache.put(video, frame, *entry)
+            yield (frame,) + entry
+
     def frame_at_time_extractor(self, aux, video_list, time):
         """
         Given a time in seconds, this will extract the closest frame.
         Img extraction that takes less than half as long as the FFMpeg version.
+        Given a list of times, every frame is extracted with one open capture per video. The times are sorted,
+        and the video is seeked once per GOP holding requested frames (see seek_plan).
 
         Parameters
         -------
@@ -46,52 +385,64 @@ class Extractor:
         video_list : List[Video]
             List of all video objects loaded for processing.
 
-        time       : Float
+        time       : Float or List[Float]
             Time in seconds to extract frame. Can be a float for higher degree of specificity
 
         Returns
         -------
 
-        Returns a list of videos, but creates an image in the output folder
+        Returns a list of videos, but creates an image per time in the output folder
         """
+        times = list(time) if isinstance(time, (list, tuple)) else [time]
+        writer = self._writer(aux)
         for video in video_list:
             try:
-                assert float(video.get_duration()) >= time >= 0
+                assert all(float(video.get_duration()) >= t >= 0 for t in times)
                 if video.label != '':
                     logging.error(
                         f"WARNING: Video {video} has processing to execute still! Resulting images will NOT have these modifications applied!")
-                if video.out != '':
-                    file_path = video.out.strip("'")
-                else:
-                    file_path = video.get_presigned_url().strip("'")
-                cv_video = cv2.VideoCapture(file_path)
-                fps = cv_video.get(cv2.CAP_PROP_FPS)
-                frame_id = int(fps * time)
-                cv_video.set(cv2.CAP_PROP_POS_FRAMES, frame_id)
-                ret, frame = cv_video.read()
-                actual_title = os.path.splitext(video.title)[0]
-                if video.path is None:
-                    video.path = tempfile.mkdtemp(dir="")
-                    path = video.path
-                    aux._local_path = path
-                    aux._temp_folder = path
-                else:
-                    path = file_path.split('/')[0]
-                # if video.path is None:
-                #     path = file_path.split('/')[0]
-                # else:
-                #     path = video.path
-                cv2.imwrite(f"{path}/output_cv_extract_frame_at_time_{time}_{actual_title}.png", frame)
-                cv_video.release()
-                logging.info(f"Extracted frame at time {time}")
+                with contextlib.ExitStack() as stack:
+                    index = self._index(video)
+                    fps = float(video.get_num_frames()) / float(video.get_duration())
+                    frame_ids = [index.frame_at(t) if index is not None else t * fps for t in times]
+                    file_path = self._source(video, min(frame_ids), max(frame_ids), stack)
+                    cv_video = self._capture(video, file_path, stack)
+                    if index is None:
+                        fps = cv_video.get(cv2.CAP_PROP_FPS)
+                        frame_ids = [int(fps * t) for t in times]
+                    actual_title = os.path.splitext(video.title)[0]
+                    if video.path is None:
+                        video.path = writer.folder or tempfile.mkdtemp(dir="")
+                        path = video.path
+                        aux._local_path = path
+                        aux._temp_folder = path
+                    else:
+                        path = file_path.split('/')[0]
+                    # if video.path is None:
+                    #     path = file_path.split('/')[0]
+                    # else:
+                    #     path = video.path
+                    plan = seek_plan(frame_ids, index.key_frames if index is not None else None)
+                    images = {frame: (image, timestamp)
+                              for frame, image, timestamp in self._read_plan(video, cv_video, plan, index)}
+                for t, frame_id in zip(times, frame_ids):
+                    if frame_id in images:
+                        writer.write(f"{path}/output_cv_extract_frame_at_time_{t}_{actual_title}", images[frame_id][0],
+                                     {"video": video.title, "frame": frame_id, "timestamp": images[frame_id][1]})
+                        logging.info(f"Extracted frame at time {t}")
+                    else:
+                        logging.error(f" Cannot extract frame at time {t} for video {video}")
             except:
                 logging.error(f" Cannot extract frame at time {time} for video {video}")
+        self._finish(aux, writer)
         return video_list
 
     def specific_frame_extractor(self, aux, video_list, frame):
         """
         OpenCv method to grab a single frame as a PNG. Passed argument frame is the frame that
         will be extracted. (No decimals please)
+        Given a list of frames, all of them are extracted with one open capture per video. The frames are sorted,
+        and the video is seeked once per GOP holding requested frames (see seek_plan).
 
         Parameters
         -------
@@ -102,52 +453,61 @@ class Extractor:
         video_list : List[Video]
             List of all video objects loaded for processing.
 
-        frame      : Integer
+        frame      : Integer or List[Integer]
             The frame number to be saved as a PNG
 
         Returns
         -------
 
-        Returns a list of video objects and outputs an image.
+        Returns a list of video objects and outputs an image per frame.
         """
+        frames = list(frame) if isinstance(frame, (list, tuple)) else [frame]
+        writer = self._writer(aux)
         for video in video_list:
             try:
-                assert int(video.get_num_frames()) >= frame >= 0
+                assert all(int(video.get_num_frames()) >= f >= 0 for f in frames)
                 if video.label != '':
                     logging.error(
                         f"WARNING: Video {video} has processing to execute still! Resulting images will NOT have these modifications applied!")
-                if video.out == '':
-                    file_path = video.get_presigned_url().strip("'")
-                else:
-                    file_path = video.out.strip("'")
-                cv_video = cv2.VideoCapture(file_path)
-                cv_video.set(cv2.CAP_PROP_POS_FRAMES, frame)
-                ret, output = cv_video.read()
-                actual_title = os.path.splitext(video.title)[0]
-                if video.path is None:
-                    video.path = tempfile.mkdtemp(dir="")
-                    path = video.path
-                    aux._local_path = path
-                    aux._temp_folder = path
-                else:
-                    path = file_path.split('/')[0]
-                # if video.path is None:
-                #     path = file_path.split('/')[0]
-                # else:
-                #     path = video.path
-                cv2.imwrite(f"{path}/output_cv_extract_specific_frame_{frame}_{actual_title}.png", output)
-                logging.info(f"Frame #{frame} extracted ")
-                cv_video.release()
+                with contextlib.ExitStack() as stack:
+                    file_path = self._source(video, min(frames), max(frames), stack)
+                    cv_video = self._capture(video, file_path, stack)
+                    actual_title = os.path.splitext(video.title)[0]
+                    if video.path is None:
+                        video.path = writer.folder or tempfile.mkdtemp(dir="")
+                        path = video.path
+                        aux._local_path = path
+                        aux._temp_folder = path
+                    else:
+                        path = file_path.split('/')[0]
+                    # if video.path is None:
+                    #     path = file_path.split('/')[0]
+                    # else:
+                    #     path = video.path
+                    index = self._index(video)
+                    plan = seek_plan(frames, index.key_frames if index is not None else None)
+                    images = {frame: (image, timestamp)
+                              for frame, image, timestamp in self._read_plan(video, cv_video, plan, index)}
+                for f in frames:
+                    if f in images:
+                        writer.write(f"{path}/output_cv_extract_specific_frame_{f}_{actual_title}", images[f][0],
+                                     {"video": video.title, "frame": f, "timestamp": images[f][1]})
+                        logging.info(f"Frame #{f} extracted ")
+                    else:
+                        logging.error(f" Cannot extract frame {f} for video {video}")
             except:
                 logging.error(f" Cannot extract frame {frame} for video {video}")
+        self._finish(aux, writer)
         return video_list
 
-    def multiple_frame_extractor(self, aux, video_list, start_frame, num_frames):
+    def multiple_frame_extractor(self, aux, video_list, start_frame, num_frames, stride=1):
         """
         Given a start_frame, extract the next num_frames from the video, and store the resulting
         collection of frames in the output folder. num_Frames is the number of frames to be returned
         Has the potential to create like a million images, only use this when you REALLY need a lot
         of frames or a specific set of frames.
+        The video is seeked to start_frame once and then read in order, so every frame is decoded only once.
+        Frames that are skipped by the stride are only grabbed, never converted to an image.
 
         Parameters
         -------
@@ -165,42 +525,349 @@ class Extractor:
             Number of frames to extract. THIS IS THE AMOUNT OF IMAGES PER VIDEO YOU WANT.
             UNLESS YOU NEED A TON OF CONTIGUOUS FRAMES, DO NOT SET THIS TO A HIGH NUMBER.
 
+        stride      : Integer
+            Distance between extracted frames. 1 extracts contiguous frames, 30 extracts every 30th frame.
+
         Returns
         -------
 
         Returns a list of Videos, and many frames are output as PNG's
         """
+        writer = self._writer(aux)
         for video in video_list:
             try:
                 if video.label != '':
                     logging.error(
                         f"WARNING: Video {video} has processing to execute still! Resulting images will NOT have these modifications applied!")
-                if video.out == '':
-                    file_path = video.get_presigned_url().strip("'")
-                else:
-                    file_path = video.out.strip("'")
-                vid_obj = cv2.VideoCapture(file_path)
-                actual_title = os.path.splitext(video.title)[0]
-                if video.path is None:
-                    video.path = tempfile.mkdtemp(dir="")
-                    path = video.path
-                    aux._local_path = path
-                    aux._temp_folder = path
-                else:
-                    path = file_path.split('/')[0]
-                # if video.path is None:
-                #     path = file_path.split('/')[0]
-                # else:
-                #     path = video.path
-                #  Sets the relative file location
-                for x in range(num_frames):
-                    vid_obj.set(cv2.CAP_PROP_POS_FRAMES, start_frame + x)
-                    ret, frame = vid_obj.read()
-                    fn = f"{path}/output_extract_many_frames_{start_frame}_{num_frames}_{actual_title}_{x}.png"
-                    #fn = f"images/output_extract_many_frames_{start_frame}_{num_frames}_{actual_title}_{x}.png"
-                    cv2.imwrite(fn, frame)
-                vid_obj.release()
+                assert stride >= 1
+                with contextlib.ExitStack() as stack:
+                    file_path = self._source(video, start_frame, start_frame + num_frames * stride, stack)
+                    vid_obj = self._capture(video, file_path, stack)
+                    actual_title = os.path.splitext(video.title)[0]
+                    if video.path is None:
+                        video.path = writer.folder or tempfile.mkdtemp(dir="")
+                        path = video.path
+                        aux._local_path = path
+                        aux._temp_folder = path
+                    else:
+                        path = file_path.split('/')[0]
+                    # if video.path is None:
+                    #     path = file_path.split('/')[0]
+                    # else:
+                    #     path = video.path
+                    #  Sets the relative file location
+                    # The video is positioned at start_frame once, and then read in order.
+                    ready = self._move(vid_obj, start_frame, self._index(video))
+                    for x in range(num_frames if ready else 0):
+                        # grab() decodes a frame without converting it, which is all the skipped frames need.
+                        if x > 0 and not vid_obj.grab(stride - 1):
+                            break
+                        ret, frame = vid_obj.read()
+                        if not ret:
+                            break
+                        fn = f"{path}/output_extract_many_frames_{start_frame}_{num_frames}_{actual_title}_{x}"
+                        #fn = f"images/output_extract_many_frames_{start_frame}_{num_frames}_{actual_title}_{x}.png"
+                        writer.write(fn, frame, {"video": video.title, "frame": start_frame + x * stride,
+                                                 "timestamp": vid_obj.get(cv2.CAP_PROP_POS_MSEC) / 1000})
                 logging.info(f"Extracted {num_frames} from video, saved as PNG's")
             except:
                 logging.error(f" Cannot extract {num_frames} starting from frame {start_frame}!")
+        self._finish(aux, writer)
         return video_list
+
+    def _open(self, video, start_frame, end_frame, stack):
+        """
+        Checks out a capture of a video that will read the frames from start_frame to end_frame, until the
+        stack closes.
+
+        Parameters
+        -------
+        video       : Video
+            The video to read.
+
+        start_frame : Integer
+            The first frame that will be read.
+
+        end_frame   : Integer
+            The last frame that will be read.
+
+        stack       : contextlib.ExitStack
+            Returns the capture and removes any partial copy once the frames are read.
+
+        Returns
+        -------
+
+        The Capture
+        """
+        if video.label != '':
+            logging.error(
+                f"WARNING: Video {video} has processing to execute still! Resulting frames will NOT have these modifications applied!")
+        return self._capture(video, self._source(video, start_frame, end_frame, stack), stack)
+
+    def _batches(self, capture, start_frame, count, stride, size, color, batch_size):
+        """
+        Reads count frames from a capture positioned at start_frame into preallocated arrays of at most
+        batch_size frames. Stops after the first batch that comes up short, which is where the video ended.
+        """
+        width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if size is not None and tuple(size) == (width, height):
+            size = None
+        width, height = size or (width, height)
+        channels = _channels(color)
+        done = 0
+        while True:
+            length = max(min(batch_size, count - done), 0)
+            frames = numpy.empty((length, height, width, channels), numpy.uint8)
+            indexes = numpy.empty(length, numpy.int64)
+            timestamps = numpy.empty(length, numpy.float64)
+            filled = 0
+            for i in range(length):
+                # grab() decodes a frame without converting it, which is all the skipped frames need.
+                if done + i > 0 and not capture.grab(stride - 1):
+                    break
+                if size is None and color is None:
+                    # OpenCV decodes into the array itself when it has the right shape.
+                    ret = capture.read(frames[i])[0]
+                else:
+                    ret, frame = capture.read()
+                    if ret:
+                        _convert(frame, size, color, frames[i])
+                if not ret:
+                    break
+                indexes[i] = start_frame + (done + i) * stride
+                timestamps[i] = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                filled += 1
+            yield frames[:filled], indexes[:filled], timestamps[:filled]
+            done += filled
+            if filled < length or done >= count:
+                return
+
+    def _count(self, capture, start_frame, num_frames, stride, index=None):
+        """
+        Returns the number of frames a read returns, which is all that are left if num_frames is None.
+        OpenCV's frame count is estimated from the duration, so the frame index is counted instead if there is one.
+        """
+        if num_frames is not None:
+            return num_frames
+        total = len(index) if index is not None else int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        return max(math.ceil((total - start_frame) / stride), 0)
+
+    def _pipe_batches(self, video, start_frame, num_frames, stride, size, color, batch_size):
+        """
+        Decodes frames with ffmpeg into one preallocated array of at most batch_size frames that every batch
+        reuses (see aEye.pipe_decoder). Stops after the first batch that comes up short, which is where the
+        video ended.
+
+        Returns
+        -------
+
+        Yields (frames, frame indexes, timestamps in seconds) tuples of NumPy arrays
+        """
+        if color not in PIPE_PIXEL_FORMATS:
+            raise ValueError(f"The ffmpeg backend can't apply colour conversion {color}")
+        pix_fmt = PIPE_PIXEL_FORMATS[color]
+        if video.label != '':
+            logging.error(
+                f"WARNING: Video {video} has processing to execute still! Resulting frames will NOT have these modifications applied!")
+        ffmpeg, ffprobe = get_executables()
+        fps = float(video.get_num_frames()) / float(video.get_duration())
+        index = self._index(video)
+        with contextlib.ExitStack() as stack:
+            end_frame = start_frame + num_frames * stride if num_frames is not None else int(video.get_num_frames())
+            source = self._source(video, start_frame, end_frame, stack)
+            if size is None and video.out == '':
+                size = (int(video.get_width()), int(video.get_height()))
+            elif size is None:
+                command = (f"{ffprobe} -v error -select_streams v:0 -show_entries stream=width,height -of csv=p=0 "
+                           f"'{source}'")
+                size = tuple(int(i) for i in subprocess.check_output(command, shell=True).decode().split(",")[:2])
+            # Starting half a frame early keeps start_frame when its time is rounded down.
+            start = index.seek_time(start_frame) if index is not None else max(start_frame - 0.5, 0) / fps
+            command = decode_command(ffmpeg, source, start, num_frames, stride, size, pix_fmt, self.threads)
+            done = 0
+            for frames in decode_batches(command, (size[1], size[0], CHANNELS[pix_fmt]), batch_size, num_frames):
+                indexes = start_frame + (done + numpy.arange(len(frames), dtype=numpy.int64)) * stride
+                done += len(frames)
+                if index is not None:
+                    yield frames, indexes, numpy.array([index.time_of(i) for i in indexes.tolist()])
+                else:
+                    yield frames, indexes, indexes / fps
+
+    def iter_frames(self, video, start_frame=0, num_frames=None, stride=1, size=None, color=None, backend="opencv"):
+        """
+        Yields the frames of a video as NumPy arrays, without writing anything to disk.
+        The video is seeked to start_frame once and then decoded in order.
+
+        Parameters
+        -------
+        video       : Video
+            The video to read.
+
+        start_frame : Integer
+            Number of the first frame.
+
+        num_frames  : Integer
+            Number of frames to yield. None yields every frame up to the end of the video.
+
+        stride      : Integer
+            Distance between yielded frames. 1 yields contiguous frames, 30 yields every 30th frame.
+
+        size        : (Integer, Integer)
+            (width, height) the frames are resized to. None keeps the size of the video.
+
+        color       : Integer
+            A cv2 colour conversion code, like cv2.COLOR_BGR2RGB, applied to every frame. None keeps OpenCV's BGR.
+            The ffmpeg backend does the conversions in PIPE_PIXEL_FORMATS.
+
+        backend     : String
+            'opencv' to decode with cv2.VideoCapture, 'ffmpeg' to decode, scale and convert with ffmpeg.
+
+        Returns
+        -------
+
+        Yields (frame index, timestamp in seconds, frame) tuples. Frames are (H, W, C) uint8 arrays.
+        """
+        assert stride >= 1 and backend in ("opencv", "ffmpeg")
+        if backend == "ffmpeg":
+            for frames, indexes, timestamps in self._pipe_batches(video, start_frame, num_frames, stride, size, color,
+                                                                  PIPE_BATCH_FRAMES):
+                # The next batch is decoded into the same array, and single frames may be kept.
+                yield from zip(indexes.tolist(), timestamps.tolist(), frames.copy())
+            return
+        with contextlib.ExitStack() as stack:
+            end_frame = start_frame + num_frames * stride if num_frames is not None else int(video.get_num_frames())
+            capture = self._open(video, start_frame, end_frame, stack)
+            index = self._index(video)
+            if not self._move(capture, start_frame, index):
+                return
+            for x in range(self._count(capture, start_frame, num_frames, stride, index)):
+                if x > 0 and not capture.grab(stride - 1):
+                    return
+                ret, frame = capture.read()
+                if not ret:
+                    return
+                yield start_frame + x * stride, capture.get(cv2.CAP_PROP_POS_MSEC) / 1000, _convert(frame, size, color)
+
+    def iter_batches(self, video, batch_size, start_frame=0, num_frames=None, stride=1, size=None, color=None,
+                     backend="opencv"):
+        """
+        Yields the frames of a video in batches, each decoded straight into a preallocated (N, H, W, C) array.
+        Takes the same parameters as iter_frames, plus batch_size. The ffmpeg backend decodes every batch into
+        the same array, so a batch is overwritten by the next one and has to be copied to be kept.
+
+        Parameters
+        -------
+        batch_size  : Integer
+            Largest number of frames in a batch. Only the last batch may be smaller.
+
+        Returns
+        -------
+
+        Yields (frames, frame indexes, timestamps in seconds) tuples of NumPy arrays.
+        """
+        assert stride >= 1 and batch_size >= 1 and backend in ("opencv", "ffmpeg")
+        if backend == "ffmpeg":
+            for batch in self._pipe_batches(video, start_frame, num_frames, stride, size, color, batch_size):
+                if len(batch[0]):
+                    yield batch
+            return
+        with contextlib.ExitStack() as stack:
+            end_frame = start_frame + num_frames * stride if num_frames is not None else int(video.get_num_frames())
+            capture = self._open(video, start_frame, end_frame, stack)
+            index = self._index(video)
+            ready = self._move(capture, start_frame, index)
+            count = self._count(capture, start_frame, num_frames, stride, index) if ready else 0
+            for batch in self._batches(capture, start_frame, count, stride, size, color, batch_size):
+                if len(batch[0]):
+                    yield batch
+
+    def read_frames(self, video, start_frame=0, num_frames=None, stride=1, size=None, color=None, backend="opencv"):
+        """
+        Decodes frames of a video straight into one preallocated (N, H, W, C) array, without writing anything
+        to disk. Takes the same parameters as iter_frames.
+
+        Returns
+        -------
+
+        (frames, frame indexes, timestamps in seconds) as NumPy arrays. N is smaller than num_frames if the video
+        ends first.
+        """
+        assert stride >= 1 and backend in ("opencv", "ffmpeg")
+        if backend == "ffmpeg":
+            if num_frames is None:
+                num_frames = max(math.ceil((int(video.get_num_frames()) - start_frame) / stride), 0)
+            batches = self._pipe_batches(video, start_frame, num_frames, stride, size, color, max(num_frames, 1))
+            with contextlib.closing(batches):
+                return next(batches)
+        with contextlib.ExitStack() as stack:
+            end_frame = start_frame + num_frames * stride if num_frames is not None else int(video.get_num_frames())
+            capture = self._open(video, start_frame, end_frame, stack)
+            index = self._index(video)
+            ready = self._move(capture, start_frame, index)
+            count = self._count(capture, start_frame, num_frames, stride, index) if ready else 0
+            return next(self._batches(capture, start_frame, count, stride, size, color, max(count, 1)))
+
+    def read_frames_at(self, video, frames=None, times=None, size=None, color=None):
+        """
+        Decodes a list of frames, or the frames at a list of times, into one preallocated (N, H, W, C) array,
+        without writing anything to disk. One capture serves the whole list: the requests are sorted and the
+        video is seeked once per GOP holding requested frames (see seek_plan).
+
+        Parameters
+        -------
+        video  : Video
+            The video to read.
+
+        frames : List[Integer]
+            The frame numbers to read, in any order.
+
+        times  : List[Float]
+            The times in seconds to read the closest frames of, instead of frames.
+
+        size   : (Integer, Integer)
+            (width, height) the frames are resized to. None keeps the size of the video.
+
+        color  : Integer
+            A cv2 colour conversion code, like cv2.COLOR_BGR2RGB, applied to every frame. None keeps OpenCV's BGR.
+
+        Returns
+        -------
+
+        (frames, frame indexes, timestamps in seconds) as NumPy arrays, in the order the frames were asked for.
+        Frames that can't be read, like those past the end of the video, are left out.
+        """
+        assert (frames is None) != (times is None)
+        with contextlib.ExitStack() as stack:
+            index = self._index(video)
+            fps = float(video.get_num_frames()) / float(video.get_duration())
+            if frames is not None:
+                requested = list(frames)
+            else:
+                requested = [index.frame_at(t) if index is not None else t * fps for t in times]
+            capture = self._open(video, min(requested), max(requested), stack)
+            if times is not None and index is None:
+                fps = capture.get(cv2.CAP_PROP_FPS)
+                requested = [int(fps * t) for t in times]
+            width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            if size is not None and tuple(size) == (width, height):
+                size = None
+            width, height = size or (width, height)
+            output = numpy.empty((len(requested), height, width, _channels(color)), numpy.uint8)
+            positions = {}
+            for i, frame in enumerate(requested):
+                positions.setdefault(frame, []).append(i)
+            found = numpy.zeros(len(requested), bool)
+            timestamps = numpy.zeros(len(requested), numpy.float64)
+            plan = seek_plan(requested, index.key_frames if index is not None else None)
+            for frame, image, timestamp in self._read_plan(video, capture, plan, index):
+                first, *others = positions[frame]
+                _convert(image, size, color, output[first])
+                timestamps[first] = timestamp
+                for i in others:
+                    output[i] = output[first]
+                    timestamps[i] = timestamps[first]
+                found[positions[frame]] = True
+        indexes = numpy.array(requested, numpy.int64)
+        if found.all():
+            return output, indexes, timestamps
+        return output[found], indexes[found], timestamps[found]
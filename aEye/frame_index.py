@@ -0,0 +1,301 @@
+"""
+Module contains the FrameIndex class, which holds the presentation time of every frame of a video and which
+frames are keyframes.
+
+nb_frames / duration only gives the time of a frame when the frame rate is constant, and OpenCV turns frame
+numbers into times with the same guess when it seeks. The index lists the presentation time of every packet
+of the video stream in presentation order, so the time of frame n is the nth entry, the frame shown at a time
+is a binary search, and so is the keyframe a seek to any frame starts from. It is built from packet headers,
+nothing is decoded: ffprobe reads them for any container, and for MP4 and MOV objects in S3 the sample tables
+of the moov box are read with a few ranged GETs instead. The index is kept in NumPy arrays and stored in the
+metadata cache next to the metadata (see aEye.cache), so every source is indexed once.
+
+"""
+
+import base64
+import subprocess
+import zlib
+import numpy
+from aEye.partial_fetch import parse_tracks
+from aEye.remote_probe import RangeReader, find_boxes
+
+# Presentation times are stored in microseconds, the precision ffprobe prints them with.
+TICKS_PER_SECOND = 1000000
+
+# Times this close to the start of a frame belong to it, for the rounding of printed times.
+EPSILON = 0.5 / TICKS_PER_SECOND
+
+
+def _pack(values):
+    """
+    Delta encodes and compresses an ascending integer array into a string. The deltas of a constant frame rate
+    are all the same, so they compress to almost nothing.
+    """
+    deltas = numpy.diff(numpy.asarray(values, numpy.int64), prepend=0).astype("<i8")
+    return base64.b64encode(zlib.compress(deltas.tobytes())).decode("ascii")
+
+
+def _unpack(text):
+    """
+    Reverses _pack.
+    """
+    return numpy.cumsum(numpy.frombuffer(zlib.decompress(base64.b64decode(text)), "<i8"))
+
+
+class FrameIndex:
+    """
+    FrameIndex maps the frames of a video to their presentation times and keyframes. Frames are numbered in
+    presentation order from 0, the way they are decoded.
+
+    Attributes
+    ----------
+        times: numpy.ndarray
+            The presentation time of every frame in seconds, ascending.
+
+        keyframes: numpy.ndarray
+            The ascending frame numbers of the keyframes.
+
+    Methods
+    ---------
+        time_of(frame) -> float:
+            Returns the presentation time of a frame.
+
+        frame_at(time) -> int:
+            Returns the frame shown at a time.
+
+        next_frame(time) -> int:
+            Returns the first frame that starts at or after a time.
+
+        keyframe_before(frame) -> int:
+            Returns the keyframe that decoding a frame starts from.
+
+        to_json() -> dict / from_json(value) -> FrameIndex:
+            Convert the index to and from the compact form stored in the metadata cache.
+
+    """
+
+    def __init__(self, times, keyframes):
+        self.times = numpy.asarray(times, numpy.float64)
+        self.keyframes = numpy.asarray(keyframes, numpy.int64)
+        self._key_frames = None
+
+    @classmethod
+    def from_packets(cls, times, flags):
+        """
+        Builds the index from the packets of a video stream in decode order.
+
+        Parameters
+        ----------
+            times: list
+                The presentation time of every packet in seconds.
+
+            flags: list
+                Whether every packet is a keyframe.
+
+        Returns
+        ----------
+            index: FrameIndex
+                The packets sorted into presentation order.
+        """
+        times = numpy.asarray(times, numpy.float64)
+        order = numpy.argsort(times, kind="stable")
+        return cls(times[order], numpy.flatnonzero(numpy.asarray(flags, bool)[order]))
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def key_frames(self):
+        """
+        The frame numbers of the keyframes as a list, for seek_plan.
+        """
+        if self._key_frames is None:
+            self._key_frames = self.keyframes.tolist()
+        return self._key_frames
+
+    def keyframe_times(self):
+        """
+        Returns the presentation times of the keyframes in seconds as a list.
+        """
+        return self.times[self.keyframes].tolist()
+
+    def time_of(self, frame):
+        """
+        Returns the presentation time of a frame in seconds. Frames past the end are placed after the last
+        frame at the pace of the last two, so the frame after the last one gives the end of the video.
+
+        Parameters
+        ----------
+            frame: int
+                The frame number.
+
+        Returns
+        ----------
+            time: float
+                The time the frame is shown at.
+        """
+        frame = int(frame)
+        if frame < 0 or not len(self.times):
+            raise IndexError(f"Frame {frame} is not in a video of {len(self.times)} frames")
+        if frame < len(self.times):
+            return float(self.times[frame])
+        last = self.times[-1] - self.times[-2] if len(self.times) > 1 else 0.0
+        return float(self.times[-1] + last * (frame - len(self.times) + 1))
+
+    def frame_at(self, time):
+        """
+        Returns the frame shown at a time: the last frame that starts at or before it.
+
+        Parameters
+        ----------
+            time: float
+                The time in seconds.
+
+        Returns
+        ----------
+            frame: int
+                The frame number, 0 for times before the first frame.
+        """
+        return max(int(numpy.searchsorted(self.times, time + EPSILON, side="right")) - 1, 0)
+
+    def next_frame(self, time):
+        """
+        Returns the first frame that starts at or after a time, which is the first frame ffmpeg outputs after
+        seeking to it.
+
+        Parameters
+        ----------
+            time: float
+                The time in seconds.
+
+        Returns
+        ----------
+            frame: int
+                The frame number, len(self) for times past the last frame.
+        """
+        return int(numpy.searchsorted(self.times, time - EPSILON, side="left"))
+
+    def keyframe_before(self, frame):
+        """
+        Returns the last keyframe at or before a frame, where decoding the frame has to start.
+
+        Parameters
+        ----------
+            frame: int
+                The frame number.
+
+        Returns
+        ----------
+            keyframe: int
+                The keyframe's frame number, 0 if there is none before frame.
+        """
+        position = int(numpy.searchsorted(self.keyframes, frame, side="right"))
+        return int(self.keyframes[position - 1]) if position else 0
+
+    def seek_time(self, frame):
+        """
+        Returns a time that seeking ffmpeg to makes frame the first frame output: halfway between the frame
+        and the one before it, so the rounding of either time can't drop or add a frame.
+
+        Parameters
+        ----------
+            frame: int
+                The frame number.
+
+        Returns
+        ----------
+            time: float
+                The time in seconds.
+        """
+        if frame <= 0:
+            return max(self.time_of(0), 0.0)
+        return (self.time_of(frame - 1) + self.time_of(frame)) / 2
+
+    def to_json(self):
+        """
+        Returns the index as a dictionary of compressed, delta encoded arrays that can be stored as JSON.
+        """
+        ticks = numpy.round(self.times * TICKS_PER_SECOND)
+        return {"frames": len(self.times), "times": _pack(ticks), "keyframes": _pack(self.keyframes)}
+
+    @classmethod
+    def from_json(cls, value):
+        """
+        Rebuilds an index from the dictionary of to_json.
+        """
+        return cls(_unpack(value["times"]) / TICKS_PER_SECOND, _unpack(value["keyframes"]))
+
+
+def probe_frame_index(probe_path, source):
+    """
+    Indexes a video by reading its packet headers with ffprobe. Packets that are flagged to be discarded,
+    like the ones an edit list skips, are not frames of the video and left out.
+
+    Parameters
+    ----------
+        probe_path: string
+            The path to the ffprobe executable.
+
+        source: string
+            The file or url of the video.
+
+    Returns
+    ----------
+        index: FrameIndex
+            The index of the first video stream.
+    """
+    command = (f"{probe_path} -v error -select_streams v:0 -show_entries packet=pts_time,flags -of csv=p=0 "
+               f"{source}")
+    out = subprocess.check_output(command, shell=True).decode("utf-8")
+    times = []
+    flags = []
+    for line in out.splitlines():
+        pts_time, _, flag = line.partition(',')
+        if pts_time not in ('', 'N/A') and 'D' not in flag:
+            times.append(float(pts_time))
+            flags.append('K' in flag)
+    return FrameIndex.from_packets(times, flags)
+
+
+def moov_frame_index(client, bucket, key):
+    """
+    Indexes an MP4 or MOV object in S3 from the sample table of its video track, fetching only the moov box.
+    Samples that the edit list cuts off before the start are left out, like ffprobe does.
+
+    Parameters
+    ----------
+        client: botocore client
+            The S3 client used for the ranged GETs.
+
+        bucket: string
+            The bucket of the object.
+
+        key: string
+            The key of the object.
+
+    Returns
+    ----------
+        index: FrameIndex
+            The index, or None if the object has no moov index or an edit list that ffprobe has to resolve.
+    """
+    reader = RangeReader(client, bucket, key)
+    boxes = find_boxes(reader)
+    if "moov" not in boxes:
+        return None
+    track = next((track for track in parse_tracks(reader.read(*boxes["moov"])) if track["handler"] == "vide"), None)
+    if track is None or track["media_time"] is None:
+        return None
+    times = numpy.asarray(track["times"], numpy.float64)
+    if track["composition"] is not None:
+        composition = numpy.zeros(len(times))
+        offsets = track["composition"][:len(times)]
+        composition[:len(offsets)] = offsets
+        times += composition / track["timescale"]
+    times -= track["media_time"] / track["timescale"]
+    flags = numpy.ones(len(times), bool)
+    if track["keyframes"] is not None:
+        flags[:] = False
+        flags[[number for number in track["keyframes"] if number < len(times)]] = True
+    shown = times > -EPSILON
+    return FrameIndex.from_packets(times[shown], flags[shown])
+
@@ -0,0 +1,176 @@
+"""
+Module contains the ImageWriter class, which encodes and writes extracted frames on a thread pool.
+
+Encoding an image costs more than decoding it, PNG's zlib most of all. OpenCV releases the GIL while it
+encodes, so images are handed to a pool of writer threads and the decoder goes on with the next frame. The
+number of images waiting is bounded, so a fast decoder can't fill the memory. JPEG and WebP are written at
+a given quality and PNG at a given compression level, and the time and bytes spent are counted.
+
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# File extension and quality parameter of every format.
+FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def encoder_params(image_format="png", quality=None, compression=None):
+    """
+    Returns the file extension and the cv2.imencode parameters of an image format.
+
+    Parameters
+    ----------
+        image_format: string
+            "png", "jpeg" or "webp".
+
+        quality: int
+            JPEG or WebP quality. None keeps OpenCV's default.
+
+        compression: int
+            PNG compression level. None keeps OpenCV's default.
+
+    Returns
+    ----------
+        extension: string
+            The file extension, dot included.
+
+        params: list
+            The parameters for cv2.imencode.
+    """
+    if image_format not in FORMATS:
+        raise ValueError(f"Unknown image format {image_format}, use one of {', '.join(FORMATS)}")
+    extension, flag = FORMATS[image_format]
+    level = compression if image_format == "png" else quality
+    return extension, [flag, int(level)] if level is not None else []
+
+
+class ImageWriter:
+    """
+    ImageWriter encodes images on a thread pool and writes them to files. Use it as a context manager, or
+    call close, to wait for every image to be written.
+
+    Attributes
+    ----------
+        image_format: string
+            "png", "jpeg" or "webp".
+
+        quality: int
+            JPEG quality (0 to 100) or WebP quality (1 to 100). None keeps OpenCV's default.
+
+        compression: int
+            PNG compression level (0 to 9). None keeps OpenCV's default.
+
+        folder: string
+            None, images are written wherever their path points. Shard writers have a folder of their own.
+
+        stats: dict
+            The number of images, their bytes, the seconds spent encoding and writing them summed over
+            every thread, the wall seconds from the first image to close, and the number of errors.
+
+    Methods
+    ---------
+        write(path, image, meta) -> string:
+            Queues an image, blocking while the queue is full, and returns the file it will be written to.
+
+        close() -> dict:
+            Waits for every queued image and returns the stats.
+
+    """
+
+    def __init__(self, image_format="png", quality=None, compression=None, max_workers=4, queue_size=None):
+        self.image_format = image_format
+        self.quality = quality
+        self.compression = compression
+        self.extension, self.params = encoder_params(image_format, quality, compression)
+        self.folder = None
+        self.stats = {"images": 0, "bytes": 0, "encode_seconds": 0.0, "write_seconds": 0.0, "seconds": 0.0,
+                      "errors": 0}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(queue_size or 2 * max_workers)
+        self._lock = threading.Lock()
+        self._start = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, path, image, meta=None):
+        """
+        Queues an image to be encoded and written. Blocks while the queue is full.
+
+        Parameters
+        ----------
+            path: string
+                The file path without extension. The extension of the format is added.
+
+            image: numpy.ndarray
+                The image in BGR, or grayscale. It must not be changed until it is written.
+
+            meta: dict
+                The video, frame and timestamp of the image. Only shards index it (see aEye.shards).
+
+        Returns
+        ----------
+            file_path: string
+                The file the image is written to.
+        """
+        if self._start is None:
+            self._start = time.perf_counter()
+        file_path = path + self.extension
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(self._encode, file_path, image)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return file_path
+
+    def _encode(self, file_path, image):
+        """
+        Encodes one image and writes it, adding the time and bytes to the stats.
+        """
+        try:
+            start = time.perf_counter()
+            ret, data = cv2.imencode(self.extension, image, self.params)
+            if not ret:
+                raise ValueError("the encoder failed")
+            encoded = time.perf_counter()
+            with open(file_path, "wb") as f:
+                f.write(data)
+            written = time.perf_counter()
+            with self._lock:
+                self.stats["images"] += 1
+                self.stats["bytes"] += len(data)
+                self.stats["encode_seconds"] += encoded - start
+                self.stats["write_seconds"] += written - encoded
+        except Exception as e:
+            logging.error(f"Cannot write image {file_path}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+
+    def close(self):
+        """
+        Waits for every queued image to be written and shuts the pool down.
+
+        Returns
+        ----------
+            stats: dict
+                The stats of every image written.
+        """
+        self._pool.shutdown(wait=True)
+        if self._start is not None:
+            self.stats["seconds"] = time.perf_counter() - self._start
+        logging.info(f"Wrote {self.stats['images']} {self.image_format} images, {self.stats['bytes']} bytes, "
+                     f"{self.stats['encode_seconds']:.2f}s encoding")
+        return self.stats
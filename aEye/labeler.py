@@ -1,6 +1,8 @@
 import logging
 import math
 import subprocess
+from aEye.planner import SEEK_MODES, Stage, is_terminal
+from aEye.video import Video
 
 
 class Labeler:
@@ -11,6 +13,10 @@ class Labeler:
     label will be run. This does not apply for multiple video_filter labels, as those are
     turned into a complex filter and applied sequentially.
 
+    Trims are run with input-side seeking, so long sources are not decoded up to the start point. Pass
+    seek_mode="fast" to start on the nearest keyframe instead of the exact frame. With partial_fetch, trims
+    of S3 videos only download the part of the object around the cut (see aEye.partial_fetch).
+
     Methods
     -------
 
@@ -22,23 +28,23 @@ class Labeler:
         Takes a list and a "typical" resolution label like 720p or 360p and resizes the
         video to common aspect ratios.
 
-    trim_video_start_end(video_list, start, end) -> List[Video]:
+    trim_video_start_end(video_list, start, end, smart_cut) -> List[Video]:
         Given start and end times in seconds, modified a trimmed down version of
-        the video to the modified file.
+        the video to the modified file. With smart_cut, only the GOPs at both ends are re-encoded.
 
-    trim_into_clips(video_list, interval) -> List[Video]:
+    trim_into_clips(video_list, interval, stream_copy, max_drift) -> List[Video]:
         Splits the video into X second clips, sends all these clips to output
         folder.
-        *will re-encode
+        *will re-encode, unless stream_copy is set and the existing keyframes are close enough to the interval
 
     trim_on_frame(video_list, frame) -> List[Video]:
         Given a specific frame, start the video there, removes any preceding frames.
         *will re-encode
 
-    trim_num_frames(video_list, start_frame, num_frames) -> List[Video]:
+    trim_num_frames(video_list, start_frame, num_frames, smart_cut) -> List[Video]:
         Given a start frame and the amount of frames that a user wants to copy, splits the video to all of the frames
         within that frame range.
-        *will re-encode
+        *will re-encode, unless smart_cut is set and this is the only label
 
     crop_video_section(video_list, width, height, start_x, start_y) -> List[Video]:
         Create a width x height crop of the input video starting at pixel values start_x, start_y and sends the
@@ -56,6 +62,10 @@ class Labeler:
         Change the video frames per second. Lowering the FPS from the original video will not reencode all
         original frames at the new framerate, but rather will drop i/b frames to achieve the original duration.
 
+    branch(video_list, names) -> Dict[str, List[Video]]
+        Attach named output branches to every video. Each branch takes its own labels, and all branches of
+        one source are executed as a single FFmpeg process that decodes the source once.
+
     Examples
     --------
 
@@ -80,11 +90,29 @@ class Labeler:
     set_bitrate(s3_video, 1500) -> Reencodes videos at 1500 KB/s (1.5MB/s) bitrate
 
     change_fps(s3_video, 24) -> Reencodes video at 24 frames per second
+
+    branch(s3_videos, ['720p', '480p']) -> {'720p': [...], '480p': [...]}, label each list separately
     """
 
-    def __init__(self) -> None:
+    def __init__(self, seek_mode='frame-exact', partial_fetch=False) -> None:
+        """
+        Parameters
+        ----------
+
+        seek_mode : string
+            How the trim labels reach their start point. "frame-exact" seeks the input to the keyframe
+            before the start and decodes up to the exact frame. "fast" starts on that keyframe, which can be a
+            little early. None decodes and throws away everything before the start, like older versions.
+
+        partial_fetch : boolean
+            Whether trims of MP4/MOV videos in S3 fetch only the byte ranges of the cut, instead of reading
+            the object from the start. Needs input-side seeking, so it has no effect with seek_mode None.
+        """
+        if seek_mode not in SEEK_MODES:
+            raise ValueError(f"seek_mode must be one of {SEEK_MODES}, not {seek_mode!r}")
+        self.seek_mode = seek_mode
+        self.partial_fetch = partial_fetch
         logging.info("---aEye Video Label Maker v0---")
-        pass
 
     def resize_by_ratio(self, video_list, x_ratio=.8, y_ratio=.8):
         """
@@ -128,7 +156,7 @@ class Labeler:
 
         return video_list
 
-    def trim_video_start_end(self, video_list, start, end):
+    def trim_video_start_end(self, video_list, start, end, smart_cut=False):
         """
         Given a start time (start) and end time (end) in seconds, this will return a clip
         from start-end time stamps. *Note this works with b frames, there may be slight time offsets as a result
@@ -145,6 +173,10 @@ class Labeler:
         end        : Integer
             End time in seconds for where the clip should end.
 
+        smart_cut  : Boolean
+            If this is the only label on the video, stream copy every GOP inside the cut and only re-encode
+            the partial GOPs at both ends. Much faster than a full encode and keeps the original quality.
+
         Returns
         -------
 
@@ -155,6 +187,9 @@ class Labeler:
                 assert start < float(video.get_duration()) and start >= 0
                 duration = end - start
                 video.add_label(f"-ss {start} -t {duration} ")
+                video.seek_mode = self.seek_mode
+                video.partial_fetch = self.partial_fetch
+                video.smart_cut = smart_cut
                 video.add_output_title(f"trimmed_{start}_to_{end}_")
                 logging.info(f"Created a sub-video from {start} to {end}")
             except:
@@ -214,23 +249,35 @@ class Labeler:
 
         return video_list
 
-    def trim_into_clips(self, video_list, interval):
+    def trim_into_clips(self, video_list, interval, stream_copy=False, max_drift=1.0):
         """
         This method splits a video into *interval* second long clips, but for any remainder
         the last clip will be truncated. Interval should be in seconds! For example: A 43 second long video with a
         10 second interval will produce 5 modified: 4 ten second clips, and one three second long one, rather
         than filling with black space.
 
+        With stream_copy, the clips are cut on the keyframes the video already has, closest to every multiple of
+        interval, and nothing is re-encoded. This only happens when every clip boundary is within max_drift
+        seconds of the requested one and the video has no other labels. Otherwise the video is re-encoded with
+        forced keyframes like without stream_copy. The (requested, actual) boundaries are kept in
+        video.clip_boundaries either way.
+
         Parameters
         -------
 
-        video_list : List[Video]
+        video_list  : List[Video]
             List of all video objects loaded for processing.
 
-        interval   : Float
+        interval    : Float
             The clip interval in seconds. Note, this will not be 100% accurate, as it will split on
             he nearest frame its possible to split on.
 
+        stream_copy : Boolean
+            Whether to cut on existing keyframes without re-encoding, when the GOP structure allows it.
+
+        max_drift   : Float
+            The largest distance in seconds between a requested and an actual boundary for stream_copy.
+
         Returns
         -------
 
@@ -239,14 +286,63 @@ class Labeler:
         for video in video_list:
             try:
                 assert interval > 0
-                video.add_label(
-                    f" -c:a aac -vsync vfr -reset_timestamps 1 -segment_time {interval} -g {interval} -sc_threshold 0 -force_key_frames 'expr:gte(t,n_forced*{interval})' -f segment ")
+                boundaries = None
+                if stream_copy and video.label == '' and not video.complex_filter:
+                    boundaries = self._keyframe_boundaries(video, interval)
+                    drift = max((abs(actual - requested) for requested, actual in boundaries), default=0.0)
+                    if drift > max_drift:
+                        logging.info(f"Keyframes of video {video} are up to {round(drift, 3)}s off every {interval}s, "
+                                     f"re-encoding instead")
+                        boundaries = None
+                if boundaries is not None:
+                    segment_times = ",".join(str(actual) for _, actual in boundaries)
+                    video.add_label(f" -c copy -reset_timestamps 1 -segment_times {segment_times} -f segment ")
+                    video.clip_boundaries = boundaries
+                else:
+                    video.add_label(
+                        f" -c:a aac -vsync vfr -reset_timestamps 1 -segment_time {interval} -g {interval} -sc_threshold 0 -force_key_frames 'expr:gte(t,n_forced*{interval})' -f segment ")
+                    clip_count = math.ceil(float(video.get_duration()) / interval)
+                    video.clip_boundaries = [(n * interval, n * interval) for n in range(1, clip_count)]
                 video.add_output_title(f"trimmed_{interval}_clips_")
                 logging.info(f"Video has been trimmed into {interval} second long clips!")
             except:
                 logging.error(f" Video {video} cannot have trim applied with {interval} as a constraint!")
         return video_list
 
+    def _keyframe_boundaries(self, video, interval):
+        """
+        Picks the existing keyframe closest to every multiple of interval inside the video.
+
+        Parameters
+        -------
+
+        video    : Video
+            The video to split.
+
+        interval : Float
+            The clip interval in seconds.
+
+        Returns
+        -------
+
+        List of (requested, actual) boundary times in seconds
+        """
+        keyframes = [k for k in video.get_keyframes() if k > 0]
+        duration = float(video.get_duration())
+        boundaries = []
+        requested = interval
+        while requested < duration:
+            if not keyframes:
+                boundaries.append((requested, duration))
+            else:
+                actual = min(keyframes, key=lambda k: abs(k - requested))
+                if boundaries and actual <= boundaries[-1][1]:
+                    # Two boundaries landed on the same keyframe, so this clip disappears.
+                    actual = duration
+                boundaries.append((requested, actual))
+            requested += interval
+        return boundaries
+
     def trim_on_frame(self, video_list, frame):
         """
         Given a frame, this method will create a video starting at that specific
@@ -270,16 +366,17 @@ class Labeler:
         for video in video_list:
             try:
                 assert 0 <= frame <= int(video.get_num_frames())
-                fps = float(video.get_num_frames()) / float(video.get_duration())
-                time_stamp = frame / fps
+                time_stamp = video.get_frame_time(frame)
                 video.add_label(f"-ss {time_stamp} ")
+                video.seek_mode = self.seek_mode
+                video.partial_fetch = self.partial_fetch
                 video.add_output_title(f"trimmed_on_frame_{frame}_")
                 logging.info(f"Split video at frame {frame}")
             except:
                 logging.error(f" Cannot trim video {video} on frame {frame}!")
         return video_list
 
-    def trim_num_frames(self, video_list, start_frame, num_frames):
+    def trim_num_frames(self, video_list, start_frame, num_frames, smart_cut=False):
         """
         Given a passed frame (start_Frame), and a duration (num_frames), which in this instance is the number of
         frames to crop to, it will send a cropped video to the output folder.
@@ -298,6 +395,10 @@ class Labeler:
             This is the number of frames that will be in the clip. For example, if num_frames is 60
             and the video FPS is 30, this will create a two second clip.
 
+        smart_cut   : Boolean
+            If this is the only label on the video, stream copy every GOP inside the cut and only re-encode
+            the partial GOPs at both ends. The frame count is turned into an end time.
+
         Returns
         -------
 
@@ -306,11 +407,13 @@ class Labeler:
         for video in video_list:
             try:
                 assert start_frame > 0 and int(start_frame + num_frames) < int(video.get_num_frames())
-                fps = float(video.get_num_frames()) / float(video.get_duration())
-                time_stamp = start_frame / fps
+                time_stamp = video.get_frame_time(start_frame)
                 logging.info(f"Encoding {num_frames} from {start_frame}")
                 video.add_output_title(f"trim_frames_{start_frame}_to_{start_frame + num_frames}_")
                 video.add_label(f"-ss {str(time_stamp)} -frames:v {num_frames} ")
+                video.seek_mode = self.seek_mode
+                video.partial_fetch = self.partial_fetch
+                video.smart_cut = smart_cut
             except:
                 logging.error(f" Cannot create a {num_frames} trim starting on frame {start_frame} for video {video}")
         return video_list
@@ -512,4 +615,39 @@ class Labeler:
                 logging.error(f" Cannot convert {video} to raw!")
         return video_list
 
+    def branch(self, video_list, names):
+        """
+        Attaches one named output branch per name to every video. A branch is a planned video that starts
+        from the current output of its source, with the labels still pending on the source applied, so labels
+        applied to it don't touch the source or the other branches. When the branches are executed together,
+        Aux writes all branches of a source with a single FFmpeg process: the source is decoded once, the
+        filters it had pending run once, and a split filter feeds every branch.
+        Sources with segment or raw labels can't be read back, so they can't be branched.
 
+        Parameters
+        ----------
+
+        video_list : List[Video]
+            List of all videos to branch.
+
+        names      : List[str]
+            The branch names. Each name is added to the output title of its branch.
+
+        Returns
+        ----------
+
+        Dictionary of branch name to the list of branch videos, in the same order as video_list
+        """
+        branches = {name: [] for name in names}
+        for video in video_list:
+            if is_terminal(video.get_label()):
+                raise ValueError(f"Video {video} has segment or raw labels pending, which can't be branched")
+            stage = Stage(video, video.get_label(), video.complex_filter)
+            for name in names:
+                new_video = Video(video.file, video.bucket, video.key, video.title)
+                new_video.path = video.path
+                new_video.stage = stage
+                new_video.add_output_title(f"{video.out_title}{name}_")
+                branches[name].append(new_video)
+            logging.info(f"Attached branches {names} to video {video}")
+        return branches
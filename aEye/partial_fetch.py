@@ -0,0 +1,320 @@
+"""
+Module contains the partial fetch of S3 videos, which reads only the part of an object that a trim or frame grab needs.
+
+The moov box of an MP4 or MOV file holds the sample table of every track: the time, size and byte offset of
+every sample, and which samples are keyframes. A requested time range is widened to the keyframes around
+it, and only the samples in that window are fetched with ranged GETs, together with the moov box and the
+first bytes of the media data that ffmpeg and OpenCV read when they open a file. Everything is written to
+a sparse local file at its original offset, so seeking by the index lands on real data. Bytes transferred
+scale with the requested duration instead of the object size. Other containers, and fragmented files
+whose index is not in the moov box, are read through a presigned url as before.
+
+"""
+
+import contextlib
+import logging
+import os
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from aEye.remote_probe import PROBE_BYTES, RangeReader, find_boxes
+from aEye.smart_cut import run_commands
+
+# Stands for the input file in the command of a partial fetch job, until the sparse copy exists.
+SOURCE_PLACEHOLDER = "{source}"
+
+# Seconds of samples fetched on both sides of the keyframe window, for audio interleaved around the cut.
+MARGIN = 0.5
+
+# Ranges closer than this are fetched as one GET.
+MERGE_GAP = 256 * 1024
+
+# Ranged GETs running at once for one video.
+MAX_WORKERS = 8
+
+# Boxes on the way from moov to the sample tables and the edit list.
+CONTAINER_BOXES = (b"trak", b"edts", b"mdia", b"minf", b"stbl")
+
+
+def _boxes(data, start, end):
+    """
+    Yields the type, payload start and end of every box between start and end.
+    """
+    while start + 8 <= end:
+        size, box = struct.unpack(">I4s", data[start:start + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[start + 8:start + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield box, start + header, start + size
+        start += size
+
+
+def _table(data, start, fields, count_offset=4):
+    """
+    Reads a full box table of count rows with the given struct fields.
+    """
+    count = struct.unpack(">I", data[start + count_offset:start + count_offset + 4])[0]
+    row = struct.calcsize(">" + fields)
+    begin = start + count_offset + 4
+    return list(struct.iter_unpack(">" + fields, data[begin:begin + count * row]))
+
+
+def parse_tracks(moov):
+    """
+    Reads the sample table of every track in a moov box.
+
+    Parameters
+    ----------
+        moov: bytes
+            The whole moov box, header included.
+
+    Returns
+    ----------
+        tracks: list
+            One dictionary per track with its handler ('vide', 'soun', ...), the decode time, offset and size
+            of every sample, and the set of keyframe sample indexes (None if every sample is a keyframe).
+            The timescale, the composition offset of every sample (None without a ctts box) and the media time
+            the edit list starts at (None if the edit list has empty or several edits) give the presentation
+            times (see aEye.frame_index).
+    """
+    tracks = []
+    for box, start, end in _boxes(moov, 0, len(moov)):
+        if box != b"moov":
+            continue
+        for trak, trak_start, trak_end in _boxes(moov, start, end):
+            if trak == b"trak":
+                tracks.append(_parse_track(moov, trak_start, trak_end))
+    return [track for track in tracks if track is not None]
+
+
+def _parse_track(data, start, end):
+    """
+    Reads the sample table of one trak box, or returns None if it has none.
+    """
+    found = {}
+
+    def walk(begin, stop):
+        for box, payload, box_end in _boxes(data, begin, stop):
+            if box in CONTAINER_BOXES:
+                walk(payload, box_end)
+            else:
+                found.setdefault(box, payload)
+
+    walk(start, end)
+    if not {b"mdhd", b"hdlr", b"stts", b"stsc", b"stsz"} <= found.keys() or not ({b"stco", b"co64"} & found.keys()):
+        return None
+
+    mdhd = found[b"mdhd"]
+    timescale = struct.unpack(">I", data[mdhd + 20:mdhd + 24] if data[mdhd] == 1 else data[mdhd + 12:mdhd + 16])[0]
+    handler = data[found[b"hdlr"] + 8:found[b"hdlr"] + 12].decode("latin-1")
+
+    stsz = found[b"stsz"]
+    sample_size, count = struct.unpack(">II", data[stsz + 4:stsz + 12])
+    if sample_size == 0:
+        sizes = [size for size, in struct.iter_unpack(">I", data[stsz + 12:stsz + 12 + 4 * count])]
+    else:
+        sizes = [sample_size] * count
+
+    times = []
+    dts = 0
+    for run, delta in _table(data, found[b"stts"], "II"):
+        for _ in range(run):
+            times.append(dts / timescale)
+            dts += delta
+
+    if b"co64" in found:
+        chunk_offsets = [offset for offset, in _table(data, found[b"co64"], "Q")]
+    else:
+        chunk_offsets = [offset for offset, in _table(data, found[b"stco"], "I")]
+    runs = _table(data, found[b"stsc"], "III")
+    offsets = []
+    for i, (first_chunk, per_chunk, _) in enumerate(runs):
+        last_chunk = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(per_chunk):
+                if len(offsets) == len(sizes):
+                    break
+                offsets.append(offset)
+                offset += sizes[len(offsets) - 1]
+
+    keyframes = None
+    if b"stss" in found:
+        keyframes = {number - 1 for number, in _table(data, found[b"stss"], "I")}
+    composition = None
+    if b"ctts" in found:
+        ctts = found[b"ctts"]
+        composition = [offset for run, offset in _table(data, ctts, "Ii" if data[ctts] == 1 else "II")
+                       for _ in range(run)]
+    media_time = 0
+    if b"elst" in found:
+        elst = found[b"elst"]
+        edits = _table(data, elst, "QqI" if data[elst] == 1 else "IiI")
+        media_time = edits[0][1] if len(edits) == 1 and edits[0][1] >= 0 else None
+    count = min(len(times), len(offsets), len(sizes))
+    return {"handler": handler, "times": times[:count], "offsets": offsets[:count], "sizes": sizes[:count],
+            "keyframes": keyframes, "timescale": timescale, "composition": composition, "media_time": media_time}
+
+
+def byte_ranges(tracks, start, end):
+    """
+    Maps a time range to the byte ranges of the samples that decoding it needs.
+
+    Parameters
+    ----------
+        tracks: list
+            The tracks from parse_tracks.
+
+        start: float
+            Start of the range in seconds.
+
+        end: float
+            End of the range in seconds.
+
+    Returns
+    ----------
+        ranges: list
+            Sorted (offset, length) pairs, with ranges closer than MERGE_GAP joined.
+    """
+    window_start, window_end = start, end
+    for track in tracks:
+        if track["handler"] != "vide" or not track["keyframes"]:
+            continue
+        key_times = sorted(track["times"][i] for i in track["keyframes"])
+        before = [time for time in key_times if time <= start]
+        after = [time for time in key_times if time > end]
+        window_start = min(window_start, before[-1] if before else 0.0)
+        window_end = max(window_end, after[0] if after else float("inf"))
+    window_start -= MARGIN
+    window_end += MARGIN
+
+    samples = sorted((offset, size) for track in tracks
+                     for time, offset, size in zip(track["times"], track["offsets"], track["sizes"])
+                     if window_start <= time <= window_end)
+    ranges = []
+    for offset, size in samples:
+        if ranges and offset <= ranges[-1][0] + ranges[-1][1] + MERGE_GAP:
+            ranges[-1][1] = max(ranges[-1][1], offset + size - ranges[-1][0])
+        else:
+            ranges.append([offset, size])
+    return [tuple(r) for r in ranges]
+
+
+def fetch_partial(client, video, start, end, workdir):
+    """
+    Writes a sparse local copy of an S3 video that holds everything needed to read from start to end.
+
+    Parameters
+    ----------
+        client: botocore client
+            The S3 client used for the ranged GETs.
+
+        video: Video
+            The S3 video.
+
+        start: float
+            Start of the range in seconds.
+
+        end: float
+            End of the range in seconds.
+
+        workdir: string
+            The folder to write the copy to.
+
+    Returns
+    ----------
+        file_path: string
+            The sparse copy, or None if the object has no usable moov index.
+    """
+    reader = RangeReader(client, video.bucket, video.key)
+    boxes = find_boxes(reader)
+    if "moov" not in boxes:
+        return None
+    moov_offset, moov_size = boxes["moov"]
+    tracks = parse_tracks(reader.read(moov_offset, moov_size))
+    if not tracks:
+        return None
+
+    ranges = byte_ranges(tracks, start, end)
+    # Opening a file reads its first packets, so those are fetched too.
+    first = min(track["offsets"][0] for track in tracks if track["offsets"])
+    ranges.append((first, min(PROBE_BYTES, reader.size - first)))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        list(pool.map(lambda r: reader.read(*r), ranges))
+
+    file_path = os.path.join(workdir, f"partial{os.path.splitext(video.key)[1]}")
+    reader.write_sparse(file_path)
+    video.fetch_bytes = reader.bytes_read
+    logging.info(f"Fetched {reader.bytes_read} of {reader.size} bytes of {video} for {start}s to {end}s")
+    return file_path
+
+
+@contextlib.contextmanager
+def partial_source(client, video, start, end):
+    """
+    Gives the location to read start to end of an S3 video from: a sparse partial copy that is removed
+    afterwards, or the presigned url if the object can't be fetched in part.
+
+    Parameters
+    ----------
+        client: botocore client
+            The S3 client used for the ranged GETs.
+
+        video: Video
+            The S3 video.
+
+        start: float
+            Start of the range in seconds.
+
+        end: float
+            End of the range in seconds.
+
+    Returns
+    ----------
+        file_path: string
+            The location to read the video from.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        file_path = None
+        try:
+            file_path = fetch_partial(client, video, start, end, workdir)
+        except Exception as e:
+            logging.error(f"Cannot fetch part of {video}, streaming it instead: {e}")
+        if file_path is None:
+            file_path = video.get_presigned_url()
+        yield file_path
+
+
+def run_partial(client, video, start, end, command):
+    """
+    Runs an ffmpeg command on a partial copy of an S3 video.
+
+    Parameters
+    ----------
+        client: botocore client
+            The S3 client used for the ranged GETs.
+
+        video: Video
+            The S3 video.
+
+        start: float
+            Start of the range the command reads, in seconds.
+
+        end: float
+            End of the range the command reads, in seconds.
+
+        command: string
+            The ffmpeg command line, with SOURCE_PLACEHOLDER as its input.
+
+    Returns
+    ----------
+        process: subprocess.CompletedProcess
+            The result of the command.
+    """
+    with partial_source(client, video, start, end) as source:
+        return run_commands([command.replace(SOURCE_PLACEHOLDER, source)])
@@ -0,0 +1,154 @@
+"""
+Module contains the ffmpeg pipe decoder, an Extractor backend that has ffmpeg decode a video and reads the frames
+from a pipe as raw pixels.
+
+ffmpeg seeks on the input side, decodes with as many threads as the codec allows, and drops, scales and converts
+the frames in its filter graph, so Python only receives the pixels it asked for. Frames have a fixed size, so
+they are read with readinto straight into one preallocated NumPy array, a whole batch per call, that every
+batch reuses. ffmpeg's stderr is drained on a thread, so a chatty decoder can't fill the pipe and stall.
+
+"""
+
+import logging
+import subprocess
+import threading
+import numpy
+
+# Channels of every pixel format the decoder can output.
+CHANNELS = {"bgr24": 3, "rgb24": 3, "bgra": 4, "rgba": 4, "gray": 1}
+
+
+def decode_command(ffmpeg, source, start=0.0, num_frames=None, stride=1, size=None, pix_fmt="bgr24", threads=0):
+    """
+    Builds the ffmpeg command that writes the frames of a video to stdout as raw pixels.
+
+    Parameters
+    ----------
+        ffmpeg: string
+            The path to the ffmpeg executable.
+
+        source: string
+            The file or url of the video.
+
+        start: float
+            The time in seconds to start from. Frames before it are decoded but not output.
+
+        num_frames: int
+            The number of frames to output, None for every frame up to the end.
+
+        stride: int
+            Distance between output frames. 1 outputs every frame.
+
+        size: (int, int)
+            (width, height) the frames are scaled to, None to keep the size of the video.
+
+        pix_fmt: string
+            The pixel format of the output, one of CHANNELS.
+
+        threads: int
+            The decoder threads, 0 to let ffmpeg pick.
+
+    Returns
+    ----------
+        command: string
+            The command line.
+    """
+    filters = []
+    if stride > 1:
+        filters.append(f"select='not(mod(n\\,{stride}))'")
+    if size is not None:
+        filters.append(f"scale={size[0]}:{size[1]}:flags=area")
+    vf = f"-vf \"{','.join(filters)}\" " if filters else ""
+    frames = f"-frames:v {num_frames} " if num_frames is not None else ""
+    return (f"{ffmpeg} -v error -nostdin -threads {threads} -ss {start} -i '{source}' -map 0:v:0 {vf}"
+            f"-vsync passthrough {frames}-f rawvideo -pix_fmt {pix_fmt} -")
+
+
+def _fill(stream, view):
+    """
+    Reads from a stream until view is full or the stream ends, and returns the number of bytes read.
+    """
+    filled = 0
+    while filled < len(view):
+        read = stream.readinto(view[filled:])
+        if not read:
+            break
+        filled += read
+    return filled
+
+
+def _drain(stream, chunks):
+    """
+    Reads a stream to its end into a list of chunks.
+    """
+    for chunk in iter(lambda: stream.read(65536), b""):
+        chunks.append(chunk)
+
+
+def decode_batches(command, frame_shape, batch_size, count=None, out=None):
+    """
+    Runs a decode command and reads its frames in batches of at most batch_size frames into one array.
+    Every batch is a view of that array and is overwritten by the next one, so copy a batch to keep it.
+    Stops after the first batch that comes up short, which is where the video ended. ffmpeg is stopped
+    when the generator is closed early.
+
+    Parameters
+    ----------
+        command: string
+            The command from decode_command.
+
+        frame_shape: tuple
+            (height, width, channels) of one output frame.
+
+        batch_size: int
+            The largest number of frames in a batch.
+
+        count: int
+            The number of frames to read, None for every frame ffmpeg outputs.
+
+        out: numpy.ndarray
+            A uint8 array of at least batch_size frames of frame_shape to read the batches into. None
+            allocates one.
+
+    Returns
+    ----------
+        frames: numpy.ndarray
+            Yields one (N, height, width, channels) view of out per batch.
+    """
+    frame_bytes = int(numpy.prod(frame_shape))
+    if count is not None:
+        batch_size = max(min(batch_size, count), 0)
+    if out is None:
+        out = numpy.empty((batch_size,) + tuple(frame_shape), numpy.uint8)
+    elif out.dtype != numpy.uint8 or out.shape[1:] != tuple(frame_shape) or len(out) < batch_size \
+            or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a contiguous uint8 array of at least {batch_size} frames of {frame_shape}")
+    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = []
+    drain = threading.Thread(target=_drain, args=(process.stderr, errors), daemon=True)
+    drain.start()
+    done = 0
+    ended = False
+    try:
+        while True:
+            length = batch_size if count is None else max(min(batch_size, count - done), 0)
+            frames = out[:length]
+            filled = _fill(process.stdout, memoryview(frames).cast("B")) // frame_bytes
+            ended = filled < length
+            done += filled
+            yield frames[:filled]
+            if ended or (count is not None and done >= count):
+                return
+    finally:
+        if not ended:
+            # The frames that were asked for are read, ffmpeg's output after them is not needed.
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        drain.join()
+        process.stderr.close()
+        error = b"".join(errors).decode("utf-8", "replace").strip()
+        if ended and process.returncode != 0:
+            logging.error(f"ffmpeg stopped after {done} frames: {error}")
+            if done == 0:
+                raise IOError(f"Cannot decode video: {error}")
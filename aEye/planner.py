@@ -0,0 +1,496 @@
+"""
+Module contains the Stage class and the helpers that fuse lazily executed labels into a single ffmpeg pass.
+
+A lazy Aux.execute_label_and_write_local does not run ffmpeg. It returns planned videos that remember
+the labels they came from as a Stage. When a planned video is finally executed, the whole chain of stages
+is compiled into one ffmpeg command: trims are combined into a single time offset and duration, filters
+are concatenated in order and encode options are kept in order, so later ones win. Frame counts are turned
+into times with the frame index of the source (see aEye.frame_index), so they stay exact at variable frame
+rates, and with the average frame rate where there is no index or the filters change the frame rate.
+
+"""
+
+import copy
+import logging
+import re
+import shlex
+
+# Labels that produce outputs ffmpeg cannot read back as a single input. These always end a plan.
+TERMINAL_LABELS = ('-f segment', 'rawvideo')
+
+# How a trim start is reached. "frame-exact" seeks the input to the keyframe before the start and decodes
+# up to the exact frame, "fast" starts on that keyframe. None keeps the seek on the output side, which
+# decodes and throws away everything before the start.
+SEEK_MODES = ('frame-exact', 'fast', None)
+
+SEEK_PATTERN = re.compile(r"(?:^|\s)-ss\s+(\S+)")
+
+
+class Stage:
+    """
+    Stage is one lazily executed generation of a video: the source video and the labels that were
+    pending on it when it was executed.
+
+    Attributes
+    ----------
+        source: Video
+            A snapshot of the video the labels were applied to, taken before the execute.
+
+        label: string
+            The pending label string, without the complex filter.
+
+        filters: list
+            The pending complex filter steps.
+
+    """
+
+    def __init__(self, source, label, filters):
+        self.source = copy.copy(source)
+        self.label = label
+        self.filters = list(filters)
+
+
+def is_terminal(label):
+    """
+    Checks whether a label has to be the last generation of a plan.
+
+    Parameters
+    ----------
+        label: string
+            The label string of a video.
+
+    Returns
+    ----------
+        terminal: boolean
+            True if the label segments the video or converts it to raw.
+    """
+    return any(terminal in label for terminal in TERMINAL_LABELS)
+
+
+def parse_label(label):
+    """
+    Splits a label string into its trim values and the remaining encode options.
+
+    Parameters
+    ----------
+        label: string
+            The label string of a video.
+
+    Returns
+    ----------
+        start: float
+            The -ss offset in seconds, 0 if there is none.
+
+        duration: float
+            The -t duration in seconds, None if there is none.
+
+        frames: int
+            The -frames:v count, None if there is none.
+
+        options: list
+            Every other token of the label, in order.
+    """
+    start, duration, frames = 0.0, None, None
+    options = []
+    tokens = shlex.split(label)
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == '-ss':
+            start = float(tokens[i + 1])
+            i += 2
+        elif tokens[i] == '-t':
+            duration = float(tokens[i + 1])
+            i += 2
+        elif tokens[i] == '-frames:v':
+            frames = int(tokens[i + 1])
+            i += 2
+        else:
+            options.append(tokens[i])
+            i += 1
+    return start, duration, frames, options
+
+
+def pop_seek(label):
+    """
+    Removes the -ss option from a label string, leaving every other option untouched.
+
+    Parameters
+    ----------
+        label: string
+            The label string of a video.
+
+    Returns
+    ----------
+        start: float
+            The -ss offset in seconds, None if there is none. Like ffmpeg, the last one wins.
+
+        label: string
+            The label string without any -ss option.
+    """
+    starts = SEEK_PATTERN.findall(label)
+    if not starts:
+        return None, label
+    return float(starts[-1]), SEEK_PATTERN.sub(" ", label).lstrip()
+
+
+def input_seek(start, seek_mode):
+    """
+    Creates the input options that seek to a start time before the source is opened.
+
+    Parameters
+    ----------
+        start: float
+            The offset in seconds.
+
+        seek_mode: string
+            "frame-exact" or "fast".
+
+    Returns
+    ----------
+        label: string
+            The options to put in front of -i.
+    """
+    if seek_mode == 'fast':
+        return f"-noaccurate_seek -ss {start} "
+    return f"-ss {start} "
+
+
+def seek_mode_of(video):
+    """
+    Finds the seek mode of a video. Planned videos use the first mode that is set along their chain.
+
+    Parameters
+    ----------
+        video: Video
+            A video or planned video.
+
+    Returns
+    ----------
+        seek_mode: string
+            One of SEEK_MODES.
+    """
+    while video is not None:
+        if video.seek_mode is not None:
+            return video.seek_mode
+        video = video.stage.source if video.stage is not None else None
+    return None
+
+
+def output_fps(fps, filters):
+    """
+    Works out the frame rate after a list of complex filter steps.
+
+    Parameters
+    ----------
+        fps: float
+            The frame rate going into the filters.
+
+        filters: list
+            The complex filter steps.
+
+    Returns
+    ----------
+        fps: float
+            The frame rate coming out of the filters.
+    """
+    for step in filters:
+        if step.startswith('fps='):
+            fps = float(step.strip().split('=')[1])
+    return fps
+
+
+def output_size(width, height, filters):
+    """
+    Works out the frame size after a list of complex filter steps.
+
+    Parameters
+    ----------
+        width: int
+            The width going into the filters.
+
+        height: int
+            The height going into the filters.
+
+        filters: list
+            The complex filter steps.
+
+    Returns
+    ----------
+        size: tuple
+            The (width, height) coming out of the filters.
+    """
+    for step in filters:
+        name, _, args = step.strip().partition('=')
+        if name == 'scale':
+            args = args.split(',')[0].split(':flags')[0]
+            width, height = (int(v) for v in args.replace('x', ':').split(':')[:2])
+        elif name == 'crop':
+            width, height = (int(v) for v in args.split(':')[:2])
+    return width, height
+
+
+def derived_metadata(video):
+    """
+    Builds the metadata of a planned video from the metadata of its source, without probing a file
+    that does not exist yet. Only the first stream is adjusted.
+
+    Parameters
+    ----------
+        video: Video
+            A planned video.
+
+    Returns
+    ----------
+        meta_data: dictionary
+            The expected metadata of the planned output.
+    """
+    stage = video.stage
+    source = stage.source
+    if source.meta_data is None:
+        source.extract_metadata()
+    meta_data = copy.deepcopy(source.meta_data)
+    stream = meta_data["streams"][0]
+
+    source_duration = float(stream["duration"])
+    fps = output_fps(float(stream["nb_frames"]) / source_duration, stage.filters)
+    start, duration, frames, options = parse_label(stage.label)
+
+    new_duration = max(source_duration - start, 0.0)
+    if duration is not None:
+        new_duration = min(new_duration, duration)
+    if frames is not None:
+        new_duration = min(new_duration, frames / fps)
+    nb_frames = int(round(new_duration * fps))
+
+    root, label, filters = fuse(_unlabeled(video))
+    index = None if _retimed(filters) else timeline_index(root)
+    if index is not None:
+        # The frames of the plan are the frames of its root from the fused start to the end of the trims.
+        offset, root_duration = parse_label(label)[:2]
+        end = index.time_of(len(index))
+        if root_duration is not None:
+            end = min(end, offset + root_duration)
+        new_duration = round(max(end - offset, 0.0), 6)
+        nb_frames = max(index.next_frame(end) - index.next_frame(offset), 0)
+
+    stream["width"], stream["height"] = output_size(int(stream["width"]), int(stream["height"]), stage.filters)
+    stream["duration"] = str(new_duration)
+    stream["nb_frames"] = str(nb_frames)
+    if "-b:v" in options:
+        stream["bit_rate"] = str(int(options[options.index("-b:v") + 1].rstrip("K")) * 1000)
+    if "format" in meta_data:
+        meta_data["format"]["duration"] = str(new_duration)
+    return meta_data
+
+
+def root_of(video):
+    """
+    Finds the snapshot of the original source that a planned video will be read from.
+
+    Parameters
+    ----------
+        video: Video
+            A planned video.
+
+    Returns
+    ----------
+        root: Video
+            The first video in the chain of stages that is not planned itself.
+    """
+    root = video
+    while root.stage is not None:
+        root = root.stage.source
+    return root
+
+
+def fuse(video):
+    """
+    Compiles a planned video and every stage above it into the label and filters of a single
+    ffmpeg pass over the original source.
+
+    Parameters
+    ----------
+        video: Video
+            A planned video, with its own pending labels.
+
+    Returns
+    ----------
+        root: Video
+            The snapshot of the video that the single pass reads from.
+
+        label: string
+            The fused label string.
+
+        filters: list
+            The fused complex filter steps.
+    """
+    generations = [(video.label, video.complex_filter)]
+    root = video
+    while root.stage is not None:
+        generations.append((root.stage.label, root.stage.filters))
+        root = root.stage.source
+    generations.reverse()
+
+    if root.meta_data is None:
+        root.extract_metadata()
+    stream = root.meta_data["streams"][0]
+    fps = float(stream["nb_frames"]) / float(stream["duration"])
+
+    start, duration, last_frames = 0.0, None, None
+    options = []
+    filters = []
+    for i, (label, steps) in enumerate(generations):
+        stage_start, stage_duration, stage_frames, stage_options = parse_label(label)
+        fps = output_fps(fps, steps)
+        options += stage_options
+        filters += steps
+
+        # Every generation trims the timeline of the generation before it, so offsets add up and
+        # the remaining duration can only shrink. Frame counts of earlier generations become durations.
+        start += stage_start
+        if duration is not None:
+            duration = max(duration - stage_start, 0.0)
+        limits = [d for d in (duration, stage_duration) if d is not None]
+        if stage_frames is not None:
+            if i == len(generations) - 1:
+                last_frames = stage_frames
+            else:
+                limits.append(_frames_duration(root, start, stage_frames, fps, filters))
+        duration = min(limits) if limits else None
+
+    label = shlex.join(options) + " " if options else ""
+    if start > 0:
+        label += f"-ss {round(start, 6)} "
+    if duration is not None:
+        label += f"-t {round(duration, 6)} "
+    if last_frames is not None:
+        label += f"-frames:v {last_frames} "
+    return root, label, filters
+
+
+def _unlabeled(video):
+    """
+    Returns a copy of a video without its pending labels, so fusing it only compiles its stages.
+    """
+    video = copy.copy(video)
+    video.label, video.complex_filter = '', []
+    return video
+
+
+def _retimed(filters):
+    """
+    Checks whether complex filter steps change the frame rate, which makes the frame index of the source
+    useless for the output.
+    """
+    return any(step.strip().startswith('fps=') for step in filters)
+
+
+def timeline_index(video):
+    """
+    Finds the frame index of a video that is not planned (see aEye.frame_index).
+
+    Parameters
+    ----------
+        video: Video
+            A video that is not planned.
+
+    Returns
+    ----------
+        index: FrameIndex
+            The index, or None if it can't be built, or if building it would mean reading a whole S3 object.
+    """
+    try:
+        return video.get_frame_index(low_io=True)
+    except Exception as e:
+        logging.error(f"Cannot index video {video}, its frames are timed by the average frame rate: {e}")
+        return None
+
+
+def planned_timeline(video):
+    """
+    Finds where the frames of a video are read from. A planned video doesn't exist yet, so its frames are
+    the frames of its root after the trims of its stages.
+
+    Parameters
+    ----------
+        video: Video
+            A video or planned video.
+
+    Returns
+    ----------
+        root: Video
+            The video the frames are read from.
+
+        offset: float
+            The time on the timeline of root that the video starts at.
+
+        index: FrameIndex
+            The frame index of root, or None if there is none or the stages change the frame rate.
+    """
+    if video.stage is None:
+        return video, 0.0, timeline_index(video)
+    root, label, filters = fuse(_unlabeled(video))
+    offset = parse_label(label)[0]
+    return root, offset, None if _retimed(filters) else timeline_index(root)
+
+
+def _frames_duration(root, start, frames, fps, filters):
+    """
+    Works out how long a number of frames starting at start on the timeline of root last.
+    """
+    index = None if _retimed(filters) else timeline_index(root)
+    if index is None:
+        return frames / fps
+    return index.time_of(index.next_frame(start) + frames) - start
+
+
+def frame_time(video, frame):
+    """
+    Turns a frame number of a video or planned video into the time it is shown at, by the frame index of the
+    file it is read from. The average frame rate is used where there is no index.
+
+    Parameters
+    ----------
+        video: Video
+            A video or planned video.
+
+        frame: int
+            The frame number, counted from 0.
+
+    Returns
+    ----------
+        time: float
+            The time in seconds.
+    """
+    root, offset, index = planned_timeline(video)
+    if index is None:
+        return frame * float(video.get_duration()) / float(video.get_num_frames())
+    return round(max(index.time_of(index.next_frame(offset) + frame) - offset, 0.0), 6)
+
+
+def frames_end(video, start, frames):
+    """
+    Turns a -frames:v count into the time the cut ends at: the start of the frame after the last one that
+    is output, by the frame index of the file the video is read from. The average frame rate is used where
+    there is no index.
+
+    Parameters
+    ----------
+        video: Video
+            The video that is cut.
+
+        start: float
+            The start of the cut in seconds.
+
+        frames: int
+            The number of frames in the cut.
+
+    Returns
+    ----------
+        end: float
+            The end of the cut in seconds.
+    """
+    root, offset, index = planned_timeline(video)
+    if index is None:
+        return start + frames * float(video.get_duration()) / float(video.get_num_frames())
+    return round(index.time_of(index.next_frame(offset + start) + frames) - offset, 6)
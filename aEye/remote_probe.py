@@ -0,0 +1,200 @@
+"""
+Module contains the low I/O probe of S3 videos, which reads only the bytes ffprobe needs instead of the whole object.
+
+MP4 and MOV files keep their whole index in the moov box, which can sit at the start or at the end of the file.
+The top level boxes are walked with small ranged GETs, the moov box and the first part of the media data are
+fetched, and ffprobe runs on a local sparse copy with every fetched range at its original offset. Sizes,
+offsets and the bit rate come out the same as for the full object. Other containers are probed on the
+presigned url with a bounded probe size.
+
+"""
+
+import json
+import logging
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import threading
+
+# Bytes read by the first ranged GET. Usually enough for the ftyp box and the header of the next box.
+HEADER_BYTES = 64 * 1024
+
+# Bytes of media data fetched after the moov box, enough for ffprobe to read the first frames.
+PROBE_BYTES = 256 * 1024
+
+# Top level boxes walked before giving up on finding the moov box.
+MAX_BOXES = 64
+
+STATISTICS_PATTERN = re.compile(r"Statistics: (\d+) bytes read")
+
+
+class RangeReader:
+    """
+    Fetches byte ranges of one S3 object and remembers every range it fetched. Ranges can be read from
+    several threads at once.
+    """
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.ranges = {}
+        self.bytes_read = 0
+        self.size = None
+        self._lock = threading.Lock()
+
+    def read(self, start, length):
+        """
+        Returns up to length bytes of the object from start, fetching only what hasn't been fetched yet.
+        """
+        with self._lock:
+            ranges = list(self.ranges.items())
+        for offset, data in ranges:
+            if offset <= start < offset + len(data):
+                cached = data[start - offset:start - offset + length]
+                if len(cached) == length or offset + len(data) >= self.size:
+                    return cached
+                return cached + self.read(offset + len(data), length - len(cached))
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{start + length - 1}")
+        data = response["Body"].read()
+        with self._lock:
+            if self.size is None:
+                self.size = int(response["ContentRange"].split("/")[1])
+            self.ranges[start] = data
+            self.bytes_read += len(data)
+        return data
+
+    def write_sparse(self, file_path):
+        """
+        Writes every fetched range to file_path at its original offset. The rest of the file is a hole,
+        so the local copy has the size of the object without taking its space.
+        """
+        with open(file_path, "wb") as local:
+            local.truncate(self.size)
+            for offset, data in self.ranges.items():
+                local.seek(offset)
+                local.write(data)
+
+
+def find_boxes(reader):
+    """
+    Walks the top level boxes of an ISO media file.
+
+    Returns
+    ----------
+        boxes: dict
+            The offset and size of the moov box and the offset of the media data, by box type.
+            Empty if the object isn't an ISO media file.
+    """
+    head = reader.read(0, HEADER_BYTES)
+    if head[4:8] not in (b"ftyp", b"moov", b"wide", b"free", b"mdat"):
+        return {}
+    boxes = {}
+    offset = 0
+    for _ in range(MAX_BOXES):
+        if offset + 8 > reader.size or ("moov" in boxes and "mdat" in boxes):
+            break
+        header = reader.read(offset, min(16, reader.size - offset))
+        size, box = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = reader.size - offset
+        if size < header_size:
+            break
+        if box == b"moov":
+            boxes["moov"] = (offset, size)
+        elif box == b"mdat":
+            boxes["mdat"] = (offset + header_size, size - header_size)
+        offset += size
+    return boxes
+
+
+def probe_s3(client, probe_path, video, probe_bytes=None):
+    """
+    Probes an S3 video with ranged GETs of its index, falling back to a bounded probe of the presigned url.
+
+    Parameters
+    ----------
+        client: botocore client
+            The S3 client used for the ranged GETs.
+
+        probe_path: string
+            The path to the ffprobe executable.
+
+        video: Video
+            The S3 video to probe.
+
+        probe_bytes: int
+            The amount of media data read for stream details. Defaults to PROBE_BYTES.
+
+    Returns
+    ----------
+        meta_data: dictionary
+            The same dictionary a full ffprobe of the object returns.
+
+        bytes_read: int
+            The number of bytes fetched from S3.
+    """
+    probe_bytes = PROBE_BYTES if probe_bytes is None else probe_bytes
+    reader = RangeReader(client, video.bucket, video.key)
+    boxes = find_boxes(reader)
+    if "moov" not in boxes:
+        logging.info(f"No moov box found in {video}, probing the presigned url instead")
+        return probe_url(probe_path, video.get_presigned_url(), probe_bytes)
+
+    moov_offset, moov_size = boxes["moov"]
+    reader.read(moov_offset, moov_size)
+    if "mdat" in boxes:
+        mdat_offset, mdat_size = boxes["mdat"]
+        if mdat_size > 0:
+            reader.read(mdat_offset, min(probe_bytes, mdat_size))
+
+    extension = os.path.splitext(video.key)[1]
+    with tempfile.TemporaryDirectory() as workdir:
+        sparse = os.path.join(workdir, f"probe{extension}")
+        reader.write_sparse(sparse)
+        # Reading the holes of the sparse copy costs no I/O, so ffprobe keeps its default probe size.
+        command = [probe_path, "-hide_banner", "-show_streams", "-v", "quiet", "-print_format", "json",
+                   "-show_format", "-i", sparse]
+        meta_data = json.loads(subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout)
+    meta_data.get("format", {})["filename"] = f"s3://{video.bucket}/{video.key}"
+    logging.info(f"Probed {video} with {reader.bytes_read} of {reader.size} bytes")
+    return meta_data, reader.bytes_read
+
+
+def probe_url(probe_path, url, probe_bytes=None):
+    """
+    Probes a url with a bounded probe size and analyze duration, and counts the bytes ffprobe read.
+
+    Parameters
+    ----------
+        probe_path: string
+            The path to the ffprobe executable.
+
+        url: string
+            The url to probe, optionally in single quotes.
+
+        probe_bytes: int
+            The probe size handed to ffprobe. Defaults to PROBE_BYTES.
+
+    Returns
+    ----------
+        meta_data: dictionary
+            The ffprobe result.
+
+        bytes_read: int
+            The number of bytes ffprobe reported reading.
+    """
+    probe_bytes = PROBE_BYTES if probe_bytes is None else probe_bytes
+    command = [probe_path, "-hide_banner", "-show_streams", "-v", "verbose", "-print_format", "json", "-show_format",
+               "-probesize", str(max(probe_bytes, 32)), "-analyzeduration", "1000000", "-i", url.strip("'")]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace")
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, process.stdout, process.stderr)
+    bytes_read = sum(int(count) for count in STATISTICS_PATTERN.findall(process.stderr))
+    return json.loads(process.stdout), bytes_read
@@ -0,0 +1,242 @@
+"""
+Module contains the ShardWriter class, which streams extracted frames into a few large archive files instead
+of one file per frame.
+
+A tar shard follows the WebDataset layout: every frame is an encoded image member next to a JSON member with
+its video, frame and timestamp, both named after the same key. An NPZ shard holds every frame as an
+uncompressed .npy array that numpy.load reads by key. A shard is closed once it reaches max_bytes, and the
+next one is started. Every shard gets an index file with one JSON line per frame, which maps the video,
+frame and timestamp to the member and the byte offset and size of its data in the shard, so single frames can
+be read with a ranged GET. For NPZ shards that is the raw array after the zip and npy headers, and the index
+also holds its shape and dtype. Images for tar shards are encoded on a thread pool and added to the shard in order.
+
+"""
+
+import collections
+import glob
+import io
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy
+from aEye.image_writer import encoder_params
+
+# Formats a shard can be written in.
+SHARD_FORMATS = ("tar", "npz")
+
+
+class ShardWriter:
+    """
+    ShardWriter adds frames to size capped tar or NPZ shards in a folder. Use it as a context manager, or call
+    close, to finish the last shard.
+
+    Attributes
+    ----------
+        folder: string
+            The folder the shards and their indexes are written to.
+
+        shard_format: string
+            "tar" or "npz".
+
+        max_bytes: int
+            The size a shard is closed at. A single frame larger than this gets a shard of its own.
+
+        files: list
+            The shards and indexes written so far, relative to folder.
+
+        stats: dict
+            The number of images and shards, their bytes, the seconds spent encoding and writing, the wall
+            seconds from the first image to close, and the number of errors.
+
+    Methods
+    ---------
+        write(path, image, meta) -> string:
+            Queues a frame, blocking while the queue is full, and returns its key.
+
+        close() -> dict:
+            Adds every queued frame, closes the last shard and returns the stats.
+
+    """
+
+    def __init__(self, folder, shard_format="tar", max_bytes=1024 * 1024 * 1024, prefix="frames", image_format="png",
+                 quality=None, compression=None, max_workers=4, queue_size=None):
+        if shard_format not in SHARD_FORMATS:
+            raise ValueError(f"Unknown shard format {shard_format}, use one of {', '.join(SHARD_FORMATS)}")
+        self.folder = folder
+        self.shard_format = shard_format
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.image_format = image_format
+        self.extension, self.params = encoder_params(image_format, quality, compression)
+        self.files = []
+        self.stats = {"images": 0, "shards": 0, "bytes": 0, "encode_seconds": 0.0, "write_seconds": 0.0,
+                      "seconds": 0.0, "errors": 0}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._queue_size = queue_size or 2 * max_workers
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._start = None
+        # Numbering continues after the shards already in the folder, so later calls don't overwrite them.
+        self._number = len(glob.glob(os.path.join(glob.escape(folder), f"{glob.escape(prefix)}-*.{shard_format}")))
+        self._shard = None
+        self._index = None
+        self._name = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, path, image, meta=None):
+        """
+        Queues a frame to be added to the current shard. Blocks while the queue is full.
+
+        Parameters
+        ----------
+            path: string
+                The file path the frame would have as a single file. Its name is used as the key.
+
+            image: numpy.ndarray
+                The image in BGR, or grayscale. It must not be changed until it is added.
+
+            meta: dict
+                The video, frame and timestamp of the image, which are indexed.
+
+        Returns
+        ----------
+            key: string
+                The key of the frame in the shard.
+        """
+        if self._start is None:
+            self._start = time.perf_counter()
+        # WebDataset keys end at the first dot.
+        key = os.path.basename(path).replace(".", "_")
+        encoded = self._pool.submit(self._encode, image) if self.shard_format == "tar" else None
+        self._pending.append((key, image, meta or {}, encoded))
+        while len(self._pending) > self._queue_size:
+            self._add(*self._pending.popleft())
+        return key
+
+    def _encode(self, image):
+        """
+        Encodes one image on a pool thread and returns its bytes.
+        """
+        start = time.perf_counter()
+        ret, data = cv2.imencode(self.extension, image, self.params)
+        if not ret:
+            raise ValueError("the encoder failed")
+        with self._lock:
+            self.stats["encode_seconds"] += time.perf_counter() - start
+        return data.tobytes()
+
+    def _add(self, key, image, meta, encoded):
+        """
+        Adds one frame and its index line to the current shard, starting a new shard if it is full.
+        """
+        try:
+            data = encoded.result() if encoded is not None else None
+            start = time.perf_counter()
+            size = len(data) if data is not None else image.nbytes
+            if self._shard is not None and self._size() + size > self.max_bytes:
+                self._close_shard()
+            if self._shard is None:
+                self._open_shard()
+            entry = dict(meta, key=key, shard=self._name)
+            if self.shard_format == "tar":
+                entry["member"] = key + self.extension
+                entry["offset"] = self._add_tar(entry["member"], data)
+                self._add_tar(key + ".json", json.dumps(meta).encode("utf-8"))
+            else:
+                entry["member"] = key + ".npy"
+                entry["offset"] = self._add_npy(entry["member"], image)
+                entry.update(shape=list(image.shape), dtype=image.dtype.str)
+            entry["size"] = size
+            self._index.write(json.dumps(entry) + "\n")
+            self.stats["images"] += 1
+            self.stats["bytes"] += size
+            self.stats["write_seconds"] += time.perf_counter() - start
+        except Exception as e:
+            logging.error(f"Cannot add frame {key} to a shard: {e}")
+            self.stats["errors"] += 1
+
+    def _add_tar(self, member, data):
+        """
+        Adds one member to the current tar shard and returns the offset of its data.
+        """
+        info = tarfile.TarInfo(member)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        offset = self._shard.offset + len(info.tobuf(self._shard.format, self._shard.encoding, self._shard.errors))
+        self._shard.addfile(info, io.BytesIO(data))
+        return offset
+
+    def _add_npy(self, member, image):
+        """
+        Adds one array to the current NPZ shard and returns the offset of its raw data, after the zip and
+        npy headers.
+        """
+        with self._shard.open(member, "w", force_zip64=True) as f:
+            # The local file header is written when the member is opened, so the npy file starts here.
+            start = self._shard.fp.tell()
+            numpy.lib.format.write_array(f, numpy.ascontiguousarray(image))
+        # Stored members are written as is, so everything before the array data is the npy header.
+        return start + self._shard.getinfo(member).file_size - image.nbytes
+
+    def _size(self):
+        """
+        Returns the bytes written to the current shard so far.
+        """
+        return self._shard.offset if self.shard_format == "tar" else self._shard.fp.tell()
+
+    def _open_shard(self):
+        """
+        Starts the next shard and its index.
+        """
+        self._name = f"{self.prefix}-{self._number:06d}.{self.shard_format}"
+        self._number += 1
+        path = os.path.join(self.folder, self._name)
+        if self.shard_format == "tar":
+            self._shard = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+        else:
+            self._shard = zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True)
+        index = f"{self.prefix}-{self._number - 1:06d}.index.jsonl"
+        self._index = open(os.path.join(self.folder, index), "w")
+        self.files += [self._name, index]
+        self.stats["shards"] += 1
+
+    def _close_shard(self):
+        """
+        Finishes the current shard and its index.
+        """
+        self._shard.close()
+        self._index.close()
+        logging.info(f"Wrote shard {self._name}")
+        self._shard = None
+        self._index = None
+
+    def close(self):
+        """
+        Adds every queued frame, finishes the last shard and shuts the pool down.
+
+        Returns
+        ----------
+            stats: dict
+                The stats of every frame added.
+        """
+        while self._pending:
+            self._add(*self._pending.popleft())
+        if self._shard is not None:
+            self._close_shard()
+        self._pool.shutdown(wait=True)
+        if self._start is not None:
+            self.stats["seconds"] = time.perf_counter() - self._start
+        logging.info(f"Wrote {self.stats['images']} frames to {self.stats['shards']} {self.shard_format} shards, "
+                     f"{self.stats['bytes']} bytes")
+        return self.stats
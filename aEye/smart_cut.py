@@ -0,0 +1,229 @@
+"""
+Module contains the smart-cut trim, which only re-encodes the parts of a cut that don't line up with keyframes.
+
+Every GOP that lies fully inside the cut is stream copied. Only the partial GOPs at the start and the end
+are re-encoded, with the codec, profile, level and pixel format of the source, and the pieces are joined with
+the concat demuxer. The audio of the whole cut is stream copied in a separate pass, so it keeps its codec too.
+For short cuts out of long footage this skips almost all of the encoding and keeps the original quality.
+If the re-encoded pieces don't come out like the source stream, the cut is re-encoded as a whole instead.
+
+"""
+
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from aEye.executables import get_executables
+
+# Encoders that write streams the concat demuxer can join with stream copied pieces of the same codec.
+ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+}
+
+# The encoder profiles of the profiles ffprobe reports.
+PROFILES = {
+    "h264": {
+        "Constrained Baseline": "baseline",
+        "Baseline": "baseline",
+        "Main": "main",
+        "High": "high",
+        "High 10": "high10",
+        "High 4:2:2": "high422",
+        "High 4:4:4 Predictive": "high444",
+    },
+    "hevc": {
+        "Main": "main",
+        "Main 10": "main10",
+        "Main Still Picture": "mainstillpicture",
+    },
+}
+
+# What a re-encoded piece has to share with the source stream to be joined with copied pieces.
+MATCHED_FIELDS = ("codec_name", "profile", "level", "pix_fmt", "width", "height")
+
+# Keyframes closer than this to a cut point count as being on it.
+EPSILON = 0.001
+
+
+def run_smart_cut(ffmpeg, video, start, end, output):
+    """
+    Writes the part of the video from start to end to output, stream copying every whole GOP in between.
+    If the codec can't be matched or no whole GOP lies inside the cut, the cut is simply re-encoded.
+
+    Parameters
+    ----------
+        ffmpeg: string
+            The path to the ffmpeg executable.
+
+        video: Video
+            The source video. Its metadata and keyframes are probed if they aren't known yet.
+
+        start: float
+            Start of the cut in seconds.
+
+        end: float
+            End of the cut in seconds, None to cut until the end of the video.
+
+        output: string
+            The output file path.
+
+    Returns
+    ----------
+        process: subprocess.CompletedProcess
+            The result of the whole cut. args holds every command that was run and stderr all of their errors.
+    """
+    video.extract_metadata()
+    stream = next(s for s in video.meta_data["streams"] if s["codec_type"] == "video")
+    encode = encode_options(stream)
+    source = video._probe_source()
+    if end is None:
+        end = float(stream["duration"])
+    reencode = f"{ffmpeg} -y -ss {start} -i {source} -t {round(end - start, 6)} {output}"
+
+    keyframes = [k for k in video.get_keyframes() if start - EPSILON <= k <= end + EPSILON] if encode else []
+    if len(keyframes) < 2:
+        # There is no whole GOP inside the cut, so there is nothing to copy.
+        return run_commands([reencode])
+
+    first, last = keyframes[0], keyframes[-1]
+    extension = os.path.splitext(output)[1]
+    workdir = tempfile.mkdtemp()
+    pieces = []
+    encoded = []
+    commands = []
+
+    if first - start > EPSILON:
+        pieces.append((f"{workdir}/head{extension}", round(first - start, 6)))
+        encoded.append(pieces[-1][0])
+        commands.append(f"{ffmpeg} -y -ss {start} -i {source} -t {pieces[-1][1]} {encode} {pieces[-1][0]}")
+    # A copied cut ends on packets in decode order, so -t alone lets reordered frames of the next GOP slip in.
+    # Whole GOPs are complete in decode order, which makes a frame count from the frame index exact.
+    index = video.get_frame_index()
+    pieces.append((f"{workdir}/middle{extension}", round(last - first, 6)))
+    commands.append(f"{ffmpeg} -y -ss {first} -i {source} -t {pieces[-1][1]} "
+                    f"-frames:v {index.frame_at(last) - index.frame_at(first)} "
+                    f"-an -c copy -avoid_negative_ts make_zero {pieces[-1][0]}")
+    if end - last > EPSILON:
+        pieces.append((f"{workdir}/tail{extension}", round(end - last, 6)))
+        encoded.append(pieces[-1][0])
+        commands.append(f"{ffmpeg} -y -ss {last} -i {source} -t {pieces[-1][1]} {encode} {pieces[-1][0]}")
+
+    # Every piece is placed by its planned duration, so rounding in a re-encoded piece can't shift the next one.
+    with open(f"{workdir}/pieces.txt", "w", encoding="utf-8") as concat_list:
+        concat_list.writelines(f"file '{piece}'\nduration {duration}\n" for piece, duration in pieces)
+    commands.append(f"{ffmpeg} -y -f concat -safe 0 -i {workdir}/pieces.txt -c copy {workdir}/video{extension}")
+    # Audio packets can all be cut on, so the audio of the whole cut is copied next to the joined video.
+    commands.append(f"{ffmpeg} -y -i {workdir}/video{extension} -ss {start} -t {round(end - start, 6)} -i {source} "
+                    f"-map 0:v -map 1:a? -c copy {output}")
+
+    try:
+        logging.info(f"Smart cut of {video} copies {round(last - first, 3)}s of {round(end - start, 3)}s")
+        process = run_commands(commands[:len(pieces)])
+        if process.returncode != 0:
+            return process
+        if not all(matches_stream(piece, stream) for piece in encoded):
+            logging.info(f"The re-encoded pieces of {video} don't match its video stream, so the cut is re-encoded")
+            return joined(process, run_commands([reencode]))
+        return joined(process, run_commands(commands[len(pieces):]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def encode_options(stream):
+    """
+    Returns the ffmpeg options that re-encode a piece like a video stream: with its codec, profile, level,
+    pixel format and timescale, and without audio.
+
+    Parameters
+    ----------
+        stream: dict
+            The ffprobe metadata of the video stream.
+
+    Returns
+    ----------
+        options: string
+            The encoding options, or None if there is no encoder for the codec.
+    """
+    encoder = ENCODERS.get(stream["codec_name"])
+    if encoder is None:
+        return None
+    timescale = stream["time_base"].split('/')[1]
+    options = f"-an -c:v {encoder} -pix_fmt {stream['pix_fmt']} -video_track_timescale {timescale}"
+    profile = PROFILES[stream["codec_name"]].get(stream.get("profile"))
+    if profile is not None:
+        options += f" -profile:v {profile}"
+    level = stream.get("level", 0)
+    if level > 0 and encoder == "libx264":
+        # ffprobe reports H.264 level 3.1 as 31.
+        options += f" -level:v {level / 10:g}"
+    elif level > 0:
+        # ffprobe reports HEVC level 3.1 as 93.
+        options += f" -x265-params level-idc={level / 30:g}"
+    return options
+
+
+def matches_stream(piece, stream):
+    """
+    Checks that a re-encoded piece has the codec, profile, level, pixel format and size of a video stream,
+    so players can decode it with the parameters of the stream copied pieces.
+
+    Parameters
+    ----------
+        piece: string
+            The path of the re-encoded piece.
+
+        stream: dict
+            The ffprobe metadata of the source's video stream.
+
+    Returns
+    ----------
+        matches: boolean
+            Whether every field in MATCHED_FIELDS is the same.
+    """
+    probe_path = get_executables()[1]
+    command = (f"{probe_path} -v error -select_streams v:0 -show_entries stream={','.join(MATCHED_FIELDS)} "
+               f"-of json {piece}")
+    try:
+        probed = json.loads(subprocess.check_output(command, shell=True))["streams"][0]
+    except Exception as e:
+        logging.error(f"Cannot probe smart cut piece {piece}: {e}")
+        return False
+    return all(probed.get(field) == stream.get(field) for field in MATCHED_FIELDS)
+
+
+def joined(first, second):
+    """
+    Combines the results of two run_commands calls into one.
+    """
+    return subprocess.CompletedProcess(f"{first.args} && {second.args}", second.returncode, None,
+                                       first.stderr + second.stderr)
+
+
+def run_commands(commands):
+    """
+    Runs ffmpeg commands one after another and stops at the first one that fails.
+
+    Parameters
+    ----------
+        commands: list
+            The ffmpeg command lines to run.
+
+    Returns
+    ----------
+        process: subprocess.CompletedProcess
+            The combined result of the commands that were run.
+    """
+    stderr = ""
+    returncode = 0
+    for command in commands:
+        logging.info(command)
+        process = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 text=True, errors="replace", check=False)
+        stderr += process.stderr
+        returncode = process.returncode
+        if returncode != 0:
+            break
+    return subprocess.CompletedProcess(" && ".join(commands), returncode, None, stderr)
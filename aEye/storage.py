@@ -0,0 +1,117 @@
+"""
+Module contains the S3 access layer that every part of aEye talks to S3 through.
+
+One client is shared by the whole process. It is created on first use, with a connection pool large enough
+for many videos being probed, decoded and uploaded at once, and with adaptive retries so throttling slows
+requests down instead of failing them. Presigned urls are cached per bucket and key and signed again only
+when they get close to their expiry, so a url handed to ffmpeg or OpenCV never runs out mid-read. Expired
+urls are dropped, and at most MAX_URLS are kept, least recently used first out.
+
+"""
+
+import collections
+import threading
+import time
+
+_client = None
+_config = {"max_pool_connections": 64, "max_attempts": 10, "retry_mode": "adaptive", "client_kwargs": {}}
+_lock = threading.Lock()
+_presigned_urls = collections.OrderedDict()
+
+# Lifetime of the presigned urls that are signed for the cache, in seconds.
+URL_LIFETIME = 3600
+
+# A cached url is signed again once less than this share of its lifetime is left.
+URL_REFRESH = 0.25
+
+# The number of presigned urls that are cached.
+MAX_URLS = 10000
+
+
+def configure_s3(max_pool_connections=64, max_attempts=10, retry_mode="adaptive", **client_kwargs):
+    """
+    Sets up the shared S3 client. The client is created again on its next use, and the url cache is emptied.
+
+    Parameters
+    ----------
+        max_pool_connections: int
+            The number of connections kept open, which limits the requests that run at once.
+
+        max_attempts: int
+            The number of attempts of a request before it fails.
+
+        retry_mode: string
+            The botocore retry mode, "adaptive", "standard" or "legacy".
+
+        client_kwargs: dict
+            Any other argument for boto3.client, like region_name or endpoint_url.
+    """
+    global _client
+    with _lock:
+        _config.update(max_pool_connections=max_pool_connections, max_attempts=max_attempts, retry_mode=retry_mode,
+                       client_kwargs=client_kwargs)
+        _client = None
+        _presigned_urls.clear()
+
+
+def get_s3_client():
+    """
+    Returns the shared S3 client, creating it the first time.
+
+    Returns
+    ----------
+        client: botocore.client.S3
+            The client. Clients are thread safe, so it can be used from every worker.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            # boto3 takes a while to import, so it is only imported once S3 is used.
+            import boto3
+            from botocore.config import Config
+            config = Config(max_pool_connections=_config["max_pool_connections"],
+                            retries={"max_attempts": _config["max_attempts"], "mode": _config["retry_mode"]})
+            _client = boto3.client("s3", config=config, **_config["client_kwargs"])
+        return _client
+
+
+def presigned_url(bucket, key, expires=600):
+    """
+    Returns a presigned GET url of an object that stays valid for at least expires seconds.
+    Urls are reused until less than URL_REFRESH of their lifetime is left.
+
+    Parameters
+    ----------
+        bucket: string
+            The bucket of the object.
+
+        key: string
+            The key of the object.
+
+        expires: int
+            The number of seconds the url has to stay valid for.
+
+    Returns
+    ----------
+        url: string
+            The presigned url.
+    """
+    now = time.time()
+    lifetime = max(expires, URL_LIFETIME)
+    with _lock:
+        cached = _presigned_urls.get((bucket, key))
+        if cached is not None:
+            _presigned_urls.move_to_end((bucket, key))
+    if cached is not None:
+        url, expiry, signed_for = cached
+        if expiry - now >= max(expires, signed_for * URL_REFRESH):
+            return url
+    url = get_s3_client().generate_presigned_url(ClientMethod="get_object", Params={"Bucket": bucket, "Key": key},
+                                                 ExpiresIn=lifetime)
+    with _lock:
+        _presigned_urls[(bucket, key)] = (url, now + lifetime, lifetime)
+        _presigned_urls.move_to_end((bucket, key))
+        # Urls that are used are signed again before they expire, so the expired ones are the least recently used.
+        while len(_presigned_urls) > MAX_URLS or next(iter(_presigned_urls.values()))[1] <= now:
+            _presigned_urls.popitem(last=False)
+    return url
@@ -2,13 +2,16 @@
 Module contains the Video class that stores and represents video files as objects.
 
 """
-import cv2
+import os
 import subprocess
 import json
-import boto3
-from static_ffmpeg import run
-
-s3 = boto3.client("s3")
+import logging
+from aEye.planner import derived_metadata, frame_time
+from aEye.cache import get_metadata_cache, get_source_cache
+from aEye.capture_pool import get_capture_pool
+from aEye.executables import get_executables
+from aEye.remote_probe import probe_s3
+from aEye.storage import get_s3_client, presigned_url
 
 
 class Video:
@@ -30,12 +33,41 @@ class Video:
     title   : str
         Title for the output video to build upon
 
+    stage   : Stage
+        Set on planned videos returned by a lazy execute. Holds the labels that have not been run yet
+
+    probe_bytes : int
+        Bytes fetched from S3 by the last low I/O probe (see aEye.remote_probe)
+
+    fetch_bytes : int
+        Bytes fetched from S3 by the last partial fetch of a trim or frame grab (see aEye.partial_fetch)
+
+    capture : Capture
+        The OpenCV capture the Extractor last read the video with, kept open between calls (see aEye.capture_pool)
+
+    frame_index : FrameIndex
+        The presentation time of every frame and the keyframes, once get_frame_index built it (see aEye.frame_index)
+
     ----------
     Methods
     ----------
     extract_metadata -> str:
         Collects the metadata from all video sources and separates the streams
         Necessary for basically any processing, but still has to be set (none by default)
+        Uses the on-disk metadata cache if it is enabled (see aEye.cache)
+
+    content_identity -> str:
+        Returns the bucket/key/ETag/size or path/mtime/size identity of the video content
+
+    get_frame_index -> FrameIndex:
+        Returns the index of the presentation time of every frame and the keyframes
+        Uses the on-disk metadata cache if it is enabled (see aEye.cache)
+
+    get_frame_time -> float:
+        Returns the presentation time of a frame in seconds
+
+    get_keyframes -> list:
+        Returns the sorted keyframe times of the video stream in seconds
 
     get_codec -> str:
         Returns the video codec
@@ -89,6 +121,16 @@ class Video:
         self.complex_filter = []
         self.out = ''
         self.out_title = ''
+        self.stage = None
+        self.seek_mode = None
+        self.smart_cut = False
+        self.partial_fetch = False
+        self.keyframes = None
+        self.clip_boundaries = None
+        self.probe_bytes = None
+        self.fetch_bytes = None
+        self.capture = None
+        self.frame_index = None
 
     def __repr__(self):
         """
@@ -127,34 +169,171 @@ class Video:
                 Boolean state of whether the video can be readed properly.
 
         """
-        return cv2.VideoCapture(self.get_presigned_url(time=2)).read()[0]
+        import cv2
+        capture = cv2.VideoCapture(self.get_presigned_url().strip("'"))
+        readable = capture.read()[0]
+        capture.release()
+        return readable
 
-    def extract_metadata(self):
+    def extract_metadata(self, low_io=False):
         """
         Probably the most important method, probes a video passed with a
         file path and returns a json dictionary full of metadata. Video metadata lives in
         json['streams'][0] because it is the first channel and the dictionary splits streams from error
+
+        Parameters
+        ----------
+            low_io: boolean
+                For S3 videos, fetch only the container index with ranged GETs instead of streaming
+                the object to ffprobe. The number of bytes fetched is kept in self.probe_bytes.
+
         Returns
         ---------
             meta_data: dictionary
                 The dictionary of metadata for all streams.
 
         """
-        ffmpeg, probe_path = run.get_or_fetch_platform_executables_else_raise()
+        if self.meta_data is None and self.stage is not None:
+            # A planned video has not been written yet, so its metadata comes from its source.
+            self.meta_data = derived_metadata(self)
+            return self.meta_data
+        ffmpeg, probe_path = get_executables()
         if self.meta_data is None:
-            fp = None
-            if self.file is None:
-                fp = self.get_presigned_url()
-            elif self.out is not '':
-                fp = self.out
+            cache = get_metadata_cache()
+            identity = self.content_identity() if cache is not None else None
+            if identity is not None:
+                json_data = cache.get(identity)
+                if json_data is not None:
+                    self.meta_data = json_data
+                    return json_data
+            if low_io and self.file is None:
+                json_data, self.probe_bytes = probe_s3(get_s3_client(), probe_path, self)
             else:
-                fp = self.file
-            command = f"{probe_path} -hide_banner -show_streams -v error -print_format json -show_format -i {fp}"
-            out = subprocess.check_output(command, shell=True).decode("utf-8")
-            json_data = json.loads(out)
+                fp = self._probe_source()
+                command = f"{probe_path} -hide_banner -show_streams -v error -print_format json -show_format -i {fp}"
+                out = subprocess.check_output(command, shell=True).decode("utf-8")
+                json_data = json.loads(out)
             self.meta_data = json_data
+            if identity is not None:
+                cache.put(identity, json_data)
             return json_data
 
+    def content_identity(self):
+        """
+        This method will describe the content that ffprobe would read, so probe results can be cached.
+        S3 objects are identified by bucket, key, ETag and size, local files by path, modification time
+        and size. A changed file gets a new identity.
+
+        Returns
+        ---------
+            identity: string
+                The identity of the content, or None if the content can't be found.
+
+        """
+        try:
+            if self.file is None:
+                head = get_s3_client().head_object(Bucket=self.bucket, Key=self.key)
+                return f"s3://{self.bucket}/{self.key}|{head['ETag']}|{head['ContentLength']}"
+            path = os.path.abspath(self._probe_source().strip("'"))
+            stat = os.stat(path)
+            return f"{path}|{stat.st_mtime_ns}|{stat.st_size}"
+        except Exception:
+            return None
+
+    def _probe_source(self):
+        """
+        This method will return the location that ffprobe should read the video from.
+
+        Returns
+        ---------
+            fp: string
+                The presigned url, the executed output or the local file of the video.
+
+        """
+        if self.file is None:
+            return self.get_presigned_url()
+        elif self.out != '':
+            return self.out
+        return self.file
+
+    def get_frame_index(self, low_io=False):
+        """
+        Indexes the presentation time of every frame of the video stream and which frames are keyframes.
+        Only packet headers are read, nothing is decoded. The index is built once per source: it is kept
+        in self.frame_index and in the metadata cache, if that is enabled.
+
+        Parameters
+        ----------
+            low_io: boolean
+                For S3 videos that can't be indexed from their moov box alone, return None instead of
+                streaming the object to ffprobe.
+
+        Returns
+        ---------
+            frame_index: FrameIndex
+                The index, or None with low_io if building it would mean reading the whole object.
+
+        """
+        if self.frame_index is None:
+            # The index is kept in NumPy arrays, which take a while to import, so they are only imported here.
+            from aEye.frame_index import FrameIndex, moov_frame_index, probe_frame_index
+            cache = get_metadata_cache()
+            identity = self.content_identity() if cache is not None else None
+            value = cache.get(identity, kind="frame_index") if identity is not None else None
+            if value is not None:
+                self.frame_index = FrameIndex.from_json(value)
+                return self.frame_index
+            index = None
+            if self.file is None:
+                try:
+                    index = moov_frame_index(get_s3_client(), self.bucket, self.key)
+                except Exception as e:
+                    logging.error(f"Cannot index {self} from its moov box: {e}")
+                if index is None and low_io:
+                    return None
+            if index is None:
+                ffmpeg, probe_path = get_executables()
+                index = probe_frame_index(probe_path, self._probe_source())
+            self.frame_index = index
+            if identity is not None:
+                cache.put(identity, index.to_json(), kind="frame_index")
+        return self.frame_index
+
+    def get_frame_time(self, frame):
+        """
+        Gives the presentation time of a frame from the frame index, which stays exact for variable frame
+        rates, unlike nb_frames / duration. Frames of a planned video are looked up in the index of the
+        source it will be read from. S3 videos that can't be indexed from their moov box, and plans that
+        change the frame rate, fall back to nb_frames / duration (see aEye.planner.frame_time).
+
+        Parameters
+        ----------
+            frame: int
+                The frame number, counted from 0.
+
+        Returns
+        ---------
+            time: float
+                The time the frame is shown at in seconds.
+
+        """
+        return frame_time(self, frame)
+
+    def get_keyframes(self):
+        """
+        Lists the presentation times of every keyframe in the video stream, from the frame index.
+        The result is kept in self.keyframes.
+
+        Returns
+        ---------
+            keyframes: list
+                Sorted keyframe times in seconds.
+
+        """
+        if self.keyframes is None:
+            self.keyframes = self.get_frame_index().keyframe_times()
+        return self.keyframes
+
     def get_codec(self):
         """
         Gets the codec of the current video
@@ -264,7 +443,7 @@ class Video:
 
     def cleanup(self) -> None:
         """
-        Removes current CV Frame capture
+        Removes current CV Frame capture, and closes it in the capture pool
 
         Parameters
         ----------
@@ -273,12 +452,23 @@ class Video:
         ----------
 
         """
-        self.capture.release()
+        get_capture_pool().discard(self)
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
 
     def get_presigned_url(self, time=600):
         """
         This method will return the presigned url of video file from S3.
         If the video file is from local machine then it will return the local path of the video file.
+        If the source cache is enabled (see aEye.cache), S3 videos are downloaded once and the path of
+        the local copy is returned instead. Urls are shared between calls until they get close to expiring
+        (see aEye.storage).
+
+        Parameters
+        ----------
+            time: int
+                The number of seconds the url has to stay valid for.
 
         Returns
         ---------
@@ -288,11 +478,13 @@ class Video:
         """
 
         if self.file is None:
-            url = s3.generate_presigned_url(
-                ClientMethod="get_object",
-                Params={"Bucket": self.bucket, "Key": self.key},
-                ExpiresIn=time,
-            )
+            cache = get_source_cache()
+            if cache is not None:
+                try:
+                    return cache.fetch(get_s3_client(), self.bucket, self.key)
+                except Exception as e:
+                    logging.error(f"Cannot cache s3://{self.bucket}/{self.key}, streaming it instead: {e}")
+            url = presigned_url(self.bucket, self.key, expires=time)
             return f"'{url}'"
         return self.file
 
@@ -342,6 +534,9 @@ class Video:
         """
 
         self.label = ''
+        self.seek_mode = None
+        self.smart_cut = False
+        self.partial_fetch = False
 
     def get_label(self):
         """
@@ -410,7 +605,7 @@ class Video:
         """
 
         result = ''
-        if '-f segment' in self.label:
+        if '-f segment' in self.label and '%02d' not in self.title:
             out = self.title.split('.')
             out[0] += "_%02d."
             out = "".join(out)
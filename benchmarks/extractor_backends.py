@@ -0,0 +1,49 @@
+"""
+Compares the frames per second of the Extractor's OpenCV and ffmpeg backends, reading a whole video into
+arrays at full size and scaled down to thumbnails. Pass any local video, the test video is used by default.
+
+    python benchmarks/extractor_backends.py my_video.mp4 --size 160x90 --threads 0
+
+"""
+
+import argparse
+import os
+import time
+
+TEST_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "test_data", "test_video.mp4")
+
+
+def measure(extractor, video, size, backend, batch_size):
+    """
+    Reads every frame of a video in batches and returns the number of frames and the frames per second.
+    """
+    start = time.perf_counter()
+    count = 0
+    for frames, _, _ in extractor.iter_batches(video, batch_size, size=size, backend=backend):
+        count += len(frames)
+    return count, count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", nargs="?", default=TEST_VIDEO, help="local video file")
+    parser.add_argument("--size", default="160x90", help="thumbnail size as WIDTHxHEIGHT")
+    parser.add_argument("--threads", type=int, default=0, help="ffmpeg decoder threads, 0 lets ffmpeg pick")
+    parser.add_argument("--batch", type=int, default=64, help="frames per batch")
+    args = parser.parse_args()
+
+    from aEye import Extractor, Video
+    extractor = Extractor(threads=args.threads)
+    video = Video(file=args.video, title=os.path.basename(args.video))
+    thumbnail = tuple(int(i) for i in args.size.split("x"))
+
+    print(f"{'backend':<10}{'size':>12}{'frames':>10}{'frames/s':>12}")
+    for size in (None, thumbnail):
+        for backend in ("opencv", "ffmpeg"):
+            count, fps = measure(extractor, video, size, backend, args.batch)
+            label = "full" if size is None else args.size
+            print(f"{backend:<10}{label:>12}{count:>10}{fps:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures the cold start of aEye: how long a fresh interpreter takes to import it, and to get from there to
+the first probed video. Every statement runs in its own process, like a short-lived worker would.
+
+    python benchmarks/import_time.py --runs 20
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TEST_VIDEO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "test_data", "test_video.mp4")
+
+STATEMENTS = {
+    "python": "pass",
+    "import aEye": "import aEye",
+    "import Aux, Labeler, Video": "from aEye import Aux, Labeler, Video",
+    "first probe": f"from aEye import Aux; Aux().load_local({TEST_VIDEO!r})[0].extract_metadata()",
+    "import Extractor": "from aEye import Extractor",
+}
+
+
+def measure(statement, runs):
+    """
+    Runs a statement in runs fresh interpreters and returns the wall times in milliseconds.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per statement")
+    args = parser.parse_args()
+
+    print(f"{'statement':<28}{'median ms':>12}{'min ms':>10}")
+    for name, statement in STATEMENTS.items():
+        times = measure(statement, args.runs)
+        print(f"{name:<28}{statistics.median(times):>12.1f}{min(times):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -66,14 +66,29 @@ setup(
     packages=find_packages(
         include=['aEye',
                  'aEye.auxiliary',
+                 'aEye.cache',
+                 'aEye.capture_pool',
+                 'aEye.chunked',
+                 'aEye.async_auxiliary',
+                 'aEye.executables',
                  'aEye.extractor',
+                 'aEye.frame_index',
+                 'aEye.image_writer',
                  'aEye.labeler',
+                 'aEye.partial_fetch',
+                 'aEye.pipe_decoder',
+                 'aEye.planner',
+                 'aEye.remote_probe',
+                 'aEye.shards',
+                 'aEye.smart_cut',
+                 'aEye.storage',
                  'aEye.video',
         ]
     ),
     include_package_data=True,
     install_requires=[
         'boto3',
+        'numpy',
         'opencv-python',
         'static-ffmpeg'
         ],
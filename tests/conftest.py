@@ -0,0 +1,27 @@
+import io
+import pytest
+
+
+class RangedS3:
+    """
+    Serves ranged GETs of a local file like S3 would, and counts the bytes sent.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.sent = 0
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = (int(i) for i in Range[len('bytes='):].split('-'))
+        body = self.data[start:end + 1]
+        self.sent += len(body)
+        return {'Body': io.BytesIO(body), 'ContentRange': f"bytes {start}-{end}/{len(self.data)}"}
+
+
+@pytest.fixture
+def ranged_s3():
+    """
+    Returns the RangedS3 class, to serve a local file as an S3 object.
+    """
+    return RangedS3
@@ -0,0 +1,37 @@
+from aEye.async_auxiliary import AsyncAux
+from aEye.labeler import Labeler
+import asyncio
+import os
+
+"""
+asyncio tests to ensure that AsyncAux probes and executes like Aux.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def test_async_extract_metadata():
+    aux = AsyncAux()
+    video = aux.load_local(input_test_video)[0]
+    meta_data = asyncio.run(aux.extract_metadata(video))
+    assert meta_data['streams'][0]['codec_name'] == "h264"
+    assert video.meta_data is meta_data
+
+
+def test_async_execute(tmp_path):
+    aux = AsyncAux()
+    video_list = Labeler().trim_video_start_end(aux.load_local(input_test_video), 0, 1)
+    output = asyncio.run(aux.execute_label_and_write_local(video_list, str(tmp_path), max_workers=2))
+    assert aux.execution_results[0]["returncode"] == 0
+    assert os.path.exists(output[0].file)
+
+
+def test_async_execute_plans_lazily(tmp_path):
+    aux = AsyncAux()
+    video_list = Labeler().trim_video_start_end(aux.load_local(input_test_video), 0, 2)
+    planned = asyncio.run(aux.execute_label_and_write_local(video_list, str(tmp_path), max_workers=None, lazy=True))
+    assert planned[0].stage is not None and not os.path.exists(planned[0].file)
+    asyncio.run(aux.probe_all(planned, max_workers=None))
+    assert abs(float(planned[0].get_duration()) - 2) < 0.1
+    output = asyncio.run(aux.execute_label_and_write_local(Labeler().trim_video_start_end(planned, 0, 1),
+                                                           str(tmp_path), max_workers=None))
+    assert aux.aux.execution_results[0]["returncode"] == 0 and os.path.exists(output[0].file)
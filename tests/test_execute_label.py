@@ -0,0 +1,159 @@
+from aEye import Video
+from aEye.auxiliary import Aux
+from aEye.executables import get_executables
+from aEye.labeler import Labeler
+import os
+import subprocess
+
+"""
+execution tests to ensure that serial and parallel runs write the same outputs in the same order.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def test_execute_parallel_keeps_order(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    video_list = aux.load_local(input_test_video) + aux.load_local(input_test_video)
+    label.trim_video_start_end(video_list[:1], 0, 1)
+    label.trim_video_start_end(video_list[1:], 0, 2)
+    output = aux.execute_label_and_write_local(video_list, str(tmp_path), max_workers=2)
+    assert [video.title for video in output] == ["trimmed_0_to_1_test_video.mp4", "trimmed_0_to_2_test_video.mp4"]
+    assert [result["returncode"] for result in aux.execution_results] == [0, 0]
+    for video in output:
+        assert os.path.exists(video.file)
+
+
+def test_execute_collects_failures(tmp_path):
+    aux = Aux()
+    video_list = [Video(file=str(tmp_path / 'missing.mp4'), title='missing.mp4')]
+    output = aux.execute_label_and_write_local(video_list, str(tmp_path), max_workers=2)
+    assert len(output) == 1
+    assert aux.execution_results[0]["returncode"] != 0
+    assert aux.execution_results[0]["stderr"] != ''
+
+
+def test_lazy_execute_fuses_into_one_pass(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    to_process = label.trim_video_start_end(aux.load_local(input_test_video), 1, 4)
+    planned = aux.execute_label_and_write_local(to_process, str(tmp_path), lazy=True)
+    assert planned[0].stage is not None
+    assert not os.path.exists(planned[0].file)
+    assert float(planned[0].get_duration()) == 3.0
+
+    planned = label.trim_video_start_end(planned, 1, 2)
+    output = aux.execute_label_and_write_local(planned, str(tmp_path))
+    assert len(aux.execution_results) == 1
+    assert "-ss 2.0 -i" in aux.execution_results[0]["command"]
+    assert "-t 1.0" in aux.execution_results[0]["command"]
+    assert output[0].title == "trimmed_1_to_2_trimmed_1_to_4_test_video.mp4"
+    assert os.path.exists(output[0].file)
+
+
+def test_branches_run_as_one_process(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    branches = label.branch(aux.load_local(input_test_video), ['small', 'grey'])
+    label.change_resolution(branches['small'], '240p')
+    label.greyscale(branches['grey'])
+    output = aux.execute_label_and_write_local(branches['small'] + branches['grey'], str(tmp_path))
+    assert [video.title for video in output] == ["small_resized_426x240_test_video.mp4",
+                                                 "grey_greyscale_test_video.mp4"]
+    assert aux.execution_results[0]["command"] == aux.execution_results[1]["command"]
+    assert "split=2" in aux.execution_results[0]["command"]
+    output[0].extract_metadata()
+    assert output[0].get_width() == 426
+    assert os.path.exists(output[1].file)
+
+
+def test_branches_keep_the_pending_labels_of_their_source(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    video_list = label.change_resolution(aux.load_local(input_test_video), '240p')
+    branches = label.branch(video_list, ['fast', 'grey'])
+    label.change_fps(branches['fast'], 10)
+    label.greyscale(branches['grey'])
+    output = aux.execute_label_and_write_local(branches['fast'] + branches['grey'], str(tmp_path))
+    command = aux.execution_results[0]["command"]
+    # The pending resize runs once, before the split, and both outputs keep its encode options.
+    assert "[0:v]scale=426x240:flags=lanczos[trunk];[trunk]split=2" in command
+    assert command.count("-preset slow -crf 28") == 2
+    assert [video.title for video in output] == ["resized_426x240_fast_framerate_10_test_video.mp4",
+                                                 "resized_426x240_grey_greyscale_test_video.mp4"]
+    for video in output:
+        video.extract_metadata()
+        assert video.get_width() == 426
+
+
+def test_trim_seek_modes(tmp_path):
+    aux = Aux()
+    seek_commands = [('frame-exact', '-y -ss 2.0 -i'), ('fast', '-y -noaccurate_seek -ss 2.0 -i'), (None, ' -ss 2 -t 1 ')]
+    for seek_mode, expected in seek_commands:
+        video_list = Labeler(seek_mode=seek_mode).trim_video_start_end(aux.load_local(input_test_video), 2, 3)
+        output = aux.execute_label_and_write_local(video_list, str(tmp_path))
+        assert expected in aux.execution_results[0]["command"]
+        output[0].extract_metadata()
+        assert abs(float(output[0].get_duration()) - 1) < 0.1
+
+
+def gop_video(tmp_path):
+    """
+    Re-encodes the test video with a keyframe every 15 frames, since the test video only has one.
+    """
+    source = str(tmp_path / 'gop.mp4')
+    subprocess.run(f"{get_executables()[0]} -v error -y -i {input_test_video} -g 15 -keyint_min 15 "
+                   f"-sc_threshold 0 {source}", shell=True, check=True)
+    return source
+
+
+def test_smart_cut_copies_whole_gops(tmp_path):
+    source = gop_video(tmp_path)
+    aux = Aux()
+    video_list = Labeler().trim_video_start_end(aux.load_local(source), 0.7, 3.3, smart_cut=True)
+    output = aux.execute_label_and_write_local(video_list, str(tmp_path))
+    assert aux.execution_results[0]["returncode"] == 0
+    assert "-c copy" in aux.execution_results[0]["command"]
+    # The audio is copied, and the re-encoded pieces are encoded like the copied ones.
+    assert "-c:a" not in aux.execution_results[0]["command"]
+    output[0].extract_metadata()
+    assert abs(float(output[0].get_duration()) - 2.6) < 0.1
+    fields = ('codec_name', 'profile', 'level', 'pix_fmt')
+    source_streams = aux.load_local(source)[0].extract_metadata()['streams']
+    assert [[stream.get(field) for field in fields] for stream in output[0].meta_data['streams']] == \
+        [[stream.get(field) for field in fields] for stream in source_streams]
+
+
+def test_trim_into_clips_stream_copy(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    video_list = label.trim_into_clips(aux.load_local(gop_video(tmp_path)), 1.2, stream_copy=True, max_drift=0.3)
+    assert "-c copy" in video_list[0].get_label()
+    assert [actual for _, actual in video_list[0].clip_boundaries] == [1.001, 2.5025, 3.5035, 4.5045]
+    aux.execute_label_and_write_local(video_list, str(tmp_path))
+    assert aux.execution_results[0]["returncode"] == 0
+    assert len([name for name in os.listdir(tmp_path) if name.startswith("trimmed_1.2_clips_gop_")]) == 5
+
+    video_list = label.trim_into_clips(aux.load_local(input_test_video), 1.2, stream_copy=True)
+    assert "-force_key_frames" in video_list[0].get_label()
+
+
+def test_chunked_matches_single_process(tmp_path):
+    source = gop_video(tmp_path)
+    aux = Aux()
+    label = Labeler()
+    results = []
+    for chunks in (1, 3):
+        output_path = tmp_path / f"chunks_{chunks}"
+        output_path.mkdir()
+        video_list = label.greyscale(label.change_resolution(aux.load_local(source), '240p'))
+        output = aux.execute_label_and_write_local(video_list, str(output_path), chunks=chunks)
+        assert aux.execution_results[0]["returncode"] == 0
+        output[0].extract_metadata()
+        results.append((output[0].get_duration(), output[0].get_num_frames(), output[0].get_width()))
+    assert "chunks.txt" in aux.execution_results[0]["command"]
+    assert results[0] == results[1]
+
+    video_list = label.trim_video_start_end(aux.load_local(source), 1, 2)
+    aux.execute_label_and_write_local(video_list, str(tmp_path), chunks=3)
+    assert "chunks.txt" not in aux.execution_results[0]["command"]
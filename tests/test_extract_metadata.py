@@ -15,4 +15,32 @@ def test_extract_metadata():
     for video in video_list_2:
         x = video.extract_metadata()
         codec = x['streams'][0]['codec_name']
-        assert codec == "h264"  # Basic check. Will fail for some more wacky formats (ex DVD's -> MPEG2)
\ No newline at end of file
+        assert codec == "h264"  # Basic check. Will fail for some more wacky formats (ex DVD's -> MPEG2)
+
+
+def test_probe_all_handles_failures(tmp_path):
+    aux = Aux()
+    video_list = aux.load_local(input_test_video) + [Video(file=str(tmp_path / 'missing.mp4'), title='missing.mp4')]
+    aux.probe_all(video_list, max_workers=2)
+    assert video_list[0].meta_data['streams'][0]['codec_name'] == "h264"
+    assert video_list[1].meta_data is None
+    assert list(aux.probe_errors) == ['missing.mp4']
+
+
+def test_low_io_probe_matches_full_probe(monkeypatch, ranged_s3):
+    import aEye.storage
+    import aEye.remote_probe
+    client = ranged_s3(input_test_video)
+    monkeypatch.setattr(aEye.storage, '_client', client)
+    # The test video is small, so the default ranges would cover most of it.
+    monkeypatch.setattr(aEye.remote_probe, 'HEADER_BYTES', 4096)
+    monkeypatch.setattr(aEye.remote_probe, 'PROBE_BYTES', 16384)
+    full = Video(file=input_test_video, title='test_video.mp4').extract_metadata()
+    video = Video(bucket='bucket', key='videos/test_video.mp4', title='test_video.mp4')
+    Aux().probe_all([video], low_io=True)
+    stream = video.meta_data['streams'][0]
+    for field in ('codec_name', 'width', 'height', 'nb_frames', 'duration', 'pix_fmt'):
+        assert stream[field] == full['streams'][0][field]
+    assert video.meta_data['format']['size'] == full['format']['size']
+    assert video.probe_bytes == client.sent
+    assert video.probe_bytes < len(client.data) / 5
@@ -0,0 +1,174 @@
+from aEye import capture_pool
+from aEye.auxiliary import Aux
+from aEye.capture_pool import configure_captures
+from aEye.executables import get_executables
+from aEye.extractor import Extractor, seek_plan
+from aEye.pipe_decoder import decode_batches
+from aEye.video import Video
+import cv2
+import numpy
+import os
+import shutil
+import subprocess
+import sys
+
+"""
+frame extraction tests to ensure that sequential reads return the same frames as seeking to each one.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def seek_frame(frame):
+    capture = cv2.VideoCapture(input_test_video)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+    image = capture.read()[1]
+    capture.release()
+    return image
+
+
+def counting(function, calls):
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def test_multiple_frame_extractor_with_stride(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    video = Video(file=input_test_video, title='test_video.mp4')
+    Extractor().multiple_frame_extractor(Aux(), [video], 40, 5, stride=7)
+    images = sorted(os.listdir(video.path))
+    assert len(images) == 5
+    for x in range(5):
+        image = cv2.imread(f"{video.path}/output_extract_many_frames_40_5_test_video_{x}.png")
+        assert numpy.array_equal(image, seek_frame(40 + 7 * x))
+
+
+def test_read_frames_matches_seeks():
+    video = Video(file=input_test_video, title='test_video.mp4')
+    frames, indexes, timestamps = Extractor().read_frames(video, 40, 5, stride=7)
+    assert frames.shape == (5, 360, 486, 3)
+    assert list(indexes) == [40, 47, 54, 61, 68]
+    assert numpy.allclose(timestamps, indexes * 1001 / 30000, atol=1e-3)
+    for frame, index in zip(frames, indexes):
+        assert numpy.array_equal(frame, seek_frame(index))
+
+
+def test_batches_resize_and_convert_during_decode():
+    video = Video(file=input_test_video, title='test_video.mp4')
+    extractor = Extractor()
+    batches = list(extractor.iter_batches(video, 64, start_frame=10, size=(120, 90), color=cv2.COLOR_BGR2GRAY))
+    assert [len(frames) for frames, _, _ in batches] == [64, 64, 12]
+    assert batches[0][0].shape == (64, 90, 120, 1)
+    index, timestamp, frame = next(extractor.iter_frames(video, 10, size=(120, 90), color=cv2.COLOR_BGR2GRAY))
+    assert index == 10 and numpy.array_equal(frame, batches[0][0][0])
+
+
+def test_seek_plan_groups_frames_by_gop():
+    plan = seek_plan([140, 5, 60, 5, 75, 300], key_frames=[0, 50, 100, 250])
+    assert plan == [(5, True), (60, True), (75, False), (140, True), (300, True)]
+    assert [seek for _, seek in seek_plan([0, 10, 100])] == [True, False, True]
+
+
+def test_read_frames_at_keeps_the_requested_order():
+    video = Video(file=input_test_video, title='test_video.mp4')
+    requested = [120, 3, 77, 3, 149, 500]
+    frames, indexes, _ = Extractor().read_frames_at(video, frames=requested)
+    assert list(indexes) == [120, 3, 77, 3, 149]
+    for frame, index in zip(frames, indexes):
+        assert numpy.array_equal(frame, seek_frame(index))
+
+
+def test_specific_frame_extractor_with_a_list(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    video = Video(file=input_test_video, title='test_video.mp4')
+    Extractor().specific_frame_extractor(Aux(), [video], [90, 12, 45])
+    for frame in (90, 12, 45):
+        image = cv2.imread(f"{video.path}/output_cv_extract_specific_frame_{frame}_test_video.png")
+        assert numpy.array_equal(image, seek_frame(frame))
+
+
+def test_captures_and_frames_are_reused_between_calls(monkeypatch):
+    configure_captures(max_open=2, frame_cache_bytes=64 * 1024 * 1024)
+    opened = []
+    monkeypatch.setattr(capture_pool.Capture, '__init__', counting(capture_pool.Capture.__init__, opened))
+    video = Video(file=input_test_video, title='test_video.mp4')
+    extractor = Extractor()
+    first = extractor.read_frames_at(video, frames=[30, 31])[0]
+    capture = video.capture
+    reads = capture.position
+    second = extractor.read_frames_at(video, frames=[31, 30, 33])[0]
+    assert len(opened) == 1 and video.capture is capture
+    assert capture.position == reads + 2
+    assert numpy.array_equal(second[:2], first[::-1])
+    assert numpy.array_equal(second[2], seek_frame(33))
+    video.cleanup()
+    assert video.capture is None
+    configure_captures()
+
+
+def test_rewritten_videos_are_read_again(tmp_path):
+    configure_captures(max_open=2, frame_cache_bytes=64 * 1024 * 1024)
+    source = str(tmp_path / 'video.mp4')
+    shutil.copyfile(input_test_video, source)
+    video = Video(file=source, title='video.mp4')
+    extractor = Extractor()
+    first = extractor.read_frames_at(video, frames=[30, 31])[0]
+    capture = video.capture
+    negated = str(tmp_path / 'negated.mp4')
+    ffmpeg = get_executables()[0]
+    subprocess.run(f"{ffmpeg} -v error -y -i {source} -vf negate {negated}", shell=True, check=True)
+    os.replace(negated, source)
+    second = extractor.read_frames_at(video, frames=[30, 31])[0]
+    assert video.capture is not capture and not capture.capture.isOpened()
+    assert not numpy.array_equal(first, second)
+    video.cleanup()
+    configure_captures()
+
+
+def test_frame_cache_evicts_least_recently_used():
+    video = Video(file=input_test_video, title='test_video.mp4')
+    cache = capture_pool.FrameCache(max_bytes=300)
+    for frame in range(3):
+        cache.put(video, frame, numpy.zeros(100, numpy.uint8), frame / 30)
+    cache.get(video, 0)
+    cache.put(video, 3, numpy.zeros(100, numpy.uint8), 0.1)
+    assert cache.get(video, 1) is None and cache.get(video, 0) is not None
+    assert cache.bytes == 300
+
+
+def test_ffmpeg_backend_matches_opencv():
+    video = Video(file=input_test_video, title='test_video.mp4')
+    extractor = Extractor()
+    frames, indexes, timestamps = extractor.read_frames(video, 40, 5, stride=7, backend='ffmpeg')
+    expected = extractor.read_frames(video, 40, 5, stride=7)
+    assert list(indexes) == list(expected[1])
+    assert numpy.allclose(timestamps, expected[2])
+    assert numpy.array_equal(frames, expected[0])
+    batches = list(extractor.iter_batches(video, 64, size=(120, 90), color=cv2.COLOR_BGR2RGB, backend='ffmpeg'))
+    assert [batch[0].shape for batch in batches] == [(64, 90, 120, 3), (64, 90, 120, 3), (22, 90, 120, 3)]
+
+
+
+def test_pipe_batches_reuse_one_array_and_drain_stderr():
+    # More stderr than a pipe holds is written before any frame, which stalls if stderr isn't drained.
+    command = (f"{sys.executable} -c \"import sys; sys.stderr.write('x' * 200000); "
+               f"sys.stdout.buffer.write(bytes(range(250)) * 6)\"")
+    out = numpy.empty((4, 10, 10, 3), numpy.uint8)
+    batches = [(batch.copy(), batch.base is out) for batch in decode_batches(command, (10, 10, 3), 2, out=out)]
+    assert [len(batch) for batch, _ in batches] == [2, 2, 1]
+    assert all(shared for _, shared in batches)
+    assert numpy.array_equal(numpy.concatenate([batch for batch, _ in batches]).ravel(),
+                             numpy.frombuffer(bytes(range(250)) * 6, numpy.uint8))
+
+def test_frames_are_written_as_jpeg_on_writer_threads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    video = Video(file=input_test_video, title='test_video.mp4')
+    extractor = Extractor(image_format='jpeg', quality=80, write_workers=2)
+    extractor.multiple_frame_extractor(Aux(), [video], 0, 20)
+    images = os.listdir(video.path)
+    assert len(images) == 20 and all(image.endswith('.jpg') for image in images)
+    stats = extractor.write_stats
+    assert stats['images'] == 20 and stats['errors'] == 0
+    assert stats['bytes'] == sum(os.path.getsize(os.path.join(video.path, image)) for image in images)
+    assert stats['encode_seconds'] > 0
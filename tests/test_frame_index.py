@@ -0,0 +1,98 @@
+from aEye.auxiliary import Aux
+from aEye.cache import enable_metadata_cache, disable_metadata_cache
+from aEye.executables import get_executables
+from aEye.extractor import Extractor
+from aEye.frame_index import FrameIndex, moov_frame_index, probe_frame_index
+from aEye.labeler import Labeler
+from aEye.video import Video
+import cv2
+import numpy
+import os
+import subprocess
+
+"""
+frame index tests to ensure that frames are addressed by their presentation times, also at variable frame rates.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+ffmpeg, ffprobe = get_executables()
+
+
+def vfr_video(tmp_path):
+    """
+    Writes a 240 frame video at 30 fps with a two second gap after frame 100 and a keyframe every 50 frames.
+    """
+    source = str(tmp_path / 'vfr.mp4')
+    subprocess.run(f"{ffmpeg} -v error -y -f lavfi -i testsrc=size=160x120:rate=30 -frames:v 240 "
+                   f"-vf \"setpts='(N/30+gt(N\\,100)*2)/TB'\" -fps_mode vfr -g 50 -bf 2 -c:v libx264 "
+                   f"-pix_fmt yuv420p {source}", shell=True, check=True)
+    return source
+
+
+def test_frame_index_matches_ffprobe_and_moov(tmp_path, ranged_s3):
+    index = probe_frame_index(ffprobe, input_test_video)
+    assert len(index) == 150 and index.key_frames == [0]
+    assert abs(index.time_of(30) - 30 * 1001 / 30000) < 1e-6
+    assert index.frame_at(1.0) == 29 and index.time_of(150) > float(index.times[-1])
+
+    stored = FrameIndex.from_json(index.to_json())
+    assert numpy.array_equal(stored.times, index.times) and stored.key_frames == index.key_frames
+
+    source = vfr_video(tmp_path)
+    client = ranged_s3(source)
+    remote = moov_frame_index(client, 'bucket', 'vfr.mp4')
+    local = probe_frame_index(ffprobe, source)
+    assert numpy.allclose(remote.times, local.times, atol=1e-6) and remote.key_frames == local.key_frames
+    assert local.key_frames == [0, 50, 100, 150, 200] and local.keyframe_before(170) == 150
+
+
+def test_frame_index_addresses_variable_frame_rate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = vfr_video(tmp_path)
+    capture = cv2.VideoCapture(source)
+    expected = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        expected.append(frame)
+    capture.release()
+
+    video = Video(file=source, title='vfr.mp4')
+    frames, indexes, timestamps = Extractor().read_frames_at(video, frames=[150, 60, 210, 120, 170])
+    assert all(numpy.array_equal(frame, expected[i]) for frame, i in zip(frames, indexes))
+    assert abs(timestamps[0] - 7.0) < 1e-3
+    frames, indexes, _ = Extractor().read_frames(video, start_frame=150, num_frames=3, backend='ffmpeg')
+    assert all(numpy.array_equal(frame, expected[i]) for frame, i in zip(frames, indexes))
+
+    Labeler().trim_on_frame([video], 150)
+    assert video.get_label().strip() == '-ss 7.0'
+
+
+def test_frame_index_times_planned_videos(tmp_path):
+    aux = Aux()
+    label = Labeler()
+    video_list = label.trim_video_start_end(aux.load_local(vfr_video(tmp_path)), 3.0, 8.0)
+    planned = aux.execute_label_and_write_local(video_list, str(tmp_path), lazy=True)
+    # Frames 90 to 100 are 1/30s apart, frames 101 to 179 follow the two second gap.
+    assert planned[0].get_num_frames() == '90' and planned[0].get_duration() == '5.0'
+
+    label.trim_on_frame(planned, 60)
+    assert planned[0].get_label().strip() == '-ss 4.0'
+    aux.execute_label_and_write_local(planned, str(tmp_path))
+    assert "-ss 7.0 -i" in aux.execution_results[0]["command"]
+
+
+def test_frame_index_is_cached_next_to_metadata(tmp_path, monkeypatch):
+    enable_metadata_cache(str(tmp_path / 'metadata.sqlite'))
+    try:
+        first = Video(file=input_test_video, title='test_video.mp4').get_frame_index()
+
+        def no_probe(*args, **kwargs):
+            raise AssertionError("ffprobe should not run on a cache hit")
+
+        monkeypatch.setattr(subprocess, "check_output", no_probe)
+        second = Video(file=input_test_video, title='test_video.mp4')
+        assert numpy.array_equal(second.get_frame_index().times, first.times)
+        assert second.get_keyframes() == [0.0]
+    finally:
+        disable_metadata_cache()
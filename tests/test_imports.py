@@ -0,0 +1,34 @@
+import aEye
+from aEye import executables
+from static_ffmpeg import run
+import subprocess
+import sys
+
+"""
+import tests to ensure that aEye imports without loading its heavy dependencies, and finds ffmpeg once.
+"""
+
+
+def test_import_defers_heavy_dependencies():
+    statement = ("import sys; from aEye import Aux, Labeler, Video; Aux(); "
+                 "print(','.join(m for m in ('cv2', 'boto3', 'static_ffmpeg', 'numpy') if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, '-c', statement], check=True, capture_output=True, text=True).stdout
+    assert loaded.strip() == ''
+    assert sorted(aEye.__all__) == sorted(aEye._exports)
+
+
+def test_executables_are_memoized_and_can_be_overridden(monkeypatch):
+    try:
+        ffmpeg, ffprobe = run.get_or_fetch_platform_executables_else_raise()
+        executables.reset_executables()
+        monkeypatch.setenv('AEYE_FFMPEG', ffmpeg)
+        monkeypatch.delenv('AEYE_FFPROBE', raising=False)
+        first = executables.get_executables()
+        assert first == (ffmpeg, ffprobe)
+        monkeypatch.setenv('AEYE_FFMPEG', '/elsewhere/ffmpeg')
+        assert executables.get_executables() is first
+
+        executables.set_executables('/opt/ffmpeg/bin/ffmpeg', '/opt/ffmpeg/bin/ffprobe')
+        assert executables.get_executables() == ('/opt/ffmpeg/bin/ffmpeg', '/opt/ffmpeg/bin/ffprobe')
+    finally:
+        executables.reset_executables()
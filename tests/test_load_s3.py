@@ -0,0 +1,37 @@
+from aEye.auxiliary import Aux
+from botocore.stub import Stubber
+import types
+
+"""
+S3 listing tests, with the S3 responses stubbed by botocore.
+"""
+
+
+def page(keys, token=None):
+    response = {'Contents': [{'Key': key} for key in keys], 'IsTruncated': token is not None}
+    if token is not None:
+        response['NextContinuationToken'] = token
+    return response
+
+
+def test_load_s3_reads_every_page():
+    aux = Aux()
+    with Stubber(aux._s3) as stub:
+        stub.add_response('list_objects_v2', page(['input/', 'input/a.mp4', 'input/b.MOV'], 'next'),
+                          {'Bucket': 'bucket', 'Prefix': 'input/', 'MaxKeys': 2})
+        stub.add_response('list_objects_v2', page(['input/c.txt', 'input/d.mp4']),
+                          {'Bucket': 'bucket', 'Prefix': 'input/', 'MaxKeys': 2, 'ContinuationToken': 'next'})
+        video_list = aux.load_s3('bucket', 'input/', suffix=('.mp4', '.mov'), page_size=2)
+    assert [video.title for video in video_list] == ['a.mp4', 'b.MOV', 'd.mp4']
+    assert video_list[2].key == 'input/d.mp4'
+
+
+def test_load_s3_lazy_lists_pages_on_demand():
+    aux = Aux()
+    with Stubber(aux._s3) as stub:
+        stub.add_response('list_objects_v2', page(['input/b.mp4'], 'next'),
+                          {'Bucket': 'bucket', 'Prefix': 'input/', 'MaxKeys': 1000, 'StartAfter': 'input/a.mp4'})
+        videos = aux.load_s3('bucket', 'input/', start_after='input/a.mp4', lazy=True)
+        assert isinstance(videos, types.GeneratorType)
+        # Only the first page is requested to produce the first video.
+        assert next(videos).title == 'b.mp4'
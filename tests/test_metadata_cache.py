@@ -0,0 +1,37 @@
+from aEye.auxiliary import Aux
+from aEye.cache import MetadataCache, enable_metadata_cache, disable_metadata_cache
+import os
+import subprocess
+
+"""
+metadata cache tests to ensure that probes are stored by content identity and evicted by size.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def test_metadata_cache_skips_second_probe(tmp_path, monkeypatch):
+    enable_metadata_cache(str(tmp_path / 'metadata.sqlite'))
+    try:
+        aux = Aux()
+        first = aux.load_local(input_test_video)[0]
+        assert first.get_codec() == "h264"
+
+        def no_probe(*args, **kwargs):
+            raise AssertionError("ffprobe should not run on a cache hit")
+
+        monkeypatch.setattr(subprocess, "check_output", no_probe)
+        second = aux.load_local(input_test_video)[0]
+        assert second.get_num_frames() == first.get_num_frames()
+    finally:
+        disable_metadata_cache()
+
+
+def test_metadata_cache_evicts_least_recently_used(tmp_path):
+    cache = MetadataCache(str(tmp_path / 'metadata.sqlite'), max_bytes=60)
+    cache.put("a", {"value": "x" * 10})
+    cache.put("b", {"value": "y" * 10})
+    assert cache.get("a") is not None
+    cache.put("c", {"value": "z" * 10})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": "x" * 10}
+    assert cache.get("c") is not None
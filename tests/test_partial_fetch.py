@@ -0,0 +1,68 @@
+from aEye.auxiliary import Aux
+from aEye.executables import get_executables
+from aEye.extractor import Extractor
+from aEye.labeler import Labeler
+from aEye.video import Video
+import cv2
+import json
+import numpy
+import os
+import subprocess
+
+"""
+partial fetch tests to ensure that trims and frame grabs of S3 videos only fetch the bytes around the cut.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+ffmpeg, ffprobe = get_executables()
+
+
+def long_video(tmp_path):
+    """
+    Writes a 50 second video with a keyframe every 15 frames, by looping the test video.
+    """
+    gop = str(tmp_path / 'gop.mp4')
+    source = str(tmp_path / 'long.mp4')
+    subprocess.run(f"{ffmpeg} -v error -y -i {input_test_video} -g 15 -keyint_min 15 -sc_threshold 0 {gop}",
+                   shell=True, check=True)
+    subprocess.run(f"{ffmpeg} -v error -y -stream_loop 9 -i {gop} -c copy {source}", shell=True, check=True)
+    return source
+
+
+def s3_video(source):
+    """
+    Creates an S3 video for the local source, with its metadata already known.
+    """
+    video = Video(bucket='bucket', key='input/long.mp4', title='long.mp4')
+    video.meta_data = json.loads(subprocess.check_output(
+        f"{ffprobe} -v error -show_streams -show_format -of json {source}", shell=True))
+    return video
+
+
+def test_partial_fetch_trim(tmp_path, ranged_s3):
+    source = long_video(tmp_path)
+    aux = Aux()
+    aux._s3 = ranged_s3(source)
+    video_list = Labeler(partial_fetch=True).trim_video_start_end([s3_video(source)], 20, 22)
+    output = aux.execute_label_and_write_local(video_list, str(tmp_path))
+    assert aux.execution_results[0]['returncode'] == 0
+    stream = Video(file=output[0].file, title=output[0].title).extract_metadata()['streams'][0]
+    assert int(stream['nb_frames']) == 60
+    assert aux._s3.sent < len(aux._s3.data) / 4
+
+
+def test_partial_fetch_frame_grab(tmp_path, monkeypatch, ranged_s3):
+    import aEye.storage
+    source = long_video(tmp_path)
+    client = ranged_s3(source)
+    monkeypatch.setattr(aEye.storage, '_client', client)
+    monkeypatch.chdir(tmp_path)
+    video = s3_video(source)
+    Extractor(partial_fetch=True).specific_frame_extractor(Aux(), [video], 1210)
+
+    capture = cv2.VideoCapture(source)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 1210)
+    expected = capture.read()[1]
+    capture.release()
+    image = cv2.imread(f"{video.path}/output_cv_extract_specific_frame_1210_long.png")
+    assert numpy.array_equal(image, expected)
+    assert client.sent < len(client.data) / 4
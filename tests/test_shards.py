@@ -0,0 +1,69 @@
+from aEye.auxiliary import Aux
+from aEye.extractor import Extractor
+from aEye.video import Video
+import cv2
+import json
+import numpy
+import os
+import tarfile
+
+"""
+shard output tests to ensure that frames of many videos end up in a few indexed archives.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def read_index(folder, files):
+    return [json.loads(line) for name in files if name.endswith('.jsonl')
+            for line in open(os.path.join(folder, name))]
+
+
+def test_tar_shards_are_capped_indexed_and_uploaded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    aux = Aux()
+    videos = [Video(file=input_test_video, title=f'clip{i}.mp4') for i in range(2)]
+    extractor = Extractor(image_format='jpeg', quality=80, output='tar', shard_bytes=200 * 1024)
+    extractor.multiple_frame_extractor(aux, videos, 0, 30)
+    folder = aux._local_path
+    shards = [name for name in aux.shard_files if name.endswith('.tar')]
+    assert len(shards) > 1 and sorted(os.listdir(folder)) == sorted(aux.shard_files)
+    assert all(os.path.getsize(os.path.join(folder, name)) <= 200 * 1024 + 64 * 1024 for name in shards)
+    index = read_index(folder, aux.shard_files)
+    assert len(index) == 60 and extractor.write_stats['images'] == 60
+    entry = next(e for e in index if e['video'] == 'clip1.mp4' and e['frame'] == 12)
+    with open(os.path.join(folder, entry['shard']), 'rb') as f:
+        f.seek(entry['offset'])
+        image = cv2.imdecode(numpy.frombuffer(f.read(entry['size']), numpy.uint8), cv2.IMREAD_COLOR)
+    assert image.shape == (360, 486, 3)
+    with tarfile.open(os.path.join(folder, entry['shard'])) as tar:
+        assert json.load(tar.extractfile(entry['key'] + '.json'))['frame'] == 12
+
+    uploaded = []
+    written = list(aux.shard_files)
+    failing = f'frames/{written[0]}'
+    monkeypatch.setattr(aux, '_upload_file', lambda file_path, bucket, key, config=None:
+                        uploaded.append(key) or {'key': key, 'error': 'failed' if key == failing else None})
+    aux.upload_s3([], 'bucket', prefix='frames/')
+    assert sorted(uploaded) == sorted('frames/' + name for name in written)
+    # Only the shard that failed is uploaded again.
+    assert aux.shard_files == written[:1]
+    aux.upload_s3([], 'bucket', prefix='frames/')
+    assert uploaded[len(written):] == [failing]
+
+
+def test_npz_shards_hold_raw_frames(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    aux = Aux()
+    video = Video(file=input_test_video, title='test_video.mp4')
+    Extractor(output='npz').specific_frame_extractor(aux, [video], [5, 90])
+    index = read_index(aux._local_path, aux.shard_files)
+    assert [entry['frame'] for entry in index] == [5, 90]
+    frames = numpy.load(os.path.join(aux._local_path, index[1]['shard']))
+    capture = cv2.VideoCapture(input_test_video)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 90)
+    assert numpy.array_equal(frames[index[1]['key']], capture.read()[1])
+    for entry in index:
+        with open(os.path.join(aux._local_path, entry['shard']), 'rb') as f:
+            f.seek(entry['offset'])
+            image = numpy.frombuffer(f.read(entry['size']), entry['dtype']).reshape(entry['shape'])
+        assert numpy.array_equal(image, frames[entry['key']])
@@ -0,0 +1,107 @@
+from aEye.video import Video
+from aEye.cache import SourceCache, enable_source_cache, disable_source_cache
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+import boto3
+import io
+import os
+import pytest
+
+"""
+source cache tests to ensure that S3 objects are downloaded once per ETag and evicted by size.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+with open(input_test_video, 'rb') as video_file:
+    video_data = video_file.read()
+
+
+def s3_client():
+    return boto3.client('s3', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+
+
+def expect_head(stub, key, etag, version=None, params=None):
+    """
+    Answers one HEAD of the key with the test video's size.
+    """
+    response = {'ETag': etag, 'ContentLength': len(video_data)}
+    if version is not None:
+        response['VersionId'] = version
+    stub.add_response('head_object', response, dict(params or {}, Bucket='bucket', Key=key))
+
+
+def expect_download(stub, key, etag, version=None, changed_to=None):
+    """
+    Answers the HEAD of the cache, and the HEAD and GET of the transfer, with the test video. The transfer has
+    to ask for the version, if there is one. Without a version, the ETag is checked once more after the
+    download, and it is changed_to if that is set.
+    """
+    pinned = {'VersionId': version} if version is not None else {}
+    expect_head(stub, key, etag, version)
+    expect_head(stub, key, etag, version, pinned)
+    stub.add_response('get_object', {'ETag': etag, 'ContentLength': len(video_data),
+                                     'Body': StreamingBody(io.BytesIO(video_data), len(video_data))},
+                      dict(pinned, Bucket='bucket', Key=key))
+    if version is None:
+        expect_head(stub, key, changed_to or etag)
+
+
+def test_source_cache_downloads_each_object_once(tmp_path, monkeypatch):
+    import aEye.cache
+    import aEye.storage
+    client = s3_client()
+    monkeypatch.setattr(aEye.storage, '_client', client)
+    now = [1000.0]
+    monkeypatch.setattr(aEye.cache.time, 'time', lambda: now[0])
+    enable_source_cache(str(tmp_path))
+    try:
+        with Stubber(client) as stub:
+            video = Video(bucket='bucket', key='input/test_video.mp4', title='test_video.mp4')
+            expect_download(stub, 'input/test_video.mp4', '"v1"')
+            assert video.extract_metadata()['streams'][0]['codec_name'] == "h264"
+            # The ETag was just checked, so the copy is used without asking S3 again.
+            first = video.get_presigned_url()
+            assert os.path.dirname(first) == str(tmp_path)
+            stub.assert_no_pending_responses()
+
+            expect_head(stub, 'input/test_video.mp4', '"v1"')
+            now[0] += aEye.cache.ETAG_SECONDS + 1
+            assert video.get_presigned_url() == first
+
+            # A new version is new content, so it is downloaded again, pinned to its version id.
+            now[0] += aEye.cache.ETAG_SECONDS + 1
+            expect_download(stub, 'input/test_video.mp4', '"v2"', version='2')
+            second = video.get_presigned_url()
+            assert second != first and os.path.getsize(second) == len(video_data)
+            stub.assert_no_pending_responses()
+        assert aEye.cache.get_source_cache()._locks == {}
+    finally:
+        disable_source_cache()
+
+
+def test_source_cache_discards_objects_that_change_during_download(tmp_path):
+    client = s3_client()
+    cache = SourceCache(str(tmp_path))
+    with Stubber(client) as stub:
+        expect_download(stub, 'a.mp4', '"v1"', changed_to='"v2"')
+        with pytest.raises(IOError):
+            cache.fetch(client, 'bucket', 'a.mp4')
+    assert os.listdir(tmp_path) == []
+
+
+def test_source_cache_evicts_least_recently_used(tmp_path):
+    client = s3_client()
+    size = len(video_data)
+    cache = SourceCache(str(tmp_path), max_bytes=2 * size)
+    with Stubber(client) as stub:
+        for key in ('a.mp4', 'b.mp4'):
+            expect_download(stub, key, '"v1"')
+        first = cache.fetch(client, 'bucket', 'a.mp4')
+        second = cache.fetch(client, 'bucket', 'b.mp4')
+        os.utime(first, (0, 0))
+        os.utime(second, (1, 1))
+        expect_download(stub, 'c.mp4', '"v1"')
+        third = cache.fetch(client, 'bucket', 'c.mp4')
+        stub.assert_no_pending_responses()
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(second), os.path.basename(third)])
@@ -0,0 +1,56 @@
+from aEye import storage
+from aEye.video import Video
+
+"""
+S3 access layer tests to ensure that the client is shared and presigned urls are reused until close to expiry.
+"""
+
+
+def test_presigned_urls_are_cached_until_close_to_expiry(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    storage.configure_s3(max_pool_connections=8, region_name='us-east-1')
+    try:
+        client = storage.get_s3_client()
+        assert client is storage.get_s3_client()
+        assert client.meta.config.max_pool_connections == 8
+        assert client.meta.config.retries['mode'] == 'adaptive'
+
+        now = [1000.0]
+        signed = []
+        sign = client.generate_presigned_url
+        monkeypatch.setattr(storage.time, 'time', lambda: now[0])
+        monkeypatch.setattr(client, 'generate_presigned_url', lambda **kwargs: signed.append(kwargs) or sign(**kwargs))
+        video = Video(bucket='bucket', key='input/a.mp4', title='a.mp4')
+        url = video.get_presigned_url()
+        assert video.get_presigned_url(time=2) == url
+        assert 'input/b.mp4' in storage.presigned_url('bucket', 'input/b.mp4')
+        assert len(signed) == 2
+
+        # A url with less than a quarter of its lifetime left is signed again.
+        now[0] += storage.URL_LIFETIME * 0.8
+        video.get_presigned_url()
+        assert len(signed) == 3
+    finally:
+        storage.configure_s3()
+
+
+def test_presigned_url_cache_drops_expired_and_least_recently_used_urls(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    storage.configure_s3(region_name='us-east-1')
+    try:
+        now = [1000.0]
+        monkeypatch.setattr(storage.time, 'time', lambda: now[0])
+        monkeypatch.setattr(storage, 'MAX_URLS', 2)
+        for key in ('a.mp4', 'b.mp4'):
+            storage.presigned_url('bucket', key)
+        storage.presigned_url('bucket', 'a.mp4')
+        storage.presigned_url('bucket', 'c.mp4')
+        assert [key for _, key in storage._presigned_urls] == ['a.mp4', 'c.mp4']
+
+        now[0] += storage.URL_LIFETIME
+        storage.presigned_url('bucket', 'd.mp4')
+        assert [key for _, key in storage._presigned_urls] == ['d.mp4']
+    finally:
+        storage.configure_s3()
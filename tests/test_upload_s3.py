@@ -0,0 +1,53 @@
+from aEye.auxiliary import Aux
+from aEye.labeler import Labeler
+from botocore.stub import Stubber
+import os
+
+"""
+Upload tests, with the S3 responses stubbed by botocore.
+"""
+input_test_video = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data/test_video.mp4')
+
+
+def test_execute_uploads_each_output_when_it_is_written(tmp_path):
+    aux = Aux()
+    video_list = Labeler().trim_video_start_end(aux.load_local(input_test_video), 0, 1)
+    with Stubber(aux._s3) as stub:
+        stub.add_response('put_object', {'ETag': '"abc"'})
+        stub.add_response('head_object', {'ETag': '"abc"', 'ContentLength': 1},
+                          {'Bucket': 'bucket', 'Key': 'modified/trimmed_0_to_1_test_video.mp4'})
+        output = aux.execute_label_and_write_local(video_list, str(tmp_path), bucket='bucket')
+        stub.assert_no_pending_responses()
+    result = aux.upload_results[0]
+    assert result['key'] == 'modified/trimmed_0_to_1_test_video.mp4'
+    assert result['etag'] == '"abc"'
+    assert result['bytes'] == os.path.getsize(output[0].file)
+    assert result['error'] is None
+
+
+def test_upload_s3_reports_failures(tmp_path, caplog):
+    aux = Aux()
+    video_list = aux.load_local(input_test_video)
+    aux.set_local_path(str(tmp_path))
+    results = aux.upload_s3(video_list, 'bucket')
+    assert results[0]['key'] == 'modified/test_video.mp4'
+    assert results[0]['etag'] is None
+    assert results[0]['error'] is not None
+    assert "1 of 1 files failed to upload to s3://bucket/modified/: modified/test_video.mp4" in caplog.text
+
+
+def test_execute_passes_upload_settings_through(tmp_path, monkeypatch):
+    from boto3.s3.transfer import TransferConfig
+    aux = Aux()
+    video_list = Labeler().trim_video_start_end(aux.load_local(input_test_video), 0, 1)
+    config = TransferConfig(max_concurrency=2)
+    configs = []
+    upload = aux._upload_file
+    monkeypatch.setattr(aux, '_upload_file', lambda *args: configs.append(args[3]) or upload(*args))
+    with Stubber(aux._s3) as stub:
+        stub.add_response('put_object', {'ETag': '"abc"'})
+        stub.add_response('head_object', {'ETag': '"abc"', 'ContentLength': 1})
+        aux.execute_label_and_write_local(video_list, str(tmp_path), bucket='bucket', upload_workers=1,
+                                          transfer_config=config)
+    assert configs == [config]
+    assert aux.upload_results[0]['error'] is None